@@ -76,7 +76,7 @@ class BinnedSummaries(object):
         :rtype: float
         """
         current_bin_idx = self._binned_idx[self._bins == bin_num][0]
-        return np.mean(self._observation.obs[current_bin_idx])
+        return np.mean(self._observation.obs[current_bin_idx], dtype=np.float64)
 
     def stdmean_obs_in_bin(self, bin_num):
         """Return the standardized mean of the observation in bin_num.
@@ -87,8 +87,9 @@ class BinnedSummaries(object):
         :rtype: float
         """
         current_bin_idx = self._binned_idx[self._bins == bin_num][0]
-        obs_var = np.var(self._observation.obs[current_bin_idx])
-        obs_mean = np.mean(self._observation.obs[current_bin_idx])
+        # accumulate in double precision, also when the observations are float32
+        obs_var = np.var(self._observation.obs[current_bin_idx], dtype=np.float64)
+        obs_mean = np.mean(self._observation.obs[current_bin_idx], dtype=np.float64)
         if obs_var > 0.:
             return obs_mean/np.sqrt(obs_var)
         else:
@@ -114,8 +115,7 @@ class BinnedSummaries(object):
         :rtype: ndarray of float
         """
         current_bin_idx = self._binned_idx[self._bins == bin_num][0]
-        ires_in_bin = self._observation.ires[current_bin_idx]
-        return np.mean(1./(ires_in_bin * ires_in_bin))
+        return np.mean(self._observation.invresolsq()[current_bin_idx], dtype=np.float64)
 
     def bin_args_in_icering(self, ice_ring):
         """Return the indices of bins appearing in the ice ring range, partially included.
@@ -13,12 +13,30 @@ from tensorflow import keras, image, convert_to_tensor
 tf.get_logger().setLevel('ERROR')
 
 import os
+import threading
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 current_path = os.path.dirname(__file__)
 
-model = None
 ice_ranges = None
+# the models are loaded once per process and shared by all threads
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_models():
+    """
+    Loads the resolution ranges and the Iobs and Fobs models on first use. Thread-safe.
+    :return: ice_ranges, {'Iobs': model, 'Fobs': model}
+    """
+    global ice_ranges
+    with _models_lock:
+        if not _models:
+            ice_ranges = np.genfromtxt(os.path.join(current_path, "Helcaraxe_models/Auspex_ranges.csv"), delimiter=';')
+            for name in ('Iobs', 'Fobs'):
+                _models[name] = keras.models.load_model(
+                    os.path.join(current_path, "Helcaraxe_models/final_models/Helcaraxe_{0}_model".format(name)))
+    return ice_ranges, _models
 
 
 def cnn_predict(i_res, i_obs, f_res, f_obs):
@@ -30,7 +48,8 @@ def cnn_predict(i_res, i_obs, f_res, f_obs):
 
     All parameters have to have the same length! The index of the list is relevant.
 
-    :var model: Convolutional Neural Network (CNN) model, input shape: [80,80,1], output: float between 0 or 1
+    The Iobs and Fobs models are Convolutional Neural Network (CNN) models, input shape: [80,80,1], output: float
+    between 0 or 1. They are loaded once by load_models and passed to predictor, so concurrent calls are safe.
     :return[0] I_prediction_lst: list of predictions, index is refering to ice_ranges.
     :return[1] F_prediction_lst: list of predictions, index is refering to ice_ranges.
      Possible Predictions:
@@ -39,12 +58,7 @@ def cnn_predict(i_res, i_obs, f_res, f_obs):
         float (0 -> 1) = classification of the model, 0 = no ice ring, 1 = ice ring
     """
     # loading resolution ranges and models
-    global ice_ranges
-    global model
-
-    ice_ranges = np.genfromtxt(os.path.join(current_path, "Helcaraxe_models/Auspex_ranges.csv"), delimiter=';')
-    model_iobs = keras.models.load_model(os.path.join(current_path, "Helcaraxe_models/final_models/Helcaraxe_Iobs_model"))
-    model_fobs = keras.models.load_model(os.path.join(current_path, "Helcaraxe_models/final_models/Helcaraxe_Fobs_model"))
+    ranges, models = load_models()
     I_prediction_lst, F_prediction_lst = None, None
 
     # Raises Exception if no f_obs or i_obs values
@@ -53,19 +67,17 @@ def cnn_predict(i_res, i_obs, f_res, f_obs):
 
     # Takes I_obs value if available and returns list of models prediction
     if i_obs is not None and i_res is not None:
-        model = model_iobs
-        I_plot_lst, I_del_list = plot_generator(i_res, i_obs, ice_ranges)
+        I_plot_lst, I_del_list = plot_generator(i_res, i_obs, ranges)
         if I_plot_lst is not None and I_del_list is not None:
-            I_prediction_lst = predictor(I_plot_lst, I_del_list)
+            I_prediction_lst = predictor(I_plot_lst, I_del_list, models['Iobs'])
         else:
             raise Exception("Invalid Input")
 
     # Takes F_obs value if avaible and returns list of models prediction
     if f_obs is not None and f_res is not None:
-        model = model_fobs
-        F_plot_lst, F_del_list = plot_generator(f_res, f_obs, ice_ranges)
+        F_plot_lst, F_del_list = plot_generator(f_res, f_obs, ranges)
         if F_plot_lst is not None and F_del_list is not None:
-            F_prediction_lst = predictor(F_plot_lst, F_del_list)
+            F_prediction_lst = predictor(F_plot_lst, F_del_list, models['Fobs'])
         else:
             raise Exception("Invalid Input")
 
@@ -139,10 +151,11 @@ def plot_generator(res_lst, y_lst, ice_ranges):
         return None, None
 
 
-def predictor(plot_lst, del_lst):
+def predictor(plot_lst, del_lst, model):
     """
     calls a helcarxe model for prediction
     :param plot_lst: list of 3D plots, shape: [None,80,80,1]
+    :param model: the Iobs or Fobs model
     :return: predict_dict[PDB_ID], numpy.ndarray
     """
     # iniates prediction_lst
@@ -368,15 +368,24 @@ class NemoHandler(object):
                                    & (self._refl_data.resolution > 10.)).flatten()
         return ind_weak
 
+    def keep_mask(self) -> np.ndarray[bool]:
+        """Return a mask over all rows of the original records which is False for NEMOs.
+
+        :return: Keep-mask, True for rows which are not NEMOs.
+        :rtype: Nx1 numpy.ndarray(dtype=bool)
+        """
+        assert self._original_row_ind is not None
+        keep = np.ones(self._refl_data.hkl.shape[0], dtype=bool)
+        keep[self._original_row_ind] = False
+        return keep
+
     def NEMO_removal(self, filename: str):
         """Remove NEMOs from the given dataset and write into a new one. Current supported format: mtz.
+        The reflection data are not modified.
 
         :param filename: The output path or file name.
         """
-        assert self._original_row_ind is not None
-        isel = flex.size_t(self._original_row_ind)
-        self._refl_data._obj.delete_reflections(isel)
-        self._refl_data._obj.write(filename)
+        self._refl_data.write_filtered({filename: self.keep_mask()})
 
     def write_filter_hkl(self, integrate_hkl_plain: PlainASCII.IntegrateHKLPlain, hkl_array: np.ndarray):
         """Generate FILTER.HKL for XDS. FILTER.HKL will be written to pwd.
@@ -481,8 +490,8 @@ def cumprob_c_intensity(e_square, sig):
 
 
 def construct_ih_table(obs, inv_res_sqr):
-    obs_ext = obs[None, :] * np.ones(obs.size)[:, None]
-    inv_res_sqr_ext = inv_res_sqr[None, :] * np.ones(inv_res_sqr.size)[:, None]
+    obs_ext = obs[None, :] * np.ones(obs.size, dtype=obs.dtype)[:, None]
+    inv_res_sqr_ext = inv_res_sqr[None, :] * np.ones(inv_res_sqr.size, dtype=inv_res_sqr.dtype)[:, None]
     obs_ih_table = delete_diag(obs_ext)
     inv_res_sqr_ih_table = delete_diag(inv_res_sqr_ext)
     return obs_ih_table, inv_res_sqr_ih_table
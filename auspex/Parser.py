@@ -1,6 +1,7 @@
 import sys
 import os
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from argparse import RawTextHelpFormatter
 from os.path import exists, basename, splitext
 from Plotter import PlotGenerator
@@ -8,7 +9,9 @@ from auspex import __version__
 from Auspex import IceFinder
 from IceRings import IceRing
 from NEMO import NemoHandler
-from ReflectionData.AutoReader import FileReader
+from ReflectionData.AutoReader import FileReader, inspect_file
+from ReflectionData.Compression import is_in_memory, load_reflection_source, strip_compression_suffix
+from ReflectionData.ReflectionCache import save_parsed
 from ReflectionData.PlainASCII import IntegrateHKLPlain
 from Verbose import MergeStatistics, suppress_warnings, auspex_init, report_ice_ring
 
@@ -26,7 +29,8 @@ parser.add_argument(
     metavar='HKLIN',
     type=str,
     nargs=1,
-    help='The file to be analyzed. Can be one of mtz, XDS HKL, cif, scalepack and SHLEX hkl.'
+    help='The file to be analyzed. Can be one of mtz, XDS HKL, cif, scalepack and SHLEX hkl. '
+         'Use - to read it from the standard input.'
 )
 
 parser.add_argument(
@@ -174,7 +178,7 @@ parser.add_argument(
     dest='nemo_removal',
     action='store_true',
     default=False,
-    help='Remove beamstop shadow outliers from the given HKLIN. Currently only support mtz format.'
+    help='Remove beamstop shadow outliers from the given HKLIN. Currently only support mtz and XDS_ASCII.HKL format.'
 )
 
 parser.add_argument(
@@ -186,32 +190,88 @@ parser.add_argument(
          'The path to INTEGRATED.HKL must be provided.'
 )
 
+parser.add_argument(
+    '--cache-dir',
+    dest='cache_dir',
+    type=str,
+    default=None,
+    help='Directory to keep the parsed reflection data in. Later runs on the same file load the parsed data '
+         'from there instead of parsing the file again.'
+)
+
+parser.add_argument(
+    '--precision',
+    dest='precision',
+    choices=['float32', 'float64'],
+    default=None,
+    help='Float type of observations, sigmas and resolutions in the analysis. float32 halves the memory traffic on '
+         'large unmerged data; sums are still accumulated in float64. By default the data are kept in the type they '
+         'are read in.'
+)
+
+parser.add_argument(
+    '--streaming',
+    dest='streaming',
+    action='store_true',
+    default=False,
+    help='Read XDS_ASCII files block by block and keep only the merged reflections and the sums needed for the '
+         'merging statistics, so that memory does not grow with the number of observations. The analysis is then '
+         'done on the merged reflections.'
+)
+
+parser.add_argument(
+    '--split-datasets',
+    dest='split_datasets',
+    action='store_true',
+    default=False,
+    help='Analyse each crystal/dataset of a multi-dataset mtz file, e.g. of a MAD experiment, or each data block of '
+         'a multi-block cif file separately with its own cell. The plots are named after the datasets or blocks. '
+         'Cannot be combined with --nemo-removal or --generate-xds-filter, which apply to the whole file.'
+)
+
+parser.add_argument(
+    '--workers',
+    dest='workers',
+    type=int,
+    default=None,
+    help='Number of datasets or blocks analysed in parallel with --split-datasets. '
+         'Default: one per CPU core, at most 32.'
+)
+
+parser.add_argument(
+    '--inspect',
+    dest='inspect',
+    action='store_true',
+    default=False,
+    help='Only print the cell, space group, column labels, number of reflections and resolution range read from '
+         'the header of HKLIN, without reading the reflections.'
+)
+
 args = parser.parse_args()
+if args.split_datasets and (args.nemo_removal or args.xds_filter):
+    parser.error('--split-datasets cannot be combined with --nemo-removal or --generate-xds-filter.')
 filename = args.hklin[0]
 output_directory = args.directory
+if filename == '-':
+    # HKLIN is read from the standard input once. output files are named after stdin.
+    hklin = load_reflection_source(filename)
+    filename = 'stdin'
+else:
+    hklin = filename
 
-auspex_init(__version__, command_line)
+if args.inspect:
+    for key, value in inspect_file(hklin, args.input_type).items():
+        print('{0:<20s}: {1}'.format(key, value))
+    sys.exit(0)
 
-if exists(filename):
-    # Original line
-    # share = os.path.join(sysconfig.PREFIX, 'share')
-    # For CCP4:
-    #share = os.path.join(os.environ['AUSPEX_INSTALL_BASE'], 'share')
-    #auspex_package_dir = os.path.join(share, 'auspex')
-    #auspex_package_data_dir = os.path.join(auspex_package_dir, 'data')
 
-    # Handling icerings
-    ice = IceRing()
-    reflection_data = FileReader(filename, args.input_type, args.unit_cell, args.space_group_number)
-    print(reflection_data.source_data_format)
-    if reflection_data.source_data_format in ('xds_hkl', 'shlex_hkl'):
-        #try:
-        reflection_data.group_by_redundancies()
-        merge_stats = MergeStatistics(reflection_data.merge_stats_binned(), reflection_data.merge_stats_overall())
-        merge_stats.print_stats_table()
-        #except:
-         #   pass
+def analyse_dataset(reflection_data, ice: IceRing):
+    """Find ice rings and, if requested, beamstop shadow outliers in one dataset.
 
+    :param reflection_data: Parsed reflection data.
+    :param ice: Ice ring ranges.
+    :return: ice_info, nemo_info_F, nemo_info_I
+    """
     ice_info = IceFinder(reflection_data, ice, use_anom_if_present=args.use_anom_if_present)
     if args.helcaraxe is True:
         ice_info.run_helcaraxe()
@@ -227,52 +287,31 @@ if exists(filename):
             ice_info.binning('I', binning=args.binning)
 
     # Handling beamstop shadow outliers
+    nemo_info_F = None
+    nemo_info_I = None
     if args.beamstop_outlier:
         if ice_info.fobs is not None:
             nemo_info_F = NemoHandler()
             nemo_info_F.refl_data_prepare(ice_info._reflection_data, 'FP')
             #nemo_info_F.cluster_detect(0)
             nemo_info_F.get_nemo_row_ind()
-        else:
-            nemo_info_F = None
         if ice_info.iobs is not None:
             nemo_info_I = NemoHandler()
             nemo_info_I.refl_data_prepare(ice_info._reflection_data, 'I')
             #nemo_info_I.cluster_detect(0)
             nemo_info_I.get_nemo_row_ind()
-        else:
-            nemo_info_I = None
+    return ice_info, nemo_info_F, nemo_info_I
 
-        if args.nemo_removal:
-            if reflection_data.source_data_format is not "mtz":
-                print("NEMO removal can only be applied to MTZ. The format of HKLIN provided is: {0}".format(reflection_data.source_data_format))
-            else:
-                if ice_info.fobs is not None:
-                    nemo_info_F.add_false_sigma_record_back()
-                    nemo_info_F.NEMO_removal(filename[:-4] + '_F_nemo_removed.mtz')
-                if ice_info.iobs is not None:
-                    nemo_info_I.add_false_sigma_record_back()
-                    nemo_info_I.NEMO_removal(filename[:-4] + '_I_nemo_removed.mtz')
-
-        if args.xds_filter:
-            from auspex.ReflectionData import PlainASCII
-            # try fobs first since NEMO detection is more accurate with fobs.
-            hkl_plain_filename = args.xds_filter[0]
-            if ice_info.fobs is not None:
-                hkl_nemo = nemo_info_F.get_nemo_indices()
-                hkl_plain = IntegrateHKLPlain()
-                hkl_plain.read_hkl(hkl_plain_filename)
-                nemo_info_F.write_filter_hkl(hkl_plain, hkl_nemo)
-            elif ice_info.iobs is not None:
-                hkl_nemo = nemo_info_I.get_nemo_indices()
-                hkl_plain = IntegrateHKLPlain()
-                hkl_plain.read_hkl(hkl_plain_filename)
-                nemo_info_I.write_filter_hkl(hkl_plain, hkl_nemo)
-    else:
-        nemo_info_F = None
-        nemo_info_I = None
 
+def report_dataset(ice_info: IceFinder, nemo_info_F: NemoHandler, nemo_info_I: NemoHandler, name_stub: str):
+    """Report the ice ring score and plot the results of one dataset.
 
+    :param ice_info: Ice ring results.
+    :param nemo_info_F: Beamstop shadow outliers found with amplitudes, or None.
+    :param nemo_info_I: Beamstop shadow outliers found with intensities, or None.
+    :param name_stub: Stub of the names of the plot files.
+    :return: None
+    """
     # Write a text file
     #if args.text_filename is not None:
     #    ice_info.WriteTextFile(args.text_filename)
@@ -290,7 +329,6 @@ if exists(filename):
         no_individual_figures=args.no_individual_figures,
         cutoff=args.cutoff,
         no_automatic=args.no_automatic)
-    name_stub = splitext(basename(filename))[0]
 
     plot.name_stub = name_stub  # = join(output_directory, "%s.png" % )
 
@@ -304,6 +342,90 @@ if exists(filename):
         outfile = open("mtz_with_ice_rings.txt", "a")
         print(os.path.split(filename)[1], file=outfile)
 
+
+auspex_init(__version__, command_line)
+
+if is_in_memory(hklin) or exists(hklin):
+    # Original line
+    # share = os.path.join(sysconfig.PREFIX, 'share')
+    # For CCP4:
+    #share = os.path.join(os.environ['AUSPEX_INSTALL_BASE'], 'share')
+    #auspex_package_dir = os.path.join(share, 'auspex')
+    #auspex_package_data_dir = os.path.join(auspex_package_dir, 'data')
+
+    # Handling icerings
+    ice = IceRing()
+    reflection_data = FileReader(hklin, args.input_type, args.unit_cell, args.space_group_number,
+                                 cache_dir=args.cache_dir, precision=args.precision, streaming=args.streaming)
+    print(reflection_data.source_data_format)
+    if reflection_data.source_data_format in ('xds_hkl', 'shlex_hkl', 'sca_unmerged'):
+        #try:
+        if reflection_data.hkl_by_multiplicity is None and not getattr(reflection_data, 'streaming', False):
+            reflection_data.group_by_redundancies()
+            if args.cache_dir is not None and not is_in_memory(hklin):
+                # keep the grouped observations in the cache as well. the file digest of FileReader is reused.
+                save_parsed(reflection_data, filename, args.cache_dir,
+                            args.input_type, args.unit_cell, args.space_group_number, args.precision, args.streaming)
+        merge_stats = MergeStatistics(reflection_data.merge_stats_binned(), reflection_data.merge_stats_overall())
+        merge_stats.print_stats_table()
+        #except:
+         #   pass
+
+    name_stub = splitext(basename(strip_compression_suffix(filename)))[0]
+    datasets = {}
+    if args.split_datasets and reflection_data.source_data_format in ('mtz', 'cif'):
+        datasets = reflection_data.split_datasets()
+    if len(datasets) > 1:
+        # the datasets are analysed in parallel. numpy and tensorflow release the GIL in the heavy parts, and the
+        # Helcaraxe models are loaded once and shared read-only by the threads.
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            analyses = list(pool.map(lambda _: analyse_dataset(_, ice), datasets.values()))
+        for dataset_name, (ice_info, nemo_info_F, nemo_info_I) in zip(datasets, analyses):
+            print(dataset_name)
+            report_dataset(ice_info, nemo_info_F, nemo_info_I,
+                           '{0}_{1}'.format(name_stub, dataset_name.replace('/', '_')))
+    else:
+        ice_info, nemo_info_F, nemo_info_I = analyse_dataset(reflection_data, ice)
+        if args.beamstop_outlier:
+            if args.nemo_removal:
+                if reflection_data.source_data_format == 'xds_hkl':
+                    # fobs first since NEMO detection is more accurate with fobs.
+                    nemo_info = nemo_info_F if ice_info.fobs is not None else nemo_info_I
+                    if nemo_info is not None:
+                        reflection_data.write_filtered(hklin, splitext(strip_compression_suffix(filename))[0] + '_nemo_removed.HKL',
+                                                       nemo_info.get_nemo_indices())
+                elif reflection_data.source_data_format != "mtz":
+                    print("NEMO removal can only be applied to MTZ and XDS_ASCII.HKL. The format of HKLIN provided is: {0}".format(reflection_data.source_data_format))
+                else:
+                    # all filtered files are written in one pass over the reflections
+                    keep_masks = {}
+                    if ice_info.fobs is not None:
+                        nemo_info_F.add_false_sigma_record_back()
+                        keep_masks[splitext(strip_compression_suffix(filename))[0] + '_F_nemo_removed.mtz'] = nemo_info_F.keep_mask()
+                    if ice_info.iobs is not None:
+                        nemo_info_I.add_false_sigma_record_back()
+                        keep_masks[splitext(strip_compression_suffix(filename))[0] + '_I_nemo_removed.mtz'] = nemo_info_I.keep_mask()
+                    reflection_data.write_filtered(keep_masks)
+
+            if args.xds_filter:
+                from auspex.ReflectionData import PlainASCII
+                # only the columns needed to write FILTER.HKL
+                integrate_hkl_filter_columns = ['H', 'K', 'L', 'XCAL', 'YCAL', 'ZCAL', 'CORR', 'XOBS', 'YOBS', 'ZOBS']
+                # try fobs first since NEMO detection is more accurate with fobs.
+                hkl_plain_filename = args.xds_filter[0]
+                if ice_info.fobs is not None:
+                    hkl_nemo = nemo_info_F.get_nemo_indices()
+                    hkl_plain = IntegrateHKLPlain()
+                    hkl_plain.read_hkl(hkl_plain_filename, columns=integrate_hkl_filter_columns)
+                    nemo_info_F.write_filter_hkl(hkl_plain, hkl_nemo)
+                elif ice_info.iobs is not None:
+                    hkl_nemo = nemo_info_I.get_nemo_indices()
+                    hkl_plain = IntegrateHKLPlain()
+                    hkl_plain.read_hkl(hkl_plain_filename, columns=integrate_hkl_filter_columns)
+                    nemo_info_I.write_filter_hkl(hkl_plain, hkl_nemo)
+
+        report_dataset(ice_info, nemo_info_F, nemo_info_I, name_stub)
+
 else:
     print("File {0} does not exist.".format(filename))
 
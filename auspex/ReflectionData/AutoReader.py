@@ -1,47 +1,249 @@
-from iotbx.cif import CifParserError
 
-from . import Cif, Mtz, Xds, Dials, Shlex
+import io
+import re
+from typing import Any, Dict
 
+import numpy as np
 
-def FileReader(file_name: str, file_type: str = None, *args):
+from . import Cif, Mtz, MtzMap, Xds, Dials, Sca, Shlex, PlainASCII
+from .Compression import compression_suffix, is_in_memory, load_reflection_source, open_reflection_file, source_name, \
+    strip_compression_suffix
+from .ReflectionCache import file_digest, load_parsed, save_parsed
+
+# number of bytes read to recognise the format of a file
+_probe_size = 4096
+
+# a SHELX HKLF record: h, k, l in 3I4, then I and sigma(I) in 2F8
+_shelx_record = re.compile(rb'^[ -]*\d+[ -]+\d+[ -]+\d+ +-?\d*\.?\d+ +-?\d*\.?\d+')
+
+
+def probe_file(file_name: str) -> Dict[str, Any]:
+    """Recognise the format of a reflection file from its first few KB, without parsing it.
+
+    Recognised formats are mtz ('MTZ ' stamp), xds_hkl (!FORMAT=XDS_ASCII), integrate_hkl (!OUTPUT_FILE=INTEGRATE.HKL),
+    refl (msgpack dials::af::reflection_table), cif (data_ block), sca (scalepack) and shlex_hkl (SHELX HKLF 3I4,2F8).
+
+    :param file_name: The name or path of the input file, or in-memory input as accepted by FileReader. Compressed
+                      files are probed after decompression.
+    :return: 'format' (None if not recognised), 'compression' and the header items found in the probed bytes.
+    :rtype: dict
+    """
+    file_name = load_reflection_source(file_name)
+    with open_reflection_file(file_name, 'rb') as f:
+        head = f.read(_probe_size)
+    probe = {'format': None, 'compression': compression_suffix(file_name)}
+    if head[:4] == b'MTZ ':
+        probe['format'] = 'mtz'
+        probe['byte_order'] = '>' if (head[8] >> 4) == 1 else '<'
+        header_word = int(np.frombuffer(head[4:8], dtype=probe['byte_order'] + 'i4')[0])
+        if header_word == -1:  # 64-bit header position
+            header_word = int(np.frombuffer(head[12:20], dtype=probe['byte_order'] + 'i8')[0])
+        probe['header_offset'] = (header_word - 1) * 4
+    elif b'dials::af::reflection_table' in head[:64]:
+        probe['format'] = 'refl'
+        try:
+            probe.update(Dials.read_table_header(io.BytesIO(head), column_names=False))
+        except AssertionError:
+            pass
+    elif head.startswith(b'!'):
+        header = {}
+        for line in head.split(b'\n'):
+            if not line.startswith(b'!') or line.startswith(b'!END_OF_HEADER'):
+                break
+            header.update(Xds._parse_header_line(line.decode('ascii', 'replace')))
+        if header.get('FORMAT') == 'XDS_ASCII':
+            probe['format'] = 'xds_hkl'
+        elif header.get('OUTPUT_FILE') == 'INTEGRATE.HKL':
+            probe['format'] = 'integrate_hkl'
+        if 'SPACE_GROUP_NUMBER' in header:
+            probe['space_group_number'] = int(header['SPACE_GROUP_NUMBER'])
+        if 'UNIT_CELL_CONSTANTS' in header:
+            probe['unit_cell'] = tuple(float(_) for _ in header['UNIT_CELL_CONSTANTS'].split())
+        for key, name in (('MERGE', 'merge'), ("FRIEDEL'S_LAW", 'friedels_law')):
+            if key in header:
+                probe[name] = header[key] == 'TRUE'
+    else:
+        lines = [_ for _ in head.split(b'\n')[:-1] if _.strip()]
+        first = next((_.strip() for _ in lines if not _.lstrip().startswith(b'#')), b'')
+        if first.startswith(b'data_'):
+            probe['format'] = 'cif'
+            probe['block'] = first[5:].split()[0].decode('ascii', 'replace') if len(first) > 5 else ''
+        elif len(lines) > 2 and lines[1].split() == [b'-987']:
+            # merged scalepack: the cell and the space group are in the third line
+            probe['format'] = 'sca'
+            probe['merge'] = True
+            cell_line = lines[2].split()
+            probe['unit_cell'] = tuple(float(_) for _ in cell_line[:6])
+            probe['space_group'] = b' '.join(cell_line[6:]).decode('ascii', 'replace')
+        elif lines and re.match(rb'^ *\d+ +\S', lines[0]) and len(lines) > 1 and len(lines[1].split()) == 9:
+            # unmerged scalepack: number of symmetry operators and space group, followed by the operators
+            probe['format'] = 'sca'
+            probe['merge'] = False
+            probe['space_group'] = lines[0].split(None, 1)[1].strip().decode('ascii', 'replace')
+        elif lines and all(_shelx_record.match(_) for _ in lines[:10]):
+            probe['format'] = 'shlex_hkl'
+    return probe
+
+
+
+def inspect_file(file_name: str, file_type: str = None) -> Dict[str, Any]:
+    """Read the metadata of a reflection file from its header only: the mtz header records, the XDS ! header lines,
+    the header of a dials reflection table or the _cell and _symmetry items of a cif file. The reflections
+    are not read.
+
+    :param file_name: The name or path of the input file, or in-memory input as accepted by FileReader.
+    :param file_type: Optional. One of mtz, xds_hkl, integrate_hkl, refl, cif, sca and shlex_hkl.
+                      Recognised by probe_file if not given.
+    :return: format and, as far as given in the header, unit_cell, space_group, space_group_number, column_labels,
+             nref and resolution_range (low, high) in Angstrom.
+    :rtype: dict
+    """
+    file_name = load_reflection_source(file_name)
+    probe = probe_file(file_name)
+    if file_type is None:
+        file_type = probe['format']
+    metadata = {'file_name': source_name(file_name), 'format': file_type}
+    if file_type == 'mtz':
+        mtz_map = MtzMap.MtzMap()
+        mtz_map.read_header(file_name)
+        metadata['unit_cell'] = mtz_map.cell
+        metadata['space_group'] = mtz_map.space_group_name
+        metadata['space_group_number'] = mtz_map.space_group_number
+        metadata['column_labels'] = mtz_map.column_labels()
+        metadata['column_types'] = mtz_map.column_types()
+        metadata['nref'] = mtz_map.nref
+        if mtz_map.resolution_range is not None:
+            # the header records the range as inverse resolution squared
+            metadata['resolution_range'] = tuple(1. / np.sqrt(_) for _ in mtz_map.resolution_range)
+        metadata['datasets'] = list(mtz_map.datasets.values())
+    elif file_type in ('xds_hkl', 'integrate_hkl'):
+        header = {}
+        with open_reflection_file(file_name, 'rb') as f:
+            for line in f:
+                if not line.startswith(b'!') or line.startswith(b'!END_OF_HEADER'):
+                    break
+                header.update(Xds._parse_header_line(line.decode('ascii', 'replace')))
+        if 'UNIT_CELL_CONSTANTS' in header:
+            metadata['unit_cell'] = tuple(float(_) for _ in header['UNIT_CELL_CONSTANTS'].split())
+        if 'SPACE_GROUP_NUMBER' in header:
+            metadata['space_group_number'] = int(header['SPACE_GROUP_NUMBER'])
+        if 'INCLUDE_RESOLUTION_RANGE' in header:
+            metadata['resolution_range'] = tuple(float(_) for _ in header['INCLUDE_RESOLUTION_RANGE'].split())
+        items = sorted((int(value), key[5:]) for key, value in header.items() if key.startswith('ITEM_'))
+        if items:
+            metadata['column_labels'] = [_[1] for _ in items]
+        elif file_type == 'integrate_hkl':
+            metadata['column_labels'] = PlainASCII._integrate_hkl_items
+        for key, name in (('MERGE', 'merge'), ("FRIEDEL'S_LAW", 'friedels_law')):
+            if key in header:
+                metadata[name] = header[key] == 'TRUE'
+    elif file_type == 'refl':
+        if not is_in_memory(file_name) and compression_suffix(file_name) is None:
+            with open(file_name, 'rb') as f:
+                header = Dials.read_table_header(f)
+        else:
+            with open_reflection_file(file_name, 'rb') as f:
+                header = Dials.read_table_header(io.BytesIO(f.read()))
+        metadata['column_labels'] = header.get('columns')
+        metadata['nref'] = header.get('nrows')
+        metadata['identifiers'] = header.get('identifiers')
+    elif file_type == 'cif':
+        metadata.update(Cif.read_cif_header(file_name))
+    else:
+        metadata.update({key: value for key, value in probe.items() if key not in ('format', 'compression')})
+    return metadata
+
+
+def FileReader(file_name: str, file_type: str = None, *args, cache_dir: str = None, precision: str = None,
+               streaming: bool = False):
     """A universal format parser to popular data formats.
 
-    :param file_name: The name or path of the input file.
-    :param file_type: Optional.
+    :param file_name: The name or path of the input file. gzip, bzip2 and xz compressed files (.gz, .bz2, .xz) are
+                      read directly. '-' reads the standard input; a file object, bytes, bytearray or memoryview
+                      is read from memory without writing a temporary file.
+    :param file_type: Optional. If not given, the format is recognised by probe_file, then by the file name suffix.
 
-    :param args: (unit cell, space group number). Needed only when the input file does not include cell information.
+    :param args: (unit cell, space group number). Needed only when the input file does not include cell information,
+                 i.e. for SHELX hkl and unmerged scalepack files.
+    :param cache_dir: Optional. Directory of the parsed reflection cache. A file found in the cache is not parsed
+                      again, otherwise the parsed arrays are stored there. Not used for in-memory input.
+    :param precision: Optional. 'float32' or 'float64', the float type of the observations, deviations and
+                      resolutions. Default: the type the data are read in.
+    :param streaming: Optional. XDS_ASCII files are read block by block and only the merged reflections and the sums
+                      needed for the merging statistics are kept, so that memory does not grow with the number of
+                      observations. Default: False.
     :return: Parsed reflection data.
+    :raises RuntimeError: if the file cannot be read, its format is not recognised or is INTEGRATE.HKL.
     """
-    if file_name[-3:] == 'mtz' or (file_type in ('mtz', 'MTZ', 'mrg', 'binary')):
+    file_name = load_reflection_source(file_name)
+    if is_in_memory(file_name):
+        # the parsers read the content again on demand, which a cache entry cannot refer to
+        cache_dir = None
+    cache_options = (file_type,) + args + (precision, streaming)
+    digest = None
+    if cache_dir is not None:
+        # the file is hashed once, for looking up and for storing the cache entry
+        digest = file_digest(file_name)
+        reflection_data = load_parsed(file_name, cache_dir, *cache_options, digest=digest)
+        if reflection_data is not None:
+            reflection_data.source_digest = digest
+            if precision is not None:
+                reflection_data.set_precision(precision)
+            return reflection_data
+    format_name = strip_compression_suffix(file_name)
+    if file_type is None:
+        # recognise the format by the content before any parsing. the suffix is used if the content is not recognised.
+        file_type = probe_file(file_name)['format']
+        if file_type is not None:
+            format_name = ''
+    if file_type == 'integrate_hkl':
+        # INTEGRATE.HKL has neither scaled nor merged intensities. It is only read to write FILTER.HKL.
+        raise RuntimeError('{0} is an XDS INTEGRATE.HKL file, which cannot be analysed. Use the XDS_ASCII.HKL file '
+                           'written by CORRECT, and give INTEGRATE.HKL with --generate-xds-filter.'.format(source_name(file_name)))
+    elif format_name[-3:] == 'mtz' or (file_type in ('mtz', 'MTZ', 'mrg', 'binary')):
         try:
             reflection_data = Mtz.MtzParser()
             reflection_data.read(file_name)
             reflection_data.source_data_format = 'mtz'
         except AssertionError:
             raise RuntimeError('Failed to read the mtz file. Check the data format or specify the input type using --input-type.')
-    elif file_name[-3:] == 'HKL' or (file_type in ('xds', 'HKL', 'xds_HKL')):
+    elif format_name[-3:] == 'HKL' or (file_type in ('xds', 'HKL', 'xds_HKL', 'xds_hkl')):
         try:
             reflection_data = Xds.XdsParser()
-            reflection_data.read_hkl(file_name) #, merge_equivalents=False)
+            reflection_data.read_hkl(file_name, streaming=streaming) #, merge_equivalents=False)
             reflection_data.source_data_format = 'xds_hkl'
         except AssertionError:
             raise RuntimeError('Failed to read the xds file. Check the data format or specify the input type using --input-type.')
-    elif file_name[-3:] == 'cif' or (file_type in ['cif', 'mmcif', 'CIF']):
+    elif format_name[-3:] == 'cif' or (file_type in ['cif', 'mmcif', 'CIF']):
         try:
             reflection_data = Cif.CifParser()
             reflection_data.read(file_name)
             reflection_data.source_data_format = 'cif'
-        except CifParserError or AssertionError:
+        except (ValueError, RuntimeError, AssertionError):
             raise RuntimeError('Failed to read the cif file. Check the data format or specify the input type using --input-type.')
 
-    elif file_name[-4:] == 'refl' or (file_type in ['refl', 'dials', 'msgpack']):
+    elif format_name[-4:] == 'refl' or (file_type in ['refl', 'dials', 'msgpack']):
         try:
             reflection_data = Dials.DialsParser()
             reflection_data.smart_read(file_name)
             reflection_data.source_data_format = 'refl'
         except AssertionError:
             raise RuntimeError('Failed to read the refl file. Check the data format or specify the input type using --input-type.')
-    elif file_name[-3:] == 'hkl' or (file_type in ['shlex', 'hkl', 'shlex_hkl']):
+    elif format_name[-3:] == 'sca' or (file_type in ['sca', 'scalepack']):
+        if probe_file(file_name).get('merge', True):
+            reflection_data = Sca.ScaParser()
+            reflection_data.read(file_name)
+            reflection_data.source_data_format = 'sca'
+        else:
+            try:
+                unit_cell, space_group_number = (args + (None, None))[:2]
+                reflection_data = Sca.ScaUnmergedParser()
+                reflection_data.read(file_name, unit_cell, space_group_number)
+                reflection_data.source_data_format = 'sca_unmerged'
+            except AssertionError as err:
+                raise RuntimeError('Failed to read the unmerged scalepack file: {0} '
+                                   'Specify the unit cell using --unit-cell.'.format(err))
+    elif format_name[-3:] == 'hkl' or (file_type in ['shlex', 'hkl', 'shlex_hkl']):
         try:
             if len(args) == 2:
                 unit_cell, space_group_number = args
@@ -51,5 +253,11 @@ def FileReader(file_name: str, file_type: str = None, *args):
         except RuntimeError as err:
             print('An error occurred when parsing shlex hkl: ', err)
     else:
-        reflection_data = None
+        raise RuntimeError('The format of {0} is not recognised. Specify the input type using --input-type.'.format(
+            source_name(file_name)))
+    if precision is not None and reflection_data is not None:
+        reflection_data.set_precision(precision)
+    if cache_dir is not None and reflection_data is not None:
+        reflection_data.source_digest = digest
+        save_parsed(reflection_data, file_name, cache_dir, *cache_options)
     return reflection_data
\ No newline at end of file
@@ -1,7 +1,55 @@
-from iotbx import cif
+import shlex
+
+import gemmi
+from cctbx import crystal, sgtbx, uctbx
+from cctbx.array_family import flex
 
 from .ReflectionBase import *
 
+# _refln items of the observations and their sigmas
+_cif_observations = {'F': ('F_meas_au', 'F_meas_sigma_au'),
+                     'I': ('intensity_meas', 'intensity_sigma')}
+
+# _refln items of the anomalous observations and their sigmas, as (+, sigma(+), -, sigma(-))
+_cif_anomalous_observations = {'F_ano': ('pdbx_F_plus', 'pdbx_F_plus_sigma', 'pdbx_F_minus', 'pdbx_F_minus_sigma'),
+                               'I_ano': ('pdbx_I_plus', 'pdbx_I_plus_sigma', 'pdbx_I_minus', 'pdbx_I_minus_sigma')}
+
+# single-valued items read by read_cif_header
+_cif_header_items = {'_cell.length_a': 'a', '_cell.length_b': 'b', '_cell.length_c': 'c',
+                     '_cell.angle_alpha': 'alpha', '_cell.angle_beta': 'beta', '_cell.angle_gamma': 'gamma',
+                     '_symmetry.space_group_name_H-M': 'space_group', '_space_group.name_H-M_alt': 'space_group',
+                     '_symmetry.Int_Tables_number': 'space_group_number', '_space_group.IT_number': 'space_group_number'}
+
+
+def read_cif_header(filename: str) -> Dict[str, Any]:
+    """Read the cell and the symmetry of the first data block of a reflection cif file. Reading stops at the _refln
+    loop, so the reflections are not read.
+
+    :param filename: File or path to file.
+    :return: block name, unit cell parameters, space group symbol and number, as far as given in the file.
+    :rtype: dict
+    """
+    header = {}
+    with open_reflection_file(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('data_'):
+                if 'block' in header:
+                    break
+                header['block'] = line[5:]
+            elif line.startswith('_refln.'):
+                break
+            elif line and line.split(None, 1)[0] in _cif_header_items:
+                words = shlex.split(line)
+                if len(words) > 1 and words[1] not in ('?', '.'):
+                    header[_cif_header_items[words[0]]] = words[1]
+    cell = [header.pop(_, None) for _ in ('a', 'b', 'c', 'alpha', 'beta', 'gamma')]
+    if None not in cell:
+        header['unit_cell'] = tuple(float(_) for _ in cell)
+    if 'space_group_number' in header:
+        header['space_group_number'] = int(header['space_group_number'])
+    return header
+
 
 class CifParser(ReflectionParser):
     """The Parser class to process cif files.
@@ -13,42 +61,143 @@ class CifParser(ReflectionParser):
         self._resolutionF = None
         self._resolutionI = None
         self._resolutionI_ano = None
+        self._resolutionF_ano = None
+        self._unit_cell = None
+        self._refln_blocks = None
+        self._block_name = None
+        self._hkl_by_obs = {}
+        self._miller_arrays = {}
 
     def read(self, filename: str = None):
-        """Read the given cif file.
+        """Read the given cif file. The file is parsed once with gemmi and the _refln loop of the first data block
+        with reflections is read column-wise.
 
-        :param filename: File or path to file
+        :param filename: File or path to file, or in-memory file content
         :type filename: str
         :return: None
         """
-        self._obj = cif.reader(file_path=filename)
-        miller_arrays = self._obj.build_miller_arrays()
-        for model in miller_arrays.keys():
-            for key in miller_arrays[model].keys():
-                wavelength_id = np.array(miller_arrays[model]['_refln.wavelength_id'].data())[0]
-                if 'F_meas' in key:
-                    self._hkl = np.array(miller_arrays[model][key].indices(), dtype=int)
-                    self._F = np.array(miller_arrays[model][key].data(), dtype=float)
-                    self._sigF = np.array(miller_arrays[model][key].sigmas(), dtype=float)
-                    self._resolutionF = np.array(miller_arrays[model][key].
-                                                 unit_cell().d(miller_arrays[model][key].indices()), dtype=float)
-                    self._space_group = miller_arrays[model][key].space_group()
-                    self._unit_cell = miller_arrays[model][key].unit_cell()
-                if 'intensity_meas' in key:
-                    if np.array(miller_arrays[model]['_refln.wavelength_id'].data())[0] == wavelength_id:
-                        if miller_arrays[model][key].anomalous_flag():
-                            self._I_ano = np.array(miller_arrays[model][key].data(), dtype=float)
-                            self._sigI_ano = np.array(miller_arrays[model][key].sigmas(), dtype=float)
-                            self._resolutionI_ano = np.array(miller_arrays[model][key].
-                                                             unit_cell().d(miller_arrays[model][key].indices()),
-                                                             dtype=float)
-                        else:
-                            self._I = np.array(miller_arrays[model][key].data(), dtype=float)
-                            self._sigI = np.array(miller_arrays[model][key].sigmas(), dtype=float)
-                            self._resolutionI = np.array(miller_arrays[model][key].
-                                                         unit_cell().d(miller_arrays[model][key].indices()),
-                                                         dtype=float)
-            self._filename = filename
+        if not is_in_memory(filename) and compression_suffix(filename) in (None, '.gz'):
+            # gemmi decompresses gzip by itself
+            self._obj = gemmi.cif.read(filename)
+        else:
+            self._obj = gemmi.cif.read_string(str(read_reflection_file(filename), 'utf-8'))
+        self._refln_blocks = gemmi.as_refln_blocks(self._obj)
+        rblocks = [_ for _ in self._refln_blocks if _]
+        if not rblocks:
+            raise AssertionError('No reflection data in {0}.'.format(source_name(filename)))
+        self.read_block(rblocks[0])
+        self._filename = filename
+
+    def split_datasets(self) -> Dict[str, 'CifParser']:
+        """Read every data block with reflections into its own parser, e.g. of several crystals, or of the merged and
+        the unmerged data deposited together. The parsers share the parsed document.
+
+        :return: Parsers of the blocks with observations, by block name.
+        :rtype: dict
+        """
+        if self._refln_blocks is None:
+            # restored from a reflection cache, only the block read is available
+            return {self._block_name: self}
+        datasets = {}
+        for rblock in self._refln_blocks:
+            if not rblock:
+                continue
+            reflection_data = CifParser()
+            reflection_data._obj = self._obj
+            reflection_data._refln_blocks = self._refln_blocks
+            reflection_data._filename = self._filename
+            reflection_data.source_data_format = self.source_data_format
+            try:
+                reflection_data.read_block(rblock)
+            except AssertionError:
+                # blocks without symmetry cannot be analysed
+                continue
+            if any(getattr(reflection_data, '_' + _) is not None for _ in ('F', 'I', 'F_ano', 'I_ano')):
+                datasets[rblock.block.name] = reflection_data
+        return datasets
+
+    def read_block(self, rblock: gemmi.ReflnBlock):
+        """Read the observations of one reflection data block. Only the rows of the first wavelength are kept.
+
+        :param rblock: A reflection block of the parsed document.
+        :return: None
+        """
+        if rblock.spacegroup is None:
+            raise AssertionError('No space group in data block {0}.'.format(rblock.block.name))
+        self._block_name = rblock.block.name
+        self._unit_cell = uctbx.unit_cell(rblock.cell.parameters)
+        self._space_group = sgtbx.space_group_info(symbol='Hall: ' + rblock.spacegroup.hall).group()
+        self._hkl_by_obs = {}
+        self._miller_arrays = {}
+        labels = rblock.column_labels()
+        hkl = rblock.make_miller_array().astype(int)
+        rows = np.ones(hkl.shape[0], dtype=bool)
+        if 'wavelength_id' in labels:
+            wavelength_id = rblock.make_int_array('wavelength_id', -1)
+            rows = wavelength_id == wavelength_id[0]
+        for obs_name, (obs_label, sig_label) in _cif_observations.items():
+            if obs_label not in labels or sig_label not in labels:
+                continue
+            obs = rblock.make_float_array(obs_label)
+            sig = rblock.make_float_array(sig_label)
+            # entries marked as ? or . are read as nan and dropped
+            valid = rows & ~np.isnan(obs) & ~np.isnan(sig)
+            self._hkl_by_obs[obs_name] = hkl[valid]
+            setattr(self, '_' + obs_name, obs[valid])
+            setattr(self, '_sig' + obs_name, sig[valid])
+            self._set_resolution(obs_name, hkl[valid], self._unit_cell)
+        hkl_anomalous = {}
+        for obs_name, ano_labels in _cif_anomalous_observations.items():
+            if not all(_ in labels for _ in ano_labels):
+                continue
+            plus, sig_plus, minus, sig_minus = [rblock.make_float_array(_) for _ in ano_labels]
+            valid = rows & ~(np.isnan(plus) & np.isnan(minus))
+            # interleave (+) and (-) as done for mtz. a missing half, i.e. ? or . as value or sigma, is set to 0 with
+            # sigma 0, which the validity masks of the observations drop as they keep only positive sigmas.
+            obs = np.stack((plus[valid], minus[valid]), axis=1).reshape(-1)
+            sig = np.stack((sig_plus[valid], sig_minus[valid]), axis=1).reshape(-1)
+            missing = np.isnan(obs) | np.isnan(sig)
+            obs[missing] = 0.
+            sig[missing] = 0.
+            setattr(self, '_' + obs_name, obs)
+            setattr(self, '_sig' + obs_name, sig)
+            hkl_anomalous[obs_name] = hkl[valid]
+            # one resolution for each (+)/(-) pair
+            self._set_resolution(obs_name, hkl[valid], self._unit_cell)
+        if 'F' in self._hkl_by_obs:
+            self._hkl = self._hkl_by_obs['F']
+        elif 'I' in self._hkl_by_obs:
+            self._hkl = self._hkl_by_obs['I']
+        elif hkl_anomalous:
+            # blocks with anomalous pairs only, the indices of the (+)/(-) pairs
+            self._hkl = hkl_anomalous.get('F_ano', hkl_anomalous.get('I_ano'))
+        else:
+            self._hkl = None
+
+    def as_miller_array(self, observation_type: str) -> miller.array:
+        """Convert the parsed observations to a cctbx miller array without parsing the file again.
+
+        :param observation_type: Can be either 'F' or 'I'.
+        :return: A cctbx miller array
+        :rtype: cctbx.miller_array
+        """
+        if observation_type not in self._hkl_by_obs:
+            raise ValueError('Non-standard colum label')
+        if observation_type not in self._miller_arrays:
+            crystal_symmetry = crystal.symmetry(unit_cell=self._unit_cell, space_group=self._space_group)
+            miller_set = miller.set(crystal_symmetry=crystal_symmetry,
+                                    indices=flex.miller_index(self._hkl_by_obs[observation_type].tolist()),
+                                    anomalous_flag=False)
+            ma = miller.array(miller_set,
+                              data=flex.double(getattr(self, '_' + observation_type)),
+                              sigmas=flex.double(getattr(self, '_sig' + observation_type)))
+            if observation_type == 'F':
+                ma.set_observation_type_xray_amplitude()
+            else:
+                ma.set_observation_type_xray_intensity()
+            ma.set_info(miller.array_info(source=self._filename, source_type='cif'))
+            self._miller_arrays[observation_type] = ma
+        return self._miller_arrays[observation_type]
 
     @filename_check
     def get_space_group(self) -> str:
@@ -0,0 +1,121 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+
+# decompressing openers by file name suffix
+_compression_openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+# leading bytes of the compressed streams, used for input without a file name
+_compression_magic = {b'\x1f\x8b': '.gz', b'BZh': '.bz2', b'\xfd7zXZ\x00': '.xz'}
+
+
+def is_in_memory(source) -> bool:
+    """
+    :param source: File name or reflection data loaded by load_reflection_source.
+    :return: Whether the source is held in memory instead of being a file on disk.
+    :rtype: bool
+    """
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+
+def load_reflection_source(source):
+    """Bring the input of a reader into a form all parsers accept. File names are returned as they are. '-' is read
+    from the standard input. File objects are read to their end. bytes, bytearray and memoryview are kept as they
+    are, so the data block of an mtz file is used without a copy.
+
+    :param source: File name, '-', file object, bytes, bytearray or memoryview.
+    :return: File name or in-memory file content.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        if source == '-':
+            return sys.stdin.buffer.read()
+        return os.fspath(source)
+    if is_in_memory(source):
+        return source
+    if hasattr(source, 'read'):
+        content = source.read()
+        return content.encode() if isinstance(content, str) else content
+    raise TypeError('Cannot read reflection data from {0}.'.format(type(source).__name__))
+
+
+def source_name(source) -> str:
+    """
+    :param source: File name or in-memory file content.
+    :return: The file name, or '<memory>' for in-memory content. Used in messages.
+    :rtype: str
+    """
+    return '<memory>' if is_in_memory(source) else source
+
+
+def compression_suffix(filename: str) -> str | None:
+    """
+    :param filename: File name or path to the file. For in-memory content, the compression is recognised by the
+                     leading bytes.
+    :return: The compression suffix of the file name ('.gz', '.bz2' or '.xz'), None for uncompressed files.
+    :rtype: str
+    """
+    if is_in_memory(filename):
+        head = bytes(filename[:6])
+        return next((suffix for magic, suffix in _compression_magic.items() if head.startswith(magic)), None)
+    suffix = os.path.splitext(filename)[1].lower()
+    return suffix if suffix in _compression_openers else None
+
+
+def strip_compression_suffix(filename: str) -> str:
+    """
+    :param filename: File name or path to the file.
+    :return: The file name without compression suffix, e.g. XDS_ASCII.HKL for XDS_ASCII.HKL.gz. In-memory content
+             has no file name, '' is returned.
+    :rtype: str
+    """
+    if is_in_memory(filename):
+        return ''
+    if compression_suffix(filename) is None:
+        return filename
+    return os.path.splitext(filename)[0]
+
+
+def open_reflection_file(filename: str, mode: str = 'rb'):
+    """Open a reflection file for reading. gzip, bzip2 and xz compressed files are decompressed on the fly while
+    reading, so text formats can be streamed without writing the uncompressed file to disk.
+
+    :param filename: File name or path to the file, or in-memory file content.
+    :param mode: 'rb' or 'r'. Default: 'rb'.
+    :return: File object
+    """
+    suffix = compression_suffix(filename)
+    if is_in_memory(filename):
+        # in-memory content is read through a buffer without copying it to disk
+        filename = io.BytesIO(filename)
+        if suffix is None:
+            return filename if mode == 'rb' else io.TextIOWrapper(filename)
+    elif suffix is None:
+        return open(filename, mode)
+    if mode == 'r':
+        mode = 'rt'
+    return _compression_openers[suffix](filename, mode)
+
+
+def read_reflection_file(filename: str) -> bytes:
+    """Read the whole content of a reflection file into memory. Used for binary formats, which are accessed at
+    random positions. Compressed files are decompressed in memory.
+
+    :param filename: File name or path to the file, or in-memory file content.
+    :return: Uncompressed file content. Uncompressed in-memory content is returned as it is.
+    :rtype: bytes
+    """
+    if is_in_memory(filename) and compression_suffix(filename) is None:
+        return filename
+    with open_reflection_file(filename, 'rb') as f:
+        return f.read()
+
+
+def is_compressed_stream(f) -> bool:
+    """
+    :param f: File object
+    :return: Whether the file object decompresses on the fly. Seeking such streams means decompressing again.
+    :rtype: bool
+    """
+    return isinstance(f, (gzip.GzipFile, bz2.BZ2File, lzma.LZMAFile))
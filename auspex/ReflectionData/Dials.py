@@ -1,5 +1,8 @@
 import msgpack
+import io
+import os
 import json
+import struct
 
 import scitbx_array_family_flex_ext as flex
 
@@ -63,12 +66,170 @@ _dials_scaled = ['background.mean', 'background.sum.value', 'background.sum.vari
                  'xyzcal.mm', 'xyzcal.px', 'xyzobs.mm.value', 'xyzobs.mm.variance',
                  'xyzobs.px.value', 'xyzobs.px.variance', 'zeta']
 
+# columns decoded by DialsParser.read_columns, all others are skipped when reading
+_dials_read_columns = ['flags', 'id', 'miller_index',
+                       'intensity.sum.value', 'intensity.sum.variance',
+                       'intensity.prf.value', 'intensity.prf.variance',
+                       'intensity.scale.value', 'intensity.scale.variance',
+                       'inverse_scale_factor', 'inverse_scale_factor_variance',
+                       'background.mean', 'background.sum.value', 'background.sum.variance',
+                       'num_pixels.background_used', 'num_pixels.foreground',
+                       'xyzcal.mm', 'xyzcal.px', 'xyzobs.mm.value', 'xyzobs.mm.variance',
+                       'xyzobs.px.value', 'xyzobs.px.variance']
+
+# bits of the flags column, as defined by dials reflection_table.flags
+dials_flags = {'in_powder_ring': 1 << 13,
+               'user_excluded_in_scaling': 1 << 22}
+
+# bytes per element of the column types with fixed-size elements. only these columns can be filtered by row.
+dials_element_sizes = {'bool': 1, 'int': 4, 'std::size_t': 8, 'double': 8, 'vec2<double>': 16,
+                       'vec3<double>': 24, 'mat3<double>': 72, 'int6': 24, 'cctbx::miller::index<>': 12}
+
+# msgpack type bytes: (struct format of the length field, number of extra bytes for ext types)
+_msgpack_sized = {0xc4: ('>B', 0), 0xc5: ('>H', 0), 0xc6: ('>I', 0),  # bin
+                  0xd9: ('>B', 0), 0xda: ('>H', 0), 0xdb: ('>I', 0),  # str
+                  0xc7: ('>B', 1), 0xc8: ('>H', 1), 0xc9: ('>I', 1)}  # ext
+_msgpack_fixed = {0xc0: 0, 0xc2: 0, 0xc3: 0, 0xca: 4, 0xcb: 8,
+                  0xcc: 1, 0xcd: 2, 0xce: 4, 0xcf: 8, 0xd0: 1, 0xd1: 2, 0xd2: 4, 0xd3: 8,
+                  0xd4: 2, 0xd5: 3, 0xd6: 5, 0xd7: 9, 0xd8: 17}
+_msgpack_containers = {0xdc: ('array', '>H'), 0xdd: ('array', '>I'), 0xde: ('map', '>H'), 0xdf: ('map', '>I')}
+
+
+class MsgpackWalker(object):
+    """A minimal msgpack reader that walks a seekable binary stream object by object.
+    Objects that are not needed are skipped by their byte length without being decoded.
+
+    :param f: Seekable binary file object.
+    """
+
+    def __init__(self, f):
+        self._f = f
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+    def seek(self, pos: int):
+        self._f.seek(pos)
+
+    def _read(self, fmt: str):
+        return struct.unpack(fmt, self._f.read(struct.calcsize(fmt)))[0]
+
+    def read_container_header(self) -> tuple[str, int]:
+        """Read the header of a map or an array.
+
+        :return: ('map' or 'array', number of items)
+        :rtype: tuple
+        """
+        code = self._read('>B')
+        if 0x80 <= code <= 0x8f:
+            return 'map', code & 0x0f
+        if 0x90 <= code <= 0x9f:
+            return 'array', code & 0x0f
+        if code in _msgpack_containers:
+            kind, fmt = _msgpack_containers[code]
+            return kind, self._read(fmt)
+        raise ValueError('Expected a msgpack map or array at byte {0}.'.format(self.tell() - 1))
+
+    def skip(self):
+        """Skip the next object, including all items of a container."""
+        code = self._read('>B')
+        if code <= 0x7f or code >= 0xe0:  # fixint
+            return
+        if 0xa0 <= code <= 0xbf:  # fixstr
+            self._f.seek(code & 0x1f, 1)
+        elif 0x80 <= code <= 0x9f or code in _msgpack_containers:
+            self._f.seek(-1, 1)
+            kind, size = self.read_container_header()
+            for _ in range(size * 2 if kind == 'map' else size):
+                self.skip()
+        elif code in _msgpack_sized:
+            fmt, extra = _msgpack_sized[code]
+            self._f.seek(self._read(fmt) + extra, 1)
+        elif code in _msgpack_fixed:
+            self._f.seek(_msgpack_fixed[code], 1)
+        else:
+            raise ValueError('Unknown msgpack type byte {0:#x}.'.format(code))
+
+    def read_bin(self) -> bytes:
+        """Read the payload of the next bin object in one call.
+
+        :return: payload
+        :rtype: bytes
+        """
+        code = self._read('>B')
+        if code not in (0xc4, 0xc5, 0xc6):
+            raise ValueError('Expected a msgpack bin at byte {0}.'.format(self.tell() - 1))
+        return self._f.read(self._read(_msgpack_sized[code][0]))
+
+    def unpack(self) -> Any:
+        """Decode the next object.
+
+        :return: decoded object
+        """
+        start = self.tell()
+        self.skip()
+        end = self.tell()
+        self.seek(start)
+        return msgpack.unpackb(self._f.read(end - start), raw=False, strict_map_key=False)
+
+
+def read_table_header(f, column_names: bool = True) -> Dict[str, Any]:
+    """Read the header of a msgpack reflection table without decoding any column.
+
+    :param f: Seekable binary file object positioned at the start of the table.
+    :param column_names: Whether to walk over the data block to collect the column names. The column payloads are
+                         skipped by their byte length. If False, reading stops at the data block.
+    :return: Table type, version, and the identifiers, nrows and column names as far as read.
+    :rtype: dict
+    """
+    walker = MsgpackWalker(f)
+    try:
+        kind, size = walker.read_container_header()
+        assert kind == 'array' and size == 3, 'Not a dials reflection table'
+        header = {'type': walker.unpack()}
+        assert header['type'] == 'dials::af::reflection_table', 'Not a dials reflection table'
+        header['version'] = walker.unpack()
+        _, num_keys = walker.read_container_header()
+        for _ in range(num_keys):
+            key = walker.unpack()
+            if key != 'data':
+                header[key] = walker.unpack()
+                continue
+            if not column_names:
+                break
+            header['columns'] = []
+            _, num_columns = walker.read_container_header()
+            for _ in range(num_columns):
+                header['columns'].append(walker.unpack())
+                walker.skip()
+    except (struct.error, ValueError, msgpack.exceptions.UnpackException):
+        raise AssertionError('Truncated or corrupted reflection table.')
+    return header
+
+
+def _copy_bytes(source, target, size: int, chunk_size: int = 1 << 24):
+    """Copy size bytes from the current position of source to target in chunks.
+
+    :param source: Binary file object.
+    :param target: Binary file object.
+    :param size: Number of bytes to copy.
+    :param chunk_size: Number of bytes copied at once. Default: 16 MB.
+    :return: None
+    """
+    while size > 0:
+        chunk = source.read(min(size, chunk_size))
+        if not chunk:
+            raise AssertionError('Truncated or corrupted reflection table.')
+        target.write(chunk)
+        size -= len(chunk)
+
 
 class DialsParser(ReflectionParser):
     """The Parser class to process dials files.
 
     """
-    flex_func = {'int': flex.int_from_byte_str, 'double': flex.double_from_byte_str}
+    # element types of the raw column buffers written by dials
+    column_dtypes = {'int': np.dtype('<i4'), 'double': np.dtype('<f8'), 'size_t': np.dtype('<u8')}
 
     def __init__(self):
         super(DialsParser, self).__init__()
@@ -84,22 +245,29 @@ class DialsParser(ReflectionParser):
         self._xyzobs_px = None
         self._xyzobs_var_px = None
         self._crystals = []
+        self._column_names = None
+        self._column_extents = None
+        self._flags = None
 
-    def smart_read(self, filename: str = None):
-        """Read dials spots files.
+    def smart_read(self, filename: str = None, columns: list[str, ...] = None):
+        """Read dials spots files. Only the requested columns are decoded, all other column payloads
+        (e.g. shoebox) are skipped by their byte length.
 
         :param filename: File or path to spots file
         :type filename: str
+        :param columns: Optional. Names of the columns to decode. Default: the columns used by read_columns.
+        :type columns: list
         :return: None
         """
         self._filename = filename
-        with open(self._filename, 'rb') as f:
-            self._obj = msgpack.unpack(f, raw=False, strict_map_key=False)
-        assert self._obj[0] == 'dials::af::reflection_table', 'Not a dials reflection table'
+        if columns is None:
+            columns = _dials_read_columns
+        with self._open_table() as f:
+            self._obj = self._walk_table(MsgpackWalker(f), columns)
         self._nrows = int(self._obj[2]['nrows'])
         self._identifiers = self._obj[2]['identifiers']
 
-        data_dict = list(self._obj[2]['data'].keys())
+        data_dict = self._column_names
         if data_dict == _dials_strong:
             self._type_reflection_table = 'spots'
         elif data_dict == _dials_indexed:
@@ -114,6 +282,67 @@ class DialsParser(ReflectionParser):
             raise AssertionError('Not a standard DIALS data file.')
         self.read_columns()
 
+    def _open_table(self):
+        """
+        :return: seekable binary file object of the reflection table
+        """
+        if not is_in_memory(self._filename) and compression_suffix(self._filename) is None:
+            return open(self._filename, 'rb')
+        # the walker seeks over the skipped payloads, so compressed tables are decompressed into memory first.
+        # in-memory tables are walked in place.
+        return io.BytesIO(read_reflection_file(self._filename))
+
+    def _walk_table(self, walker: MsgpackWalker, columns: list[str, ...]) -> list:
+        """Walk through a msgpack reflection table and decode the header and the requested columns.
+        The names and byte extents of all columns are recorded.
+
+        :param walker: MsgpackWalker positioned at the start of the table.
+        :param columns: Names of the columns to decode.
+        :return: [table type, version, {'identifiers': ..., 'nrows': ..., 'data': {requested columns}}]
+        :rtype: list
+        """
+        kind, size = walker.read_container_header()
+        assert kind == 'array' and size == 3, 'Not a dials reflection table'
+        table_type = walker.unpack()
+        assert table_type == 'dials::af::reflection_table', 'Not a dials reflection table'
+        version = walker.unpack()
+        content = {}
+        self._column_names = []
+        self._column_extents = {}
+        _, num_keys = walker.read_container_header()
+        for _ in range(num_keys):
+            key = walker.unpack()
+            if key != 'data':
+                content[key] = walker.unpack()
+                continue
+            content['data'] = {}
+            _, num_columns = walker.read_container_header()
+            for _ in range(num_columns):
+                start = walker.tell()
+                name = walker.unpack()
+                self._column_names.append(name)
+                if name in columns:
+                    content['data'][name] = self._read_column(walker)
+                else:
+                    walker.skip()
+                self._column_extents[name] = (start, walker.tell())
+        return [table_type, version, content]
+
+    @staticmethod
+    def _read_column(walker: MsgpackWalker) -> list:
+        """Read a column stored as [type name, [number of elements, raw buffer]]. The raw buffer is read once
+        and kept as it is, so that columns can be viewed without further copies.
+
+        :param walker: MsgpackWalker positioned at the column.
+        :return: [type name, [number of elements, raw buffer]]
+        :rtype: list
+        """
+        walker.read_container_header()
+        type_name = walker.unpack()
+        walker.read_container_header()
+        size = walker.unpack()
+        return [type_name, [size, walker.read_bin()]]
+
     def read_columns(self):
         """Read and record data by keys.
 
@@ -124,6 +353,7 @@ class DialsParser(ReflectionParser):
         self._xyzobs_px = self.column_to_array('xyzobs.px.value', 'double', True)
         self._xyzobs_px_var = self.column_to_array('xyzobs.px.variance', 'double', True)
         self._id = self.column_to_array('id', 'int', False)
+        self._flags = self.column_to_array('flags', 'size_t', False)
 
         for identifier in self._identifiers.keys():
             self._id_bool.append(self._id == identifier)
@@ -153,13 +383,80 @@ class DialsParser(ReflectionParser):
             self._inv_sca_factor = self.column_to_array('inverse_scale_factor', 'double', False)
             self._inv_sca_factor_var = self.column_to_array('inverse_scale_factor_variance', 'double', False)
 
+    def write_flagged(self, filename: str, rows: np.ndarray[Literal["N"], np.bool_],
+                      flag: int = dials_flags['user_excluded_in_scaling'], drop: bool = False):
+        """Write a copy of the reflection table in which the given rows, e.g. NEMOs or reflections in ice rings, are
+        flagged or removed. When flagging, only the flags column is encoded again. The payloads of all other columns
+        are copied from the source file byte by byte, so writing costs about one sequential copy.
+
+        :param filename: Path of the output reflection table.
+        :param rows: Mask over all rows of the table, True for the rows to flag or remove.
+        :param flag: Bits set in the flags column of the given rows. Default: user_excluded_in_scaling, so that
+                     dials.scale ignores the rows.
+        :param drop: If True, remove the rows instead. Every column is then filtered, which is only possible for
+                     columns of fixed-size elements, e.g. not for shoeboxes. Default: False.
+        :return: None
+        """
+        rows = np.asarray(rows, dtype=bool)
+        if rows.shape != (self._nrows,):
+            raise AssertionError('The row mask does not match the {0} rows of the table.'.format(self._nrows))
+        table_type, version, content = self._obj
+        packer = msgpack.Packer()
+        try:
+            with self._open_table() as source, open(filename, 'wb') as out:
+                walker = MsgpackWalker(source)
+                out.write(packer.pack_array_header(3) + packer.pack(table_type) + packer.pack(version))
+                out.write(packer.pack_map_header(len(content)))
+                for key, value in content.items():
+                    out.write(packer.pack(key))
+                    if key == 'nrows' and drop:
+                        out.write(packer.pack(int(np.count_nonzero(~rows))))
+                    elif key != 'data':
+                        out.write(packer.pack(value))
+                    else:
+                        out.write(packer.pack_map_header(len(self._column_names)))
+                        for name in self._column_names:
+                            start, end = self._column_extents[name]
+                            if drop:
+                                walker.seek(start)
+                                walker.unpack()
+                                out.write(packer.pack(name) + packer.pack(self._drop_rows(name, walker, rows)))
+                            elif name == 'flags':
+                                flags = self._flags | np.where(rows, np.uint64(flag), np.uint64(0))
+                                out.write(packer.pack(name) + packer.pack(
+                                    [value[name][0], [self._nrows, flags.astype(self.column_dtypes['size_t']).tobytes()]]))
+                            else:
+                                source.seek(start)
+                                _copy_bytes(source, out, end - start)
+        except (AssertionError, ValueError):
+            os.remove(filename)
+            raise
+
+    def _drop_rows(self, name: str, walker: MsgpackWalker, rows: np.ndarray[Literal["N"], np.bool_]) -> list:
+        """
+        :param name: Column name, used in the error message.
+        :param walker: MsgpackWalker positioned at the column.
+        :param rows: Mask over all rows of the table, True for the rows to remove.
+        :return: [type name, [number of elements, raw buffer]] of the column without the given rows
+        :rtype: list
+        """
+        try:
+            type_name, (size, buffer) = self._read_column(walker)
+        except ValueError:
+            raise AssertionError('Rows of column {0} cannot be removed.'.format(name))
+        if size != self._nrows or type_name not in dials_element_sizes \
+                or len(buffer) != size * dials_element_sizes[type_name]:
+            raise AssertionError('Rows of column {0} cannot be removed.'.format(name))
+        elements = np.frombuffer(buffer, dtype=np.uint8).reshape(size, dials_element_sizes[type_name])
+        return [type_name, [int(np.count_nonzero(~rows)), elements[~rows].tobytes()]]
+
     def read_expt(self, filename):
         """Read expt using dxtbx crystal model.
 
         :param filename: File or path to expt file
         """
         self._expt = 'filename'
-        with open(filename, 'r') as inline:
+        with open_reflection_file(filename, 'r') as inline:
             dict_crystals = json.loads(inline.read())['crystal']
         for d in dict_crystals:
             real_space_a = d['real_space_a']
@@ -184,9 +481,12 @@ class DialsParser(ReflectionParser):
         if len(self._crystals) != len(self._identifiers):
             raise RuntimeError('Mismatched data file and experiment list file.')
         if self._resolution is None:
-            self._resolution = np.zeros(self._nrows)
+            invresolsq = np.zeros(self._nrows)
             for i, k in zip(self._id_bool, self._identifiers.keys()):
-                self._resolution[i] = self._crystals[k].get_unit_cell().d(af_flex.miller_index(self._hkl[i].tolist()))
+                invresolsq[i] = d_star_sq(self._hkl[i], self._crystals[k].get_unit_cell())
+            self._d_star_sq = invresolsq
+            with np.errstate(divide='ignore'):
+                self._resolution = 1. / np.sqrt(invresolsq)
         return self._resolution
 
     def as_miller_array(self, identifier_key: str, intensity: str = 'sum') -> miller.array:
@@ -222,16 +522,22 @@ class DialsParser(ReflectionParser):
         :param dict_key: Key used by dials.
         :param d_type: Data type of the chosen column.
         :param reshape: Optional. If True, reshape the data array to (N,3).
-        :return: Data of the chosen column as np.ndarray.
+        :return: Read-only view of the chosen column over the msgpack buffer. Copy it before modification.
         :rtype: np.ndarray
         """
-        array = self.flex_func[d_type](self._obj[2]['data'][dict_key][1][1])
-        array = array.as_numpy_array()
+        array = np.frombuffer(self._obj[2]['data'][dict_key][1][1], dtype=self.column_dtypes[d_type])
         if reshape:
             return array.reshape(self._nrows, 3)
         else:
             return array
 
+    def get_flags(self) -> np.ndarray[Literal["N"], np.uint64]:
+        """
+        :return: status flags of the reflections
+        :rtype: 1d np.ndarray
+        """
+        return self._flags
+
     @property
     def data_type(self) -> str:
         """
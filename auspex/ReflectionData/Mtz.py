@@ -1,9 +1,50 @@
 import os
+import tempfile
 
 import numpy as np
 from iotbx import mtz
 
 from .ReflectionBase import *
+from .MtzMap import MtzMap
+
+# attributes of MtzParser filled from (+)/(-) column pairs, by the keys of MtzParser.sort_column_types
+_lazy_pair_columns = {'_F_ano': 'F_ano',
+                      '_sigF_ano': 'sigF_ano',
+                      '_I_ano': 'I_ano',
+                      '_sigI_ano': 'sigI_ano'}
+
+# attributes of MtzParser filled from single non-standard columns, by the keys of MtzParser.sort_column_types
+_lazy_single_columns = {'_Fobs_refmac': 'Fobs_refmac',
+                        '_Fcalc_refmac': 'Fcalc_refmac',
+                        '_FP_refmac': 'FP',
+                        '_FC_refmac': 'FC',
+                        '_FC_ALL_refmac': 'FC_ALL',
+                        '_FC_ALL_LS_refmac': 'FC_ALL_LS',
+                        '_FOM_refmac': 'FOM',
+                        '_Fobs_phenix': 'Fobs_phenix',
+                        '_Fcalc_phenix': 'Fcalc_phenix',
+                        '_Fobs_meta_phenix': 'Fobs_meta_phenix',
+                        '_Fmodel_phenix': 'Fmodel_phenix'}
+
+
+class LazyColumn(TableColumn):
+    """Descriptor for a column of MtzParser that is only decoded on first access.
+
+    MtzParser.read registers the column indices in _pending_columns. The first read of the attribute decodes the
+    column through _extract_column and stores it in the reflection table. An explicit assignment replaces any
+    pending column.
+    """
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if self._name in obj._pending_columns:
+            obj._table[self._column] = obj._extract_column(obj._pending_columns.pop(self._name))
+        return super(LazyColumn, self).__get__(obj, objtype)
+
+    def __set__(self, obj, value):
+        obj._pending_columns.pop(self._name, None)
+        super(LazyColumn, self).__set__(obj, value)
 
 
 class MtzParser(ReflectionParser):
@@ -11,106 +52,323 @@ class MtzParser(ReflectionParser):
     The Parser class to process mtz files.
     """
 
+    _F = LazyColumn()
+    _sigF = LazyColumn()
+    _I = LazyColumn()
+    _sigI = LazyColumn()
+    _F_ano = LazyColumn()
+    _sigF_ano = LazyColumn()
+    _I_ano = LazyColumn()
+    _sigI_ano = LazyColumn()
+    _Fobs_refmac = LazyColumn()
+    _Fcalc_refmac = LazyColumn()
+    _FP_refmac = LazyColumn()
+    _FC_refmac = LazyColumn()
+    _FC_ALL_refmac = LazyColumn()
+    _FC_ALL_LS_refmac = LazyColumn()
+    _FOM_refmac = LazyColumn()
+    _Fobs_phenix = LazyColumn()
+    _Fcalc_phenix = LazyColumn()
+    _Fobs_meta_phenix = LazyColumn()
+    _Fmodel_phenix = LazyColumn()
+
     def __init__(self):
+        self._pending_columns = {}
         super(MtzParser, self).__init__()
+        self._mtz_obj = None
+        self._mtz_map_obj = None
+        self._dataset_id = None
+        self._observation_cidx = {}
+        self._batch_headers = None
+        self._batch = None
+        self._m_isym = None
         self._Fobs_refmac = None
         self._Fcalc_refmac = None
 
-    def read(self, filename: str = None):
+    def read(self, filename: str = None, dataset_id: int = None):
         """Read the given mtz file
 
-        :param filename: File name or path to the file
+        :param filename: File name or path to the file, or in-memory file content
+        :param dataset_id: Optional. Read only the columns of this dataset, with the cell of the dataset.
+                           Default: the first columns of each type, with the global cell.
         :return: None
         """
-        if not os.path.exists(filename):
+        if not is_in_memory(filename) and not os.path.exists(filename):
             raise FileNotFoundError('{0} does not exist'.format(filename))
-        # use iotbx.mtz to read mtz file
-        self._obj = mtz.object(file_name=filename)
-        #self._space_group = self._obj.space_group()
-        columns = [_ for _ in self._obj.columns()]
-        cidx = self.sort_column_types(self._obj.column_types(), self._obj.column_labels())
+        # map the data block of the mtz file. columns are only decoded when extracted.
+        self._mtz_map = MtzMap()
+        self._mtz_map.read(filename)
+        self._filename = filename
         if self._batch_exits():
             self._read_batch()
-        # read h, k, l
-        # h = columns[cidx[0][0]].extract_values().as_numpy_array()
-        # k = columns[cidx[0][1]].extract_values().as_numpy_array()
-        # l = columns[cidx[0][2]].extract_values().as_numpy_array()
-        # self._hkl = np.array([h, k, l]).T
-        self._hkl = np.array(self._obj.extract_miller_indices())
-        # one line
-        # read structure amplitude
+        self._hkl = self._mtz_map.miller_indices()
+        self._read_columns(dataset_id)
+
+    def split_datasets(self) -> Dict[str, 'MtzParser']:
+        """Split a multi-dataset mtz file, e.g. of several wavelengths or crystals, into one parser per dataset.
+        The parsers share the mapped file and the Miller indices. Each has its own reflection table and computes
+        the resolutions from the cell of its dataset.
+
+        :return: Parsers of the datasets with observations, by 'crystal/dataset' name.
+        :rtype: dict
+        """
+        column_dataset_ids = set(self._mtz_map.column_dataset_ids())
+        datasets = {}
+        for dataset_id, dataset in sorted(self._mtz_map.datasets.items()):
+            if dataset_id not in column_dataset_ids:
+                continue
+            reflection_data = MtzParser()
+            reflection_data._mtz_map = self._mtz_map
+            reflection_data._mtz_obj = self._mtz_obj
+            reflection_data._filename = self._filename
+            reflection_data._hkl = self._hkl
+            reflection_data._batch_headers = self._batch_headers
+            reflection_data._batch = self._batch
+            reflection_data._m_isym = self._m_isym
+            reflection_data.source_data_format = self.source_data_format
+            reflection_data._read_columns(dataset_id)
+            if reflection_data._observation_cidx:
+                datasets['{0}/{1}'.format(dataset.get('crystal', ''), dataset.get('dataset', dataset_id))] \
+                    = reflection_data
+        return datasets
+
+    def _read_columns(self, dataset_id: int = None):
+        """Register the recognised observation columns, of one dataset if given, and compute the resolutions.
+
+        :param dataset_id: Optional. Id of the dataset.
+        :return: None
+        """
+        self._dataset_id = dataset_id
+        column_types = self._mtz_map.column_types()
+        column_labels = self._mtz_map.column_labels()
+        if dataset_id is not None:
+            # the columns of the other datasets are not recognised
+            in_dataset = [_ == dataset_id for _ in self._mtz_map.column_dataset_ids()]
+            column_types = [t if keep else '' for t, keep in zip(column_types, in_dataset)]
+            column_labels = [label if keep else '' for label, keep in zip(column_labels, in_dataset)]
+        cidx = self.sort_column_types(column_types, column_labels)
+        # register the recognised columns. they are decoded on first access and cached afterwards.
+        self._pending_columns = {}
+        self._observation_cidx = {}
         if self.column_exits(cidx['F']):
-            self._F = columns[cidx['F'][0]].extract_values().as_numpy_array()
+            self._pending_columns['_F'] = (cidx['F'][0],)
+            self._observation_cidx['FP'] = int(cidx['F'][0])
             if cidx['F'][0] + 1 in cidx['sig']:  # read F standard deviation if exist
-                self._sigF = columns[cidx['F'][0] + 1].extract_values().as_numpy_array()
-        # read  F(+)/F(-)
-        if self.column_exits(cidx['F_ano']):
-            # Here assumes that F(+) column and F(-) column are adjacent
-            pair_1 = columns[cidx['F_ano'][0]].extract_values().as_numpy_array()
-            pair_2 = columns[cidx['F_ano'][1]].extract_values().as_numpy_array()
-            self._F_ano = np.c_[pair_1, pair_2].flatten()
-        # read standard deviation for  F(+)/F(-)
-        if self.column_exits(cidx['sigF_ano']):
-            pair_1 = columns[cidx['sigF_ano'][0]].extract_values().as_numpy_array()
-            pair_2 = columns[cidx['sigF_ano'][1]].extract_values().as_numpy_array()
-            self._sigF_ano = np.c_[pair_1, pair_2].flatten()
-        # read intensity
+                self._pending_columns['_sigF'] = (cidx['F'][0] + 1,)
         if self.column_exits(cidx['I']):
-            self._I = columns[cidx['I'][0]].extract_values().as_numpy_array()
+            self._pending_columns['_I'] = (cidx['I'][0],)
+            self._observation_cidx['I'] = int(cidx['I'][0])
             if cidx['I'][0] + 1 in cidx['sig']:  # read I standard deviation if exist
-                self._sigI = columns[cidx['I'][0] + 1].extract_values().as_numpy_array()
-        # read I(+)/I(-)
-        if self.column_exits(cidx['I_ano']):
-            # Here assumes that I(+) column and I(-) column are adjacent
-            pair_1 = columns[cidx['I_ano'][0]].extract_values().as_numpy_array()
-            pair_2 = columns[cidx['I_ano'][1]].extract_values().as_numpy_array()
-            self._I_ano = np.c_[pair_1, pair_2].flatten()
-        # read standard deviation for I(+)/I(-)
-        if self.column_exits(cidx['sigI_ano']):
-            pair_1 = columns[cidx['sigI_ano'][0]].extract_values().as_numpy_array()
-            pair_2 = columns[cidx['sigI_ano'][1]].extract_values().as_numpy_array()
-            self._sigI_ano = np.c_[pair_1, pair_2].flatten()
-        # read refmac sfcalc output
-        if self.column_exits(cidx['Fobs_refmac']):
-            self._Fobs_refmac = columns[cidx['Fobs_refmac'][0]].extract_values().as_numpy_array()
-        if self.column_exits(cidx['Fcalc_refmac']):
-            self._Fcalc_refmac = columns[cidx['Fcalc_refmac'][0]].extract_values().as_numpy_array()
-        if self.column_exits(cidx['FP']):
-            self._FP_refmac = columns[cidx['FP'][0]].extract_values().as_numpy_array()
-        if self.column_exits(cidx['FC']):
-            self._FC_refmac = columns[cidx['FC'][0]].extract_values().as_numpy_array()
-        if self.column_exits(cidx['FC_ALL']):
-            self._FC_ALL_refmac = columns[cidx['FC_ALL'][0]].extract_values().as_numpy_array()
-        if self.column_exits(cidx['FC_ALL_LS']):
-            self._FC_ALL_LS_refmac = columns[cidx['FC_ALL_LS'][0]].extract_values().as_numpy_array()
-        if self.column_exits(cidx['FOM']):
-            self._FOM_refmac = columns[cidx['FOM'][0]].extract_values().as_numpy_array()
-        # read phenix.refinement output
-        if self.column_exits(cidx['Fobs_phenix']):
-            self._Fobs_phenix = columns[cidx['Fobs_phenix'][0]].extract_values().as_numpy_array()
-        if self.column_exits(cidx['Fcalc_phenix']):
-            self._Fcalc_phenix = columns[cidx['Fcalc_phenix'][0]].extract_values().as_numpy_array()
-        if self.column_exits(cidx['Fobs_meta_phenix']):
-            self._Fobs_meta_phenix = columns[cidx['Fobs_meta_phenix'][0]].extract_values().as_numpy_array()
-        if self.column_exits(cidx['Fmodel_phenix']):
-            self._Fmodel_phenix = columns[cidx['Fmodel_phenix'][0]].extract_values().as_numpy_array()
+                self._pending_columns['_sigI'] = (cidx['I'][0] + 1,)
+        # Here assumes that the (+) column and the (-) column are adjacent
+        for attr_name, column_key in _lazy_pair_columns.items():
+            if self.column_exits(cidx[column_key]):
+                self._pending_columns[attr_name] = tuple(cidx[column_key][:2])
+                self._observation_cidx.setdefault(column_key, int(cidx[column_key][0]))
+        # refmac and phenix.refinement output
+        for attr_name, column_key in _lazy_single_columns.items():
+            if self.column_exits(cidx[column_key]):
+                self._pending_columns[attr_name] = (cidx[column_key][0],)
         # read resolution
-        self._resolution = np.array(self._obj.crystals()[0].unit_cell().d(self._obj.extract_miller_indices()))
-        self._filename = filename
+        self._set_resolution('', self._hkl, self.get_cell())
+
+    def get_cell(self) -> tuple[float, float, float, float, float, float]:
+        """
+        :return: unit cell parameters of the dataset read, the global cell if no dataset was selected or the
+                 dataset has no cell
+        :rtype: tuple
+        """
+        cell = self._mtz_map.datasets.get(self._dataset_id, {}).get('cell')
+        if self._dataset_id is None or cell is None or not any(cell):
+            return self._mtz_map.cell
+        return cell
+
+    def get_miller_array(self, observation_type):
+        """For a single dataset, the miller array of the observation column read is returned.
+
+        :param observation_type: Can be either 'FP' or 'I'.
+        :return: Miller array corresponding to the given column label
+        """
+        if self._dataset_id is None or observation_type not in self._observation_cidx:
+            return super(MtzParser, self).get_miller_array(observation_type)
+        label = self._mtz_map.column_labels()[self._observation_cidx[observation_type]]
+        for ma in self._obj.as_miller_arrays():
+            if label in ma.info().labels:
+                return ma
+        raise ValueError('Non-standard colum label')
+
+    def _column_dtype(self) -> np.dtype:
+        """
+        :return: float type of the decoded columns, float64 unless a lower precision is set with set_precision
+        :rtype: numpy.dtype
+        """
+        return np.dtype(np.float64) if self._table.dtype is None else self._table.dtype
+
+    def _extract_column(self, column_cidx: tuple[int, ...]) -> np.ndarray[Literal["N"], np.float64]:
+        """Decode a single column or an interleaved (+)/(-) column pair.
+
+        :param column_cidx: Index of a single column, or indices of the (+) and (-) columns.
+        :return: Decoded column.
+        :rtype: 1d ndarray
+        """
+        if len(column_cidx) == 2:
+            return self._interleave_pair(column_cidx)
+        return self._mtz_map.extract(column_cidx[0], dtype=self._column_dtype())
+
+    def _interleave_pair(self, pair_cidx: np.ndarray[Literal[2], np.int_]) -> np.ndarray[Literal["N"], np.float64]:
+        """Decode a (+)/(-) column pair directly into one interleaved array.
+
+        :param pair_cidx: Indices of the (+) and (-) columns.
+        :return: Interleaved array of (+) and (-) values.
+        :rtype: 1d ndarray
+        """
+        dtype = self._column_dtype()
+        pair = np.empty((self._mtz_map.nref, 2), dtype=dtype)
+        pair[:, 0] = self._mtz_map.extract(pair_cidx[0], dtype=dtype)
+        pair[:, 1] = self._mtz_map.extract(pair_cidx[1], dtype=dtype)
+        return pair.reshape(-1)
+
+    @property
+    def _obj(self) -> mtz.object:
+        """
+        :return: iotbx mtz object, only constructed when cctbx functionality is needed (miller arrays, writing)
+        :rtype: iotbx.mtz.object
+        """
+        if self._mtz_obj is None and self._filename is not None:
+            if not is_in_memory(self._filename) and compression_suffix(self._filename) is None:
+                self._mtz_obj = mtz.object(file_name=self._filename)
+            else:
+                # iotbx reads from disk only. the object is held in memory, so the temporary file is removed again.
+                with tempfile.NamedTemporaryFile(suffix='.mtz') as tmp:
+                    tmp.write(read_reflection_file(self._filename))
+                    tmp.flush()
+                    self._mtz_obj = mtz.object(file_name=tmp.name)
+        return self._mtz_obj
+
+    @_obj.setter
+    def _obj(self, _):
+        self._mtz_obj = _
+
+    @property
+    def _mtz_map(self) -> MtzMap:
+        """
+        :return: memory-mapped mtz file, mapped again on first use after restoring from a reflection cache
+        :rtype: MtzMap
+        """
+        if self._mtz_map_obj is None and self._filename is not None:
+            self._mtz_map_obj = MtzMap()
+            self._mtz_map_obj.read(self._filename)
+        return self._mtz_map_obj
+
+    @_mtz_map.setter
+    def _mtz_map(self, _):
+        self._mtz_map_obj = _
+
+    def _cache_state(self) -> Dict[str, Any]:
+        """Decode all pending columns, so that they are cached as well. The mapped file and the iotbx object are
+        not cached.
+
+        :return: The attributes to be stored in a reflection cache.
+        :rtype: dict
+        """
+        for attr_name in list(self._pending_columns):
+            getattr(self, attr_name)
+        state = super(MtzParser, self)._cache_state()
+        for name in ('_mtz_map_obj', '_mtz_obj', '_pending_columns'):
+            state.pop(name, None)
+        return state
 
     def _batch_exits(self) -> bool:
         """
         :return: Check whether the batch data exists.
         :rtype: bool
         """
-        if self._obj.batches().size() == 0:
+        if self._mtz_map.nbatch == 0:
             return False
         else:
             return True
 
     def _read_batch(self):
-        # TODO:
-        pass
+        """Read the batch headers and the BATCH and M/ISYM columns of unmerged data.
+
+        :return: None
+        """
+        self._batch_headers = self._mtz_map.batch_headers
+        column_types = self._mtz_map.column_types()
+        if 'B' in column_types:
+            self._batch = self._mtz_map.column(column_types.index('B')).astype(np.int32)
+        if 'Y' in column_types:
+            self._m_isym = self._mtz_map.column(column_types.index('Y')).astype(np.int32)
+
+    def get_batch(self) -> np.ndarray[Literal["N"], np.int32] | None:
+        """
+        :return: batch numbers of the observations, None for merged data
+        :rtype: 1d ndarray
+        """
+        return self._batch
+
+    def get_m_isym(self) -> np.ndarray[Literal["N"], np.int32] | None:
+        """
+        :return: M/ISYM of the observations, the partial flag times 256 plus the symmetry number, None for merged data
+        :rtype: 1d ndarray
+        """
+        return self._m_isym
+
+    def get_batch_headers(self) -> np.ndarray | None:
+        """
+        :return: batch number, phi_start, phi_end and dataset_id of each batch, None for merged data
+        :rtype: 1d structured ndarray
+        """
+        return self._batch_headers
+
+    def batch_header_index(self) -> np.ndarray[Literal["N"], np.int_]:
+        """Find the batch header of each observation, e.g. to get its phi range or dataset id with
+        get_batch_headers()[batch_header_index()].
+
+        :return: index into the batch headers for each observation, -1 for batches without header
+        :rtype: 1d ndarray
+        :raises ValueError: if the observations have no batch numbers, e.g. for merged data
+        """
+        if self._batch is None:
+            raise ValueError('{0} has no BATCH column. Merged data have no batch headers.'.format(
+                source_name(self._filename)))
+        if self._batch_headers is None or self._batch_headers.size == 0:
+            return np.full(self._batch.size, -1)
+        order = np.argsort(self._batch_headers['batch'], kind='stable')
+        sorted_batches = self._batch_headers['batch'][order]
+        pos = np.searchsorted(sorted_batches, self._batch).clip(max=sorted_batches.size - 1)
+        return np.where(sorted_batches[pos] == self._batch, order[pos], -1)
+
+    def sum_by_batch(self, values: np.ndarray[Literal["N"], np.float32]) \
+            -> tuple[np.ndarray[Literal["M"], np.int32], np.ndarray[Literal["M"], np.float64],
+                     np.ndarray[Literal["M"], np.int_]]:
+        """Aggregate per-observation values by batch without looping over the batches.
+
+        :param values: One value per observation, e.g. intensities.
+        :return: batch numbers, sums of the values in float64 and numbers of observations, one entry per batch
+        :rtype: tuple
+        """
+        batches, inverse, counts = np.unique(self._batch, return_inverse=True, return_counts=True)
+        return batches, np.bincount(inverse, weights=values, minlength=batches.size), counts
+
+    def mean_by_batch(self, values: np.ndarray[Literal["N"], np.float32]) \
+            -> tuple[np.ndarray[Literal["M"], np.int32], np.ndarray[Literal["M"], np.float64]]:
+        """
+        :param values: One value per observation, e.g. intensities.
+        :return: batch numbers and means of the values in each batch
+        :rtype: tuple
+        """
+        batches, sums, counts = self.sum_by_batch(values)
+        return batches, sums / counts
+
+    def write_filtered(self, outputs: Dict[str, np.ndarray[Literal["N"], np.bool_]]):
+        """Write filtered copies of the mtz file, e.g. without NEMOs or without reflections in ice rings. All outputs
+        are written in one pass over the data block. The parsed data are not modified.
+
+        :param outputs: Keep-masks over all reflections of the file by output file name. True keeps the row.
+        :return: None
+        """
+        self._mtz_map.write_filtered(outputs)
 
     @staticmethod
     def column_exits(cidx) -> bool:
@@ -129,7 +387,7 @@ class MtzParser(ReflectionParser):
         :return: a list of column types
         :rtype: list
         """
-        return self._obj.column_types()
+        return self._mtz_map.column_types()
 
     @filename_check
     def get_column_list(self) -> list[str, ...]:
@@ -137,7 +395,7 @@ class MtzParser(ReflectionParser):
         :return: a list of column labels
         :rtype: list
         """
-        return self._obj.column_labels()
+        return self._mtz_map.column_labels()
 
     @filename_check
     def get_space_group(self) -> str:
@@ -153,7 +411,7 @@ class MtzParser(ReflectionParser):
         :return: Maximum resolution
         :rtype: float
         """
-        return self._obj.max_min_resolution()[1]
+        return self._resolution.min()
 
     @filename_check
     def get_min_resolution(self) -> float:
@@ -161,7 +419,7 @@ class MtzParser(ReflectionParser):
         :return: minimum resolution
         :rtype: float
         """
-        return self._obj.max_min_resolution()[0]
+        return self._resolution.max()
 
     @staticmethod
     def sort_column_types(column_types_list: list[str, ...], column_labels_list: list[str, ...]) \
@@ -195,8 +453,9 @@ class MtzParser(ReflectionParser):
         fom_refmac_cidx = np.argwhere(column_labels == 'FOM').flatten()  # refmac general output
         # phenix.refinement
         fobs_meta_phenix_cidx = np.argwhere(column_labels == 'F-obs').flatten()
-        fmodel_phenix_cidx = np.argwhere(column_labels == 'F-model').flatten() or \
-                             np.argwhere(column_labels == 'F-model_xray').flatten()
+        fmodel_phenix_cidx = np.argwhere(column_labels == 'F-model').flatten()
+        if fmodel_phenix_cidx.size == 0:
+            fmodel_phenix_cidx = np.argwhere(column_labels == 'F-model_xray').flatten()
         fobs_phenix_cidx = np.argwhere(column_labels == 'FOBS').flatten()
         fcalc_phenix_cidx = np.argwhere(column_labels == 'FCALC').flatten()
         cidx = {'indices': miller_cidx,
@@ -0,0 +1,471 @@
+import os
+import shlex
+from typing import Literal, Dict
+
+import numpy as np
+
+from .Compression import compression_suffix, is_in_memory, open_reflection_file, read_reflection_file, source_name
+
+
+_MTZ_MAGIC = b'MTZ '
+_MTZ_RECORD_LENGTH = 80
+_MTZ_DATA_OFFSET = 80  # the reflection data block starts at word 21
+_MTZ_BATCH_INTEGERS = {'dataset_id': 20}
+_MTZ_BATCH_REALS = {'phi_start': 36, 'phi_end': 37}
+
+# decoded batch headers
+batch_header_dtype = np.dtype([('batch', np.int32), ('phi_start', np.float32), ('phi_end', np.float32),
+                               ('dataset_id', np.int32)])
+
+
+class MtzMap(object):
+    """Memory-mapped reader for the reflection data block of mtz files.
+
+    The header records are parsed directly and the data block is mapped with numpy.memmap. Each column is exposed as
+    a strided float32 view into the file. Values are only decoded and copied when a column is extracted.
+    """
+
+    def __init__(self):
+        self._filename = None
+        self._data = None
+        self._byte_order = None
+        self._ncol = None
+        self._nref = None
+        self._nbatch = None
+        self._cell = None
+        self._space_group_number = None
+        self._space_group_name = None
+        self._point_group_name = None
+        self._missing_value = np.nan
+        self._resolution_range = None
+        self._column_labels = []
+        self._column_types = []
+        self._column_dataset_ids = []
+        self._datasets = {}
+        self._batch_numbers = []
+        self._batch_headers = np.zeros(0, dtype=batch_header_dtype)
+        self._header_offset = None
+        self._stamp = None
+        self._header = None
+
+    def read(self, filename: str):
+        """Parse the header of the given mtz file and map its data block.
+
+        :param filename: File name or path to the file, or in-memory file content
+        :return: None
+        """
+        if not is_in_memory(filename) and not os.path.exists(filename):
+            raise FileNotFoundError('{0} does not exist'.format(filename))
+        if is_in_memory(filename) or compression_suffix(filename) is not None:
+            # compressed files cannot be mapped. the data block is decompressed into memory instead.
+            # uncompressed in-memory content is used as the buffer directly.
+            buffer = read_reflection_file(filename)
+            self._parse_header(bytes(buffer[self._parse_stamp(bytes(buffer[:20]), filename):]))
+            self._data = np.ndarray(shape=(self._nref, self._ncol), dtype=np.dtype(self._byte_order + 'f4'),
+                                    buffer=buffer, offset=_MTZ_DATA_OFFSET)
+        else:
+            self.read_header(filename)
+            self._data = np.memmap(filename, dtype=np.dtype(self._byte_order + 'f4'), mode='r',
+                                   offset=_MTZ_DATA_OFFSET, shape=(self._nref, self._ncol))
+        self._filename = filename
+
+    def read_header(self, filename: str):
+        """Parse only the header records of the given mtz file. The data block is not read. For compressed files
+        the data block is decompressed and discarded while seeking to the header.
+
+        :param filename: File name or path to the file
+        :return: None
+        """
+        with open_reflection_file(filename, 'rb') as f:
+            f.seek(self._parse_stamp(f.read(20), filename))
+            self._parse_header(f.read())
+        self._filename = filename
+
+    def _parse_stamp(self, stamp: bytes, filename: str) -> int:
+        """Check the file type and read the byte order and the header position from the first 20 bytes.
+
+        :param stamp: The first 20 bytes of the file.
+        :param filename: File name, used in the error message.
+        :return: Byte offset of the header records.
+        :rtype: int
+        """
+        if stamp[:4] != _MTZ_MAGIC:
+            raise AssertionError('{0} is not an mtz file.'.format(source_name(filename)))
+        self._stamp = stamp
+        self._byte_order = '>' if (stamp[8] >> 4) == 1 else '<'
+        header_word = int(np.frombuffer(stamp[4:8], dtype=self._byte_order + 'i4')[0])
+        if header_word == -1:  # 64-bit header position for files larger than 8 GB
+            header_word = int(np.frombuffer(stamp[12:20], dtype=self._byte_order + 'i8')[0])
+        self._header_offset = (header_word - 1) * 4
+        return self._header_offset
+
+    def _parse_header(self, header: bytes):
+        """Parse the 80-character header records up to END.
+
+        :param header: Raw bytes from the header position to the end of the file.
+        :return: None
+        """
+        self._header = header
+        for pos in range(0, len(header), _MTZ_RECORD_LENGTH):
+            record = header[pos:pos + _MTZ_RECORD_LENGTH].decode('ascii', 'replace')
+            key = record[:4].upper()
+            if key == 'END ' or record.rstrip().upper() == 'END':
+                if self._nbatch:
+                    self._parse_batch_headers(header, pos + _MTZ_RECORD_LENGTH)
+                break
+            fields = record.split()
+            if key == 'NCOL':
+                self._ncol, self._nref, self._nbatch = int(fields[1]), int(fields[2]), int(fields[3])
+            elif key == 'CELL':
+                self._cell = tuple(float(_) for _ in fields[1:7])
+            elif key == 'SYMI':
+                syminf = shlex.split(record[6:])
+                self._space_group_number = int(syminf[3])
+                self._space_group_name = syminf[4]
+                self._point_group_name = syminf[5] if len(syminf) > 5 else None
+            elif key == 'RESO':
+                self._resolution_range = (float(fields[1]), float(fields[2]))
+            elif key == 'VALM':
+                self._missing_value = np.nan if fields[1].upper() == 'NAN' else float(fields[1])
+            elif key == 'COLU':
+                self._column_labels.append(fields[1])
+                self._column_types.append(fields[2])
+                self._column_dataset_ids.append(int(fields[5]) if len(fields) > 5 else 0)
+            elif key in ('PROJ', 'CRYS', 'DATA', 'DCEL', 'DWAV'):
+                dataset_id = int(fields[1])
+                dataset = self._datasets.setdefault(dataset_id, {'id': dataset_id})
+                if key == 'PROJ':
+                    dataset['project'] = ' '.join(fields[2:])
+                elif key == 'CRYS':
+                    dataset['crystal'] = ' '.join(fields[2:])
+                elif key == 'DATA':
+                    dataset['dataset'] = ' '.join(fields[2:])
+                elif key == 'DCEL':
+                    dataset['cell'] = tuple(float(_) for _ in fields[2:8])
+                else:
+                    dataset['wavelength'] = float(fields[2])
+            elif key == 'BATC':
+                self._batch_numbers.extend(int(_) for _ in fields[1:])
+        if self._ncol is None or len(self._column_labels) != self._ncol:
+            raise AssertionError('Corrupted mtz header.')
+
+    def _parse_batch_headers(self, header: bytes, start: int):
+        """Decode the batch headers following MTZBATS. Each batch is a BH record, a TITLE record, the integer and
+        real words of the orientation block and a BHCH record. If all batches have the same layout, which is the
+        common case, all headers are decoded with one structured numpy view.
+
+        :param header: Raw bytes from the header position to the end of the file.
+        :param start: Position after the END record.
+        :return: None
+        """
+        start = header.find(b'MTZBATS', start)
+        while start >= 0 and start % _MTZ_RECORD_LENGTH != 0:
+            start = header.find(b'MTZBATS', start + 1)
+        if start < 0:
+            return
+        start += _MTZ_RECORD_LENGTH
+        fields = header[start:start + _MTZ_RECORD_LENGTH].split()
+        nwords, nintegers, nreals = int(fields[2]), int(fields[3]), int(fields[4])
+        record = np.dtype([('bh', 'S80'), ('title', 'S80'),
+                           ('integers', self._byte_order + 'i4', (nintegers,)),
+                           ('reals', self._byte_order + 'f4', (nreals,)), ('bhch', 'S80')])
+        if nwords == nintegers + nreals and len(header) - start >= self._nbatch * record.itemsize:
+            records = np.frombuffer(header, dtype=record, count=self._nbatch, offset=start)
+            if np.char.startswith(records['bh'], b'BH').all():
+                self._batch_headers = self._batch_header_array(records)
+                return
+        # batches of different layouts are decoded one by one
+        headers = []
+        for _ in range(self._nbatch):
+            fields = header[start:start + _MTZ_RECORD_LENGTH].split()
+            if not fields or fields[0] != b'BH':
+                raise AssertionError('Corrupted mtz batch header.')
+            nintegers, nreals = int(fields[3]), int(fields[4])
+            record = np.dtype([('bh', 'S80'), ('title', 'S80'),
+                               ('integers', self._byte_order + 'i4', (nintegers,)),
+                               ('reals', self._byte_order + 'f4', (nreals,)), ('bhch', 'S80')])
+            headers.append(self._batch_header_array(np.frombuffer(header, dtype=record, count=1, offset=start)))
+            start += record.itemsize
+        self._batch_headers = np.concatenate(headers)
+
+    @staticmethod
+    def _batch_header_array(records: np.ndarray) -> np.ndarray:
+        """
+        :param records: Raw batch header records.
+        :return: batch number, phi range and dataset id of the batches
+        :rtype: 1d structured ndarray
+        """
+        batch_headers = np.zeros(records.shape[0], dtype=batch_header_dtype)
+        # BH records are written as 'BH %8d%8d%8d%8d'
+        bh = np.ascontiguousarray(records['bh']).view([('key', 'S3'), ('batch', 'S8'), ('sizes', 'S69')])
+        batch_headers['batch'] = bh['batch'].astype(np.int32)
+        for name, idx in _MTZ_BATCH_INTEGERS.items():
+            batch_headers[name] = records['integers'][:, idx]
+        for name, idx in _MTZ_BATCH_REALS.items():
+            batch_headers[name] = records['reals'][:, idx]
+        return batch_headers
+
+    def write_filtered(self, outputs: Dict[str, np.ndarray[Literal["N"], np.bool_]], chunk_size: int = 1 << 16):
+        """Write one mtz file per keep-mask in a single pass over the data block. Each chunk of rows is read once
+        and the kept rows are appended to every output as raw bytes. The header records are copied with the number of
+        reflections, the column ranges and the resolution range updated. History and batch headers are copied unchanged. The mapped file
+        is not modified.
+
+        :param outputs: Keep-masks over all reflections by output file name. True keeps the row. An output must
+                        not be the source file.
+        :param chunk_size: Number of rows read at once. Default: 65536.
+        :return: None
+        """
+        masks = {}
+        for filename, keep in outputs.items():
+            keep = np.asarray(keep, dtype=bool)
+            if keep.shape != (self._nref,):
+                raise AssertionError('Keep-mask for {0} does not match the {1} reflections.'.format(filename,
+                                                                                                 self._nref))
+            # the source is still read while the outputs are written
+            if not is_in_memory(self._filename) and os.path.exists(filename) \
+                    and os.path.samefile(filename, self._filename):
+                raise AssertionError('{0} is the source file {1} and cannot be overwritten.'.format(filename,
+                                                                                                 self._filename))
+            masks[filename] = keep
+        ranges = {filename: (np.full(self._ncol, np.inf), np.full(self._ncol, -np.inf)) for filename in masks}
+        # the inverse resolution squared range of the kept rows, for the RESO record
+        reso_ranges = {filename: np.array([np.inf, -np.inf]) for filename in masks}
+        hkl_columns = [self.column_index(_) for _ in ('H', 'K', 'L')]
+        # imported here, so that the mtz map itself does not depend on cctbx
+        from .ReflectionBase import reciprocal_metric_tensor
+        reciprocal_metric = reciprocal_metric_tensor(self._cell)
+        files = {}
+        try:
+            for filename, keep in masks.items():
+                files[filename] = open(filename, 'wb')
+                files[filename].write(self._filtered_stamp(int(np.count_nonzero(keep))))
+            for start in range(0, self._nref, chunk_size):
+                chunk = np.asarray(self._data[start:start + chunk_size])
+                # missing values do not count for the column ranges
+                values = chunk.astype(np.float64)
+                if not np.isnan(self._missing_value):
+                    values[values == self._missing_value] = np.nan
+                hkl = values[:, hkl_columns]
+                invresolsq = ((hkl @ reciprocal_metric) * hkl).sum(axis=1)
+                for filename, keep in masks.items():
+                    kept = keep[start:start + chunk_size]
+                    files[filename].write(chunk[kept].tobytes())
+                    if kept.any():
+                        low, high = ranges[filename]
+                        np.fmin(low, np.fmin.reduce(values[kept], axis=0), out=low)
+                        np.fmax(high, np.fmax.reduce(values[kept], axis=0), out=high)
+                        reso = reso_ranges[filename]
+                        reso[0] = np.fmin(reso[0], np.fmin.reduce(invresolsq[kept]))
+                        reso[1] = np.fmax(reso[1], np.fmax.reduce(invresolsq[kept]))
+            for filename, keep in masks.items():
+                files[filename].write(self._filtered_header(int(np.count_nonzero(keep)), *ranges[filename],
+                                                            reso_ranges[filename]))
+        finally:
+            for f in files.values():
+                f.close()
+
+    def _filtered_stamp(self, nref: int) -> bytes:
+        """
+        :param nref: Number of reflections written.
+        :return: the first 80 bytes of a file with nref reflections, pointing to the header behind the data block
+        :rtype: bytes
+        """
+        header_word = (_MTZ_DATA_OFFSET + nref * self._ncol * 4) // 4 + 1
+        stamp = bytearray(_MTZ_DATA_OFFSET)
+        stamp[:12] = self._stamp[:12]
+        if header_word > np.iinfo(np.int32).max or \
+                int(np.frombuffer(self._stamp[4:8], dtype=self._byte_order + 'i4')[0]) == -1:
+            stamp[4:8] = np.array(-1, dtype=self._byte_order + 'i4').tobytes()
+            stamp[12:20] = np.array(header_word, dtype=self._byte_order + 'i8').tobytes()
+        else:
+            stamp[4:8] = np.array(header_word, dtype=self._byte_order + 'i4').tobytes()
+        return bytes(stamp)
+
+    def _filtered_header(self, nref: int, low: np.ndarray[Literal["N"], np.float64],
+                         high: np.ndarray[Literal["N"], np.float64],
+                         reso: np.ndarray[Literal[2], np.float64]) -> bytes:
+        """
+        :param nref: Number of reflections written.
+        :param low: Smallest value of each column in the written rows.
+        :param high: Largest value of each column in the written rows.
+        :param reso: Smallest and largest inverse resolution squared of the written rows.
+        :return: the header records with updated NCOL, RESO and COLUMN records, followed by the unchanged remainder
+        :rtype: bytes
+        """
+        records = []
+        cidx = 0
+        for pos in range(0, len(self._header), _MTZ_RECORD_LENGTH):
+            record = self._header[pos:pos + _MTZ_RECORD_LENGTH]
+            key = record[:4].upper()
+            if key == b'END ' or record.rstrip().upper() == b'END':
+                return b''.join(records) + self._header[pos:]
+            if key == b'NCOL':
+                record = 'NCOL {0:8d} {1:12d} {2:8d}'.format(self._ncol, nref, self._nbatch or 0).encode('ascii')
+            elif key == b'RESO' and reso[0] <= reso[1]:
+                record = 'RESO {0:<20.12g} {1:<20.12g}'.format(*reso).encode('ascii')
+            elif key == b'COLU':
+                # columns without any value keep a range of 0 0
+                column_range = (low[cidx], high[cidx]) if low[cidx] <= high[cidx] else (0., 0.)
+                column = 'COLUMN {0:<30s} {1} {2:17.9g} {3:17.9g} {4:4d}'.format(
+                    self._column_labels[cidx], self._column_types[cidx], *column_range,
+                    self._column_dataset_ids[cidx]).encode('ascii')
+                if len(column) <= _MTZ_RECORD_LENGTH:
+                    record = column
+                cidx += 1
+            records.append(record.ljust(_MTZ_RECORD_LENGTH))
+        raise AssertionError('Corrupted mtz header.')
+
+    def column_index(self, label: str) -> int:
+        """
+        :return: index of the column with the given label
+        :rtype: int
+        """
+        try:
+            return self._column_labels.index(label)
+        except ValueError:
+            raise KeyError('No column labelled {0}.'.format(label))
+
+    def column(self, idx: int | str) -> np.ndarray[Literal["N"], np.float32]:
+        """Return a read-only strided view of a column. Missing values are left untouched.
+
+        :param idx: Column index or label.
+        :return: View of the column into the mapped file.
+        :rtype: 1d ndarray
+        """
+        if isinstance(idx, str):
+            idx = self.column_index(idx)
+        return self._data[:, idx]
+
+    def extract(self, idx: int | str, not_a_number_substitute: float = 0.,
+                dtype: type = np.float32) -> np.ndarray[Literal["N"], np.float32]:
+        """Decode a column into memory. Missing values are replaced as done by iotbx.mtz extract_values().
+
+        :param idx: Column index or label.
+        :param not_a_number_substitute: Value used for missing entries. Default: 0.
+        :param dtype: Float type of the decoded column. Default: np.float32, the type stored in the file.
+        :return: Decoded column in native byte order.
+        :rtype: 1d ndarray
+        """
+        values = self.column(idx).astype(dtype)
+        values[self.missing(idx)] = not_a_number_substitute
+        return values
+
+    def missing(self, idx: int | str) -> np.ndarray[Literal["N"], np.bool_]:
+        """
+        :return: flags of missing values in the given column
+        :rtype: 1d ndarray
+        """
+        column = self.column(idx)
+        if np.isnan(self._missing_value):
+            return np.isnan(column)
+        return np.isnan(column) | (column == self._missing_value)
+
+    def miller_indices(self) -> np.ndarray[Literal["N", 3], np.int_]:
+        """
+        :return: hkl indices read from the first three columns of type H
+        :rtype: Nx3 ndarray
+        """
+        hkl_cidx = [i for i, t in enumerate(self._column_types) if t == 'H'][:3]
+        return self._data[:, hkl_cidx].astype(int)
+
+    @property
+    def file_name(self) -> str:
+        """
+        :return: file or path to file, '<memory>' for in-memory input
+        :rtype: str
+        """
+        return source_name(self._filename)
+
+    @property
+    def nref(self) -> int:
+        """
+        :return: number of reflections
+        :rtype: int
+        """
+        return self._nref
+
+    @property
+    def nbatch(self) -> int:
+        """
+        :return: number of batches
+        :rtype: int
+        """
+        return self._nbatch
+
+    @property
+    def cell(self) -> tuple[float, float, float, float, float, float]:
+        """
+        :return: global unit cell parameters (a, b, c, alpha, beta, gamma)
+        :rtype: tuple
+        """
+        return self._cell
+
+    @property
+    def space_group_number(self) -> int:
+        """
+        :return: space group number
+        :rtype: int
+        """
+        return self._space_group_number
+
+    @property
+    def space_group_name(self) -> str:
+        """
+        :return: space group symbol
+        :rtype: str
+        """
+        return self._space_group_name
+
+    @property
+    def resolution_range(self) -> tuple[float, float]:
+        """
+        :return: (min, max) inverse resolution squared recorded in the header
+        :rtype: tuple
+        """
+        return self._resolution_range
+
+    @property
+    def batch_headers(self) -> np.ndarray:
+        """
+        :return: batch number, phi_start, phi_end and dataset_id of each batch, empty for merged files
+        :rtype: 1d structured ndarray
+        """
+        return self._batch_headers
+
+    @property
+    def datasets(self) -> Dict[int, dict]:
+        """
+        :return: project, crystal, dataset names, cell and wavelength by dataset id
+        :rtype: dict
+        """
+        return self._datasets
+
+    @property
+    def batch_numbers(self) -> list[int, ...]:
+        """
+        :return: batch numbers listed in the header
+        :rtype: list
+        """
+        return self._batch_numbers
+
+    def column_labels(self) -> list[str, ...]:
+        """
+        :return: a list of column labels
+        :rtype: list
+        """
+        return self._column_labels
+
+    def column_types(self) -> list[str, ...]:
+        """
+        :return: a list of column types
+        :rtype: list
+        """
+        return self._column_types
+
+    def column_dataset_ids(self) -> list[int, ...]:
+        """
+        :return: a list of the dataset ids of the columns
+        :rtype: list
+        """
+        return self._column_dataset_ids
@@ -3,6 +3,10 @@ from cctbx import sgtbx
 
 from .ReflectionBase import *
 
+# the items of each data record in INTEGRATE.HKL
+_integrate_hkl_items = ['H', 'K', 'L', 'IOBS', 'SIGMA', 'XCAL', 'YCAL', 'ZCAL', 'RLP', 'PEAK', 'CORR', 'MAXC',
+                        'XOBS', 'YOBS', 'ZOBS', 'ALF0', 'BET0', 'ALF1', 'BET1', 'PSI', 'ISEG']
+
 
 class IntegrateHKLPlain(ReflectionParser):
     """Parser for XDS INTEGRATE.HKL..
@@ -15,56 +19,50 @@ class IntegrateHKLPlain(ReflectionParser):
         self._xyz_cal = None
         self._xyz_obs = None
         self._corr_peak = None
-        self._hkl_view = None
 
-    def read_hkl(self, filename: str):
-        """INTEGRATE.HKL reader.
+    def read_hkl(self, filename: str, columns: list[str, ...] = None, chunk_size: int = 1 << 26):
+        """INTEGRATE.HKL reader. The data records are decoded block-wise into preallocated arrays.
 
         :param filename: Filename or path to INTEGRATE.HKL.
+        :param columns: Optional. Names of the columns to keep, e.g. ['H', 'K', 'L', 'XCAL', 'YCAL', 'ZCAL'].
+                        Default: all 21 columns.
+        :param chunk_size: Number of bytes decoded at once. Default: 64 MB.
         :return: None.
         """
-        data = {
-            "H": [],  # 0
-            "K": [],  # 1
-            "L": [],  # 2
-            "IOBS": [],  # 3
-            "SIGMA": [],  # 4
-            "XCAL": [],  # 5
-            "YCAL": [],  # 6
-            "ZCAL": [],  # 7
-            "RLP": [],  # 8
-            "PEAK": [],  # 9
-            "CORR": [],  # 10
-            "MAXC": [],  # 11
-            "XOBS": [],  # 12
-            "YOBS": [],  # 13
-            "ZOBS": [],  # 14
-            "ALF0": [],  # 15
-            "BET0": [],  # 16
-            "ALF1": [],  # 17
-            "BET1": [],  # 18
-            "PSI": [],  # 19
-            "ISEG": []  # 20
-        }
-        with open(filename, 'r') as file:
-            for line in file:
-                if line.startswith('!SPACE_GROUP_NUMBER='):
-                    self._space_group=sgtbx.space_group(sgtbx.space_group_symbols(
-                        int(line.lstrip('!SPACE_GROUP_NUMBER=').strip())
+        if columns is None:
+            columns = _integrate_hkl_items
+        col_idx = [_integrate_hkl_items.index(_) for _ in columns]
+        with open_reflection_file(filename, 'rb') as file:
+            # header
+            n_items = len(_integrate_hkl_items)
+            while True:
+                data_start = file.tell()
+                line = file.readline()
+                if not line.startswith(b'!'):
+                    break
+                if line.startswith(b'!SPACE_GROUP_NUMBER='):
+                    self._space_group = sgtbx.space_group(sgtbx.space_group_symbols(
+                        int(line.decode().lstrip('!SPACE_GROUP_NUMBER=').strip())
                     ))
-                if not line.startswith('!'):
-                    columns = line.strip().split()
-                    if len(columns) == 21:
-                        for col_name, col_value in zip(data.keys(), columns):
-                            data[col_name].append(float(col_value))
+                if line.startswith(b'!NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD='):
+                    n_items = int(line.decode().split('=')[1])
+            file.seek(data_start)
+            values = read_records(file, n_items, col_idx, chunk_size)
+        data = {col_name: values[:, i] for i, col_name in enumerate(columns)}
         self._data_dict = data
-        self._hkl = np.array([data['H'], data['K'], data['L']], dtype=int).transpose()
-        self._hkl_view = self._hkl.copy().view([('a', int), ('b', int), ('c', int)])
-        self._xyz_cal = np.array([data['XCAL'], data['YCAL'], data['ZCAL']]).transpose()
-        self._xyz_obs = np.array([data['XOBS'], data['YOBS'], data['ZOBS']]).transpose()
-        self._corr_peak = np.array(data['CORR'], dtype=int)
-        self._I = np.array(data['IOBS'])
-        self._sigI = np.array(data['SIGMA'])
+        if all(_ in data for _ in ('H', 'K', 'L')):
+            self._hkl = np.column_stack((data['H'], data['K'], data['L'])).astype(int)
+        if all(_ in data for _ in ('XCAL', 'YCAL', 'ZCAL')):
+            self._xyz_cal = np.column_stack((data['XCAL'], data['YCAL'], data['ZCAL']))
+        if all(_ in data for _ in ('XOBS', 'YOBS', 'ZOBS')):
+            self._xyz_obs = np.column_stack((data['XOBS'], data['YOBS'], data['ZOBS']))
+        if 'CORR' in data:
+            self._corr_peak = data['CORR'].astype(int)
+        if 'IOBS' in data:
+            self._I = data['IOBS']
+        if 'SIGMA' in data:
+            self._sigI = data['SIGMA']
+        self._filename = filename
 
     def find_equiv_refl(self, h: int, k: int, l: int) -> np.ndarray[Literal["N"], np.bool_]:
         """Find the equivalent reflections for the given h, k, l
@@ -75,20 +73,16 @@ class IntegrateHKLPlain(ReflectionParser):
         :return:
         :rtype: Nx3 numpy.ndarray(dtype=int)
         """
-        bool_pos = np.full(self.size, False)
         sym_operator = miller.sym_equiv_indices(self._space_group, [int(h), int(k), int(l)])
-        for miller_idx in sym_operator.indices():
-            search_view = np.array(miller_idx.h()).view([('a', int), ('b', int), ('c', int)])
-            bool_pos |= np.in1d(self._hkl_view, search_view)
-        return np.argwhere(bool_pos).flatten()
+        return self.hkl_keys.rows([_.h() for _ in sym_operator.indices()])
 
     @property
     def size(self) -> int:
         """
-        :return:
+        :return: number of records
         :rtype: int
         """
-        return self._I.size
+        return self._hkl.shape[0]
 
     @property
     def corr(self) -> np.ndarray:
@@ -1,3 +1,6 @@
+import io
+import os
+
 import numpy as np
 from typing import Literal, Any, Dict
 
@@ -5,6 +8,8 @@ from collections import namedtuple
 
 from cctbx import miller
 
+from .Compression import *
+
 _obs_names = ['F', 'sig', 'I', 'F_ano', 'I_ano', 'sigF_ano', 'sigI_ano']
 
 column_type_as_miller_array_type_hints = {
@@ -39,22 +44,59 @@ class Observation(object):
     :type sigma: 1d ndarray
     :param ires: resolution array
     :type ires: 1d ndarray
+    :param invresolsq: Optional. inverse resolution squared array, if already known
+    :type invresolsq: 1d ndarray
+    :param valid: Optional. mask of the valid observations, if already known. The arrays are then selected once
+                  with it instead of the sigma check, or kept as they are if it is slice(None). Resolutions given
+                  for the valid observations only are not selected again.
+    :type valid: 1d ndarray or slice
     """
 
-    def __init__(self, obs, sigma, ires):
+    def __init__(self, obs, sigma, ires, invresolsq=None, valid=None):
         self._obs = obs
         self._sigma = sigma
         self._ires = ires
+        self._invresolsq = invresolsq
+        self._valid = valid
+        self._index = None
         self.omit_invalid_sigmas()
 
     def omit_invalid_sigmas(self):
         """
         Function to omit observations with negative sigmas.
         """
-        valid_sigmas_idx = self._sigma > 0.
-        self._obs = self._obs[valid_sigmas_idx]
-        self._sigma = self._sigma[valid_sigmas_idx]
-        self._ires = self._ires[valid_sigmas_idx]
+        if self._valid is None:
+            valid_sigmas_idx = self._sigma > 0.
+            self._valid = slice(None) if valid_sigmas_idx.all() else valid_sigmas_idx
+        if isinstance(self._valid, slice):
+            return
+        if self._ires.size == self._obs.size:
+            self._ires = self._ires[self._valid]
+            if self._invresolsq is not None:
+                self._invresolsq = self._invresolsq[self._valid]
+        self._obs = self._obs[self._valid]
+        self._sigma = self._sigma[self._valid]
+
+    @property
+    def valid(self) -> np.ndarray[Literal["N"], np.bool_] | slice:
+        """
+        :return: mask of the kept observations in the input arrays, slice(None) if all were kept
+        :rtype: 1d ndarray or slice
+        """
+        return self._valid
+
+    @property
+    def index(self) -> np.ndarray[Literal["N"], np.int_]:
+        """
+        :return: indices of the kept observations in the input arrays
+        :rtype: 1d ndarray
+        """
+        if self._index is None:
+            if isinstance(self._valid, slice):
+                self._index = np.arange(self._obs.size)
+            else:
+                self._index = np.flatnonzero(self._valid)
+        return self._index
 
     @property
     def obs(self) -> np.ndarray[Literal["N"], np.float32]:
@@ -93,7 +135,219 @@ class Observation(object):
         :return: inverse resolution squared
         :rtype: 1d ndarray
         """
-        return 1. / (self.ires * self.ires)
+        if self._invresolsq is None:
+            self._invresolsq = 1. / (self.ires * self.ires)
+        return self._invresolsq
+
+
+class MillerKeys(object):
+    """
+    Packed int64 keys of the Miller indices of a table, sorted once. Lookups, joins and set operations on the indices
+    become searchsorted and np.unique calls on one int64 column instead of comparisons of Nx3 arrays.
+    """
+
+    def __init__(self, hkl: np.ndarray[Literal["N", 3], np.int_]):
+        keys = pack_hkl(hkl)
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+
+    @property
+    def sorted_keys(self) -> np.ndarray[Literal["N"], np.int64]:
+        """
+        :return: packed keys of all rows in ascending order
+        :rtype: 1d ndarray
+        """
+        return self._sorted_keys
+
+    @property
+    def order(self) -> np.ndarray[Literal["N"], np.int_]:
+        """
+        :return: rows of the table in the order of the sorted keys
+        :rtype: 1d ndarray
+        """
+        return self._order
+
+    def rows(self, hkl: np.ndarray[Literal["M", 3], np.int_]) -> np.ndarray[Literal["K"], np.int_]:
+        """
+        :param hkl: Miller indices to look up.
+        :return: rows of the table with any of the given indices, in ascending order
+        :rtype: 1d ndarray
+        """
+        query = np.unique(pack_hkl(hkl))
+        start = np.searchsorted(self._sorted_keys, query, side='left')
+        counts = np.searchsorted(self._sorted_keys, query, side='right') - start
+        # positions start, start + 1, ..., start + count - 1 of every looked up key
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.sort(self._order[np.repeat(start, counts) + offsets])
+
+    def contains(self, hkl: np.ndarray[Literal["M", 3], np.int_]) -> np.ndarray[Literal["M"], np.bool_]:
+        """
+        :param hkl: Miller indices to look up.
+        :return: flags of the given indices which occur in the table
+        :rtype: 1d ndarray
+        """
+        keys = pack_hkl(hkl)
+        if self._sorted_keys.size == 0:
+            return np.zeros(keys.size, dtype=bool)
+        pos = np.searchsorted(self._sorted_keys, keys).clip(max=self._sorted_keys.size - 1)
+        return self._sorted_keys[pos] == keys
+
+
+class ReflectionTable(object):
+    """
+    Struct-of-arrays table of the reflection data of a parser. Each column (hkl, F, sigF, I, resolution, ...) is held
+    once. Anomalous columns hold interleaved (+) and (-) values and may share the per-reflection resolution column.
+    The combined validity masks, the Observation instances and the Miller index keys are computed once and kept until
+    one of their columns is replaced. If a float type is set, all float columns are held in it.
+    """
+
+    def __init__(self):
+        self._columns = {}
+        self._valid_rows = {}
+        self._observations = {}
+        self._miller_keys = {}
+        self._pair_columns = {}
+        self._dtype = None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._columns
+
+    def __getitem__(self, name: str):
+        return self._columns[name]
+
+    def __setitem__(self, name: str, value):
+        if self._dtype is not None and isinstance(value, np.ndarray) and value.dtype.kind == 'f':
+            value = value.astype(self._dtype, copy=False)
+        self._columns[name] = value
+        self._forget(name)
+
+    def __delitem__(self, name: str):
+        self._columns.pop(name, None)
+        self._forget(name)
+
+    def _forget(self, name: str):
+        """Drop the masks, observations, keys and repeated columns computed from the given column."""
+        for cache in (self._valid_rows, self._observations, self._miller_keys, self._pair_columns):
+            for key in [_ for _ in cache if name in _]:
+                del cache[key]
+
+    def get(self, name: str, default=None):
+        return self._columns.get(name, default)
+
+    def items(self):
+        return self._columns.items()
+
+    @property
+    def dtype(self) -> np.dtype | None:
+        """
+        :return: float type of the float columns, None if the columns keep the type they were read in
+        :rtype: numpy.dtype
+        """
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, dtype):
+        self._dtype = None if dtype is None else np.dtype(dtype)
+        for name, column in list(self._columns.items()):
+            self[name] = column
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: memory held by the array columns
+        :rtype: int
+        """
+        return sum(_.nbytes for _ in self._columns.values() if isinstance(_, np.ndarray))
+
+    def valid_rows(self, name: str, sigma_name: str) -> np.ndarray[Literal["N"], np.bool_] | slice:
+        """
+        :param name: Name of an observation column.
+        :param sigma_name: Name of its deviation column.
+        :return: Mask of the rows with a non-zero observation and a positive deviation, or slice(None) if all rows
+                 are valid, so that selecting with it keeps views of the columns.
+        """
+        key = (name, sigma_name)
+        if key not in self._valid_rows:
+            valid = (self._columns[name] != 0) & (self._columns[sigma_name] > 0.)
+            self._valid_rows[key] = slice(None) if valid.all() else valid
+        return self._valid_rows[key]
+
+    def observation(self, name: str, sigma_name: str, resolution_name: str) -> Observation:
+        """Wrap the valid rows of an observation column, its deviations and resolutions. The rows are selected once
+        and the Observation is kept, so repeated calls return the same instance. Its valid and index properties refer
+        to the rows of the table.
+
+        :param name: Name of the observation column.
+        :param sigma_name: Name of the deviation column.
+        :param resolution_name: Name of the resolution column of the observation. The shared column 'resolution'
+                                is used if it does not exist.
+        :return: Observation instance
+        """
+        if resolution_name not in self._columns:
+            resolution_name = 'resolution'
+        key = (name, sigma_name, resolution_name)
+        if key not in self._observations:
+            obs = self._columns[name]
+            ires = self._columns[resolution_name]
+            # the inverse resolution squared, if recorded with the resolutions
+            invresolsq_name = resolution_name.replace('resolution', 'd_star_sq')
+            invresolsq = self._columns.get(invresolsq_name)
+            valid = self.valid_rows(name, sigma_name)
+            if ires.size * 2 == obs.size:
+                # one resolution for each (+)/(-) pair. only the pairs of the kept rows are looked up, the repeated
+                # columns are built once per table if all rows are kept.
+                if isinstance(valid, slice):
+                    ires = self.pair_column(resolution_name)
+                    invresolsq = None if invresolsq is None else self.pair_column(invresolsq_name)
+                else:
+                    pairs = np.flatnonzero(valid) >> 1
+                    ires = ires[pairs]
+                    invresolsq = None if invresolsq is None else invresolsq[pairs]
+            self._observations[key] = Observation(obs=obs, sigma=self._columns[sigma_name], ires=ires,
+                                                  invresolsq=invresolsq, valid=valid)
+        return self._observations[key]
+
+    def pair_column(self, name: str) -> np.ndarray[Literal["N"], Any]:
+        """
+        :param name: Name of a per-reflection column, e.g. resolution.
+        :return: the column with each value repeated for the (+) and (-) rows of an anomalous pair, built on first use
+        :rtype: 1d ndarray
+        """
+        key = (name,)
+        if key not in self._pair_columns:
+            self._pair_columns[key] = np.repeat(self._columns[name], 2)
+        return self._pair_columns[key]
+
+    def miller_keys(self, name: str = 'hkl') -> MillerKeys:
+        """
+        :param name: Name of a Miller index column. Default: hkl.
+        :return: sorted packed keys of the column, computed on first use
+        """
+        key = (name,)
+        if key not in self._miller_keys:
+            self._miller_keys[key] = MillerKeys(self._columns[name])
+        return self._miller_keys[key]
+
+
+class TableColumn(object):
+    """Descriptor that stores a parser attribute such as _F as the column F of the parser's ReflectionTable.
+    Assigning None removes the column.
+    """
+
+    def __set_name__(self, owner, name):
+        self._name = name
+        self._column = name.lstrip('_')
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj._table.get(self._column)
+
+    def __set__(self, obj, value):
+        if value is None:
+            del obj._table[self._column]
+        else:
+            obj._table[self._column] = value
 
 
 class ReflectionParser(object):
@@ -101,12 +355,35 @@ class ReflectionParser(object):
     A conceptual class for reflections. It is the basic class for the actual file parser.
     """
 
+    _hkl = TableColumn()
+    _F = TableColumn()
+    _sigF = TableColumn()
+    _I = TableColumn()
+    _sigI = TableColumn()
+    _background = TableColumn()
+    _F_ano = TableColumn()
+    _I_ano = TableColumn()
+    _sigF_ano = TableColumn()
+    _sigI_ano = TableColumn()
+    _resolution = TableColumn()
+    _resolutionI = TableColumn()
+    _resolutionI_ano = TableColumn()
+    _resolutionF = TableColumn()
+    _resolutionF_ano = TableColumn()
+    _d_star_sq = TableColumn()
+    _d_star_sqI = TableColumn()
+    _d_star_sqI_ano = TableColumn()
+    _d_star_sqF = TableColumn()
+    _d_star_sqF_ano = TableColumn()
+
     def __init__(self):
         """
         constructor method
         """
+        self._table = ReflectionTable()
         self._filename = None
         self._source_data_format = None
+        self._source_digest = None
         self._obj = None
         self._hkl = None
         self._F = None
@@ -123,15 +400,20 @@ class ReflectionParser(object):
         self._resolutionI_ano = None
         self._resolutionF = None
         self._resolutionF_ano = None
+        self._d_star_sq = None
+        self._d_star_sqI = None
+        self._d_star_sqI_ano = None
+        self._d_star_sqF = None
+        self._d_star_sqF_ano = None
         self._space_group = None
 
     @property
     def file_name(self) -> str:
         """
-        :return: file or path to file
+        :return: file or path to file, '<memory>' for in-memory input
         :rtype: str
         """
-        return self._filename
+        return source_name(self._filename)
 
     @property
     def size(self) -> int:
@@ -145,6 +427,14 @@ class ReflectionParser(object):
         """
         return self._hkl
 
+    @property
+    def hkl_keys(self) -> MillerKeys:
+        """
+        :return: sorted packed int64 keys of the hkl indices
+        :rtype: MillerKeys
+        """
+        return self._table.miller_keys('hkl')
+
     @property
     def resolution(self) -> np.ndarray[Literal["N"], np.float32]:
         """
@@ -203,7 +493,7 @@ class ReflectionParser(object):
         :return: anomalous amplitude
         :rtype: 1d ndarray
         """
-        return self.F_ano
+        return self._F_ano
 
     @property
     def sigF_ano(self) -> np.ndarray[Literal["N"], np.float32]:
@@ -211,7 +501,7 @@ class ReflectionParser(object):
         :return: standard deviation of anomalous amplitude
         :rtype: 1d ndarray
         """
-        return self.sigF_ano
+        return self._sigF_ano
 
     @property
     def sigI_ano(self) -> np.ndarray[Literal["N"], np.float32]:
@@ -219,7 +509,7 @@ class ReflectionParser(object):
         :return: standard deviation of anomalous intensity
         :rtype: 1d ndarray
         """
-        return self.sigI_ano
+        return self._sigI_ano
 
     @property
     def source_data_format(self) -> str:
@@ -229,6 +519,18 @@ class ReflectionParser(object):
     def source_data_format(self, _):
         self._source_data_format = _
 
+    @property
+    def source_digest(self) -> str:
+        """
+        :return: sha256 hex digest of the input file, if computed for the reflection cache
+        :rtype: str
+        """
+        return self._source_digest
+
+    @source_digest.setter
+    def source_digest(self, _):
+        self._source_digest = _
+
     def observation(self, idx) -> namedtuple:
         """Return all not None observations at the given index, as a namedtuple.
 
@@ -247,6 +549,29 @@ class ReflectionParser(object):
         obs_at_idx = ObsTuple(**obs_dict)
         return obs_at_idx
 
+    def _set_resolution(self, suffix: str, hkl: np.ndarray[Literal["N", 3], np.int_], cell):
+        """Calculate the inverse resolution squared of the given indices once. It is recorded as d_star_sq<suffix>
+        together with the resolution<suffix> derived from it, so that Observation does not compute it again.
+
+        :param suffix: Suffix of the resolution column, e.g. '' for the shared column, 'I' or 'F_ano'.
+        :param hkl: Miller indices.
+        :param cell: Unit cell parameters (a, b, c, alpha, beta, gamma) or a cctbx unit cell.
+        :return: None
+        """
+        invresolsq = d_star_sq(hkl, cell)
+        with np.errstate(divide='ignore'):
+            setattr(self, '_resolution' + suffix, 1. / np.sqrt(invresolsq))
+        setattr(self, '_d_star_sq' + suffix, invresolsq)
+
+    def set_precision(self, dtype: type):
+        """Set the float type of the observations, deviations and resolutions, e.g. np.float32 to halve the memory
+        traffic of the binning. Columns read later are converted as well.
+
+        :param dtype: np.float32 or np.float64
+        :return: None
+        """
+        self._table.dtype = dtype
+
     def get_amplitude_data(self):
         """Return the wrapped amplitude data
 
@@ -254,14 +579,7 @@ class ReflectionParser(object):
         """
         if self._F is None:
             return None
-        valid_args = self._F.nonzero()
-        obs = self._F[valid_args]
-        sigma = self._sigF[valid_args]
-        try:
-            ires = self._resolutionF[valid_args]
-        except (AttributeError, TypeError):
-            ires = self._resolution[valid_args]
-        return Observation(obs=obs, sigma=sigma, ires=ires)
+        return self._table.observation('F', 'sigF', 'resolutionF')
 
     def get_intensity_data(self):
         """Return the wrapped intensity data
@@ -270,14 +588,7 @@ class ReflectionParser(object):
         """
         if self._I is None:
             return None
-        valid_args = self._I.nonzero()
-        obs = self._I[valid_args]
-        sigma = self._sigI[valid_args]
-        try:
-            ires = self._resolutionI[valid_args]
-        except (AttributeError, TypeError):
-            ires = self._resolution[valid_args]
-        return Observation(obs=obs, sigma=sigma, ires=ires)
+        return self._table.observation('I', 'sigI', 'resolutionI')
 
     def get_amplitude_anom_data(self):
         """Return the wrapped anomalous amplitude data
@@ -286,14 +597,7 @@ class ReflectionParser(object):
         """
         if self._F_ano is None:
             return None
-        valid_args = self._F_ano.nonzero()
-        obs = self._F_ano[valid_args]
-        sigma = self._sigF_ano[valid_args]
-        try:
-            ires = self._resolutionF_ano[valid_args]
-        except (AttributeError, TypeError):
-            ires = np.c_[self._resolution, self._resolution].flatten()[valid_args]
-        return Observation(obs=obs, sigma=sigma, ires=ires)
+        return self._table.observation('F_ano', 'sigF_ano', 'resolutionF_ano')
 
     def get_intensity_anom_data(self):
         """Return the wrapped anomalous intensity data.
@@ -302,14 +606,26 @@ class ReflectionParser(object):
         """
         if self._I_ano is None:
             return None
-        valid_args = self._I_ano.nonzero()
-        obs = self._I_ano[valid_args]
-        sigma = self._sigI_ano[valid_args]
-        try:
-            ires = self._resolutionI_ano[valid_args]
-        except (AttributeError, TypeError):
-            ires = np.c_[self._resolution, self._resolution].flatten()[valid_args]
-        return Observation(obs=obs, sigma=sigma, ires=ires)
+        return self._table.observation('I_ano', 'sigI_ano', 'resolutionI_ano')
+
+    def _cache_state(self) -> Dict[str, Any]:
+        """
+        :return: The attributes to be stored in a reflection cache.
+        :rtype: dict
+        """
+        state = dict(vars(self))
+        state.pop('_table')
+        state.update({'_' + name: column for name, column in self._table.items()})
+        return state
+
+    def _restore_cache_state(self, state: Dict[str, Any]):
+        """Restore the attributes loaded from a reflection cache.
+
+        :param state: Attributes by name.
+        :return: None
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def get_equiv_index(self, hkl):
         """Return the equivalent indices of given hkl based on Laue class
@@ -328,10 +644,8 @@ class ReflectionParser(object):
         :param observation_type: Can be either 'FP' or 'I'.
         :return: Miller array corresponding to the given column label
         """
-        try:
+        if self.source_data_format == 'mtz':
             ma = self._obj.as_miller_arrays()
-        except Exception as e:
-            print(e.message, e.args)
         if observation_type == 'FP':
             if self.source_data_format == 'mtz':
                 for ma_type in ['FP', 'F', 'FMEANS']:
@@ -341,11 +655,7 @@ class ReflectionParser(object):
                     except IndexError:
                         continue
             elif self.source_data_format == 'cif':
-                miller_arrays = self._obj.build_miller_arrays()
-                for model in miller_arrays.keys():
-                    for key in miller_arrays[model].keys():
-                        if 'F_meas' in key:
-                            return_ma = miller_arrays[model][key]
+                return_ma = self.as_miller_array('F')
         if observation_type == 'I':
             if self.source_data_format == 'mtz':
                 for ma_type in ['I', 'IMEANS', 'IMEAN']:
@@ -355,17 +665,9 @@ class ReflectionParser(object):
                     except IndexError:
                         continue
             elif self.source_data_format == 'cif':
-                miller_arrays = self._obj.build_miller_arrays()
-                wavelength_id = np.array(miller_arrays[model]['_refln.wavelength_id'].data())[0]
-                for model in miller_arrays.keys():
-                    for key in miller_arrays[model].keys():
-                        if ('intensity_meas' in key) and ('wavelength_id='+wavelength_id in key):
-                            if miller_arrays[model][key].anomalous_flag():
-                                continue
-                            else:
-                                return_ma = miller_arrays[model][key]
+                return_ma = self.as_miller_array('I')
             elif self.source_data_format == 'xds_hkl':
-                return_ma = self._obj.as_miller_array(merge_equivalents=True)
+                return_ma = self.as_miller_array(merge_equivalents=True)
 
         try:
             return_ma
@@ -374,6 +676,206 @@ class ReflectionParser(object):
         return return_ma
 
 
+def reciprocal_metric_tensor(cell) -> np.ndarray[Literal[3, 3], np.float64]:
+    """Return the reciprocal metric tensor G* of the given unit cell.
+
+    :param cell: Unit cell parameters (a, b, c, alpha, beta, gamma) or a cctbx unit cell.
+    :return: Reciprocal metric tensor.
+    :rtype: 3x3 ndarray
+    """
+    if hasattr(cell, 'parameters'):
+        cell = cell.parameters()
+    a, b, c, alpha, beta, gamma = cell
+    cos_alpha, cos_beta, cos_gamma = np.cos(np.radians([alpha, beta, gamma]))
+    metric_tensor = np.array([[a * a, a * b * cos_gamma, a * c * cos_beta],
+                              [a * b * cos_gamma, b * b, b * c * cos_alpha],
+                              [a * c * cos_beta, b * c * cos_alpha, c * c]])
+    return np.linalg.inv(metric_tensor)
+
+
+def d_star_sq(hkl: np.ndarray[Literal["N", 3], np.int_], cell, dtype: type = np.float64) \
+        -> np.ndarray[Literal["N"], np.float64]:
+    """Calculate the inverse resolution squared (1/d^2) of the given indices in one matrix product.
+
+    :param hkl: Miller indices.
+    :param cell: Unit cell parameters (a, b, c, alpha, beta, gamma) or a cctbx unit cell.
+    :param dtype: Float type of the computation, np.float32 or np.float64. Default: np.float64.
+    :return: Inverse resolution squared.
+    :rtype: 1d ndarray
+    """
+    hkl = np.asarray(hkl).reshape(-1, 3).astype(dtype)
+    return ((hkl @ reciprocal_metric_tensor(cell).astype(dtype)) * hkl).sum(axis=1)
+
+
+def d_spacing(hkl: np.ndarray[Literal["N", 3], np.int_], cell, dtype: type = np.float64) \
+        -> np.ndarray[Literal["N"], np.float64]:
+    """Calculate the d-spacings (resolutions) of the given indices.
+
+    :param hkl: Miller indices.
+    :param cell: Unit cell parameters (a, b, c, alpha, beta, gamma) or a cctbx unit cell.
+    :param dtype: Float type of the computation, np.float32 or np.float64. Default: np.float64.
+    :return: d-spacings. The reflection 0 0 0 is given an infinite d-spacing.
+    :rtype: 1d ndarray
+    """
+    with np.errstate(divide='ignore'):
+        return 1. / np.sqrt(d_star_sq(hkl, cell, dtype))
+
+
+def pack_hkl(hkl: np.ndarray[Literal["N", 3], np.int_]) -> np.ndarray[Literal["N"], np.int64]:
+    """Pack Miller indices into one int64 key each, 21 bits per index. Indices within +-2^20 are supported.
+
+    :param hkl: Miller indices.
+    :return: Packed keys. Sorting the keys sorts the indices by h, then k, then l.
+    :rtype: 1d ndarray
+    """
+    hkl = np.asarray(hkl, dtype=np.int64).reshape(-1, 3) + (1 << 20)
+    return (hkl[:, 0] << 42) | (hkl[:, 1] << 21) | hkl[:, 2]
+
+
+def unpack_hkl(keys: np.ndarray[Literal["N"], np.int64]) -> np.ndarray[Literal["N", 3], np.int64]:
+    """Recover the Miller indices from keys packed by pack_hkl.
+
+    :param keys: Packed keys.
+    :return: Miller indices.
+    :rtype: 2d ndarray
+    """
+    keys = np.asarray(keys, dtype=np.int64).reshape(-1, 1)
+    return ((keys >> np.array([42, 21, 0])) & ((1 << 21) - 1)) - (1 << 20)
+
+
+def equivalence_keys(hkl: np.ndarray[Literal["N", 3], np.int_], space_group, anomalous_flag: bool = False) \
+        -> np.ndarray[Literal["N"], np.int64]:
+    """Key each Miller index by the largest packed index among its symmetry equivalents, so that equivalent
+    reflections share one key. Friedel mates are equivalent unless anomalous_flag is set. In centrosymmetric space
+    groups -h is always equivalent, as the inversion is not among the operators of space_group.smx().
+
+    :param hkl: Miller indices.
+    :param space_group: cctbx space group.
+    :param anomalous_flag: Whether to keep Friedel mates apart. Default: False.
+    :return: Packed keys of the equivalence classes.
+    :rtype: 1d ndarray
+    """
+    hkl = np.asarray(hkl, dtype=np.int64).reshape(-1, 3)
+    keys = np.full(hkl.shape[0], np.iinfo(np.int64).min)
+    with_inverse = not anomalous_flag or space_group.is_centric()
+    for op in space_group.smx():
+        # the centring translations do not change the indices
+        equiv = hkl @ np.array(op.r().as_double(), dtype=np.int64).reshape(3, 3)
+        np.maximum(keys, pack_hkl(equiv), out=keys)
+        if with_inverse:
+            np.maximum(keys, pack_hkl(-equiv), out=keys)
+    return keys
+
+
+def iter_line_blocks(f, chunk_size: int = 1 << 26, stop: bytes = b'!'):
+    """Read a binary text stream in large blocks that always end with a complete line.
+
+    :param f: Binary file object positioned at the first data line.
+    :param chunk_size: Number of bytes read at once. Default: 64 MB.
+    :param stop: Optional. Iteration stops before the first line starting with this prefix, e.g. !END_OF_DATA.
+    :return: Generator of byte blocks
+    """
+    remainder = b''
+    while True:
+        chunk = f.read(chunk_size)
+        block = remainder + chunk
+        if not block:
+            return
+        if chunk:
+            cut = block.rfind(b'\n') + 1
+            block, remainder = block[:cut], block[cut:]
+        else:
+            remainder = b''
+        if stop:
+            stop_pos = block.find(b'\n' + stop)
+            if block.startswith(stop):
+                return
+            if stop_pos >= 0:
+                yield block[:stop_pos + 1]
+                return
+        if block:
+            yield block
+        if not chunk:
+            return
+
+
+def decode_line_block(block: bytes, n_items: int, dtype: type = np.float64) -> np.ndarray[Literal["N", "M"], np.float64]:
+    """Decode a block of whitespace separated numeric lines into a 2d array in one call.
+
+    :param block: Complete lines of text.
+    :param n_items: Number of items in each line.
+    :param dtype: Output data type. Default: np.float64.
+    :return: Decoded values, one row per line.
+    :rtype: NxM ndarray
+    """
+    if not block.strip():
+        return np.empty((0, n_items), dtype=dtype)
+    try:
+        values = np.loadtxt(io.BytesIO(block), dtype=dtype, ndmin=2)
+    except ValueError as e:
+        raise AssertionError('Malformed data record: {0}'.format(e)) from e
+    if values.shape[1] != n_items:
+        raise AssertionError('Malformed data record: {0} items instead of {1}.'.format(values.shape[1], n_items))
+    return values
+
+
+def cut_fixed_width_block(block: bytes, record: np.dtype) -> np.ndarray[Literal["N"], Any]:
+    """Cut a block of fixed-width text records into their fields by column position, so that neighbouring fields
+    which run into each other, e.g. -100-100, are still separated. Shorter lines are padded with blanks.
+
+    :param block: Complete lines of text.
+    :param record: Structured dtype of byte string fields, one per column range of the record.
+    :return: Fields of the records as byte strings.
+    :rtype: 1d structured ndarray
+    """
+    record_length = record.itemsize
+    line_length = block.find(b'\n') + 1
+    if line_length > record_length and len(block) % line_length == 0 \
+            and (np.frombuffer(block, dtype=np.uint8)[line_length - 1::line_length] == ord('\n')).all():
+        # lines of equal length. the fields are cut from the raw bytes without splitting the lines.
+        raw = np.frombuffer(block, dtype=np.uint8).reshape(-1, line_length)[:, :record_length]
+    else:
+        lines = [_.rstrip(b'\r') for _ in block.split(b'\n') if _.strip()]
+        raw = np.array(lines, dtype='S{0}'.format(record_length)).view(np.uint8).reshape(-1, record_length)
+        raw = np.where(raw == 0, np.uint8(ord(' ')), raw)
+    return np.ascontiguousarray(raw).view(record).reshape(-1)
+
+
+def read_records(f, n_items: int, col_idx: list[int, ...] = None, chunk_size: int = 1 << 26,
+                 dtype: type = np.float64) -> np.ndarray[Literal["N", "M"], np.float64]:
+    """Decode the remaining fixed-width records of a text stream block-wise into one preallocated array.
+
+    :param f: Binary file object positioned at the first data line. May be a decompressing stream.
+    :param n_items: Number of items in each record.
+    :param col_idx: Optional. Indices of the items to keep. Default: all items.
+    :param chunk_size: Number of bytes decoded at once. Default: 64 MB.
+    :param dtype: Output data type. Default: np.float64.
+    :return: Decoded records, one row per record.
+    :rtype: NxM ndarray
+    """
+    if col_idx is None:
+        col_idx = list(range(n_items))
+    data_start = f.tell()
+    first_line = f.readline()
+    if is_compressed_stream(f):
+        # the uncompressed size is unknown without decompressing twice. start with one block and grow.
+        capacity = chunk_size // max(len(first_line), 1) + 1
+    else:
+        # the records are written in fixed width, so the length of the first one gives the number of records
+        f.seek(0, os.SEEK_END)
+        capacity = (f.tell() - data_start) // max(len(first_line), 1) + 1
+    f.seek(data_start)
+    values = np.empty((capacity, len(col_idx)), dtype=dtype)
+    num_rows = 0
+    for block in iter_line_blocks(f, chunk_size):
+        records = decode_line_block(block, n_items, dtype)
+        if num_rows + records.shape[0] > values.shape[0]:
+            values = np.resize(values, (2 * (num_rows + records.shape[0]), len(col_idx)))
+        values[num_rows:num_rows + records.shape[0]] = records[:, col_idx]
+        num_rows += records.shape[0]
+    return values[:num_rows]
+
+
 def namedtuplify(keys, values):
     obs_iter = zip(values, keys)
     obs_dict = {}
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from cctbx import crystal, miller, sgtbx, uctbx
+from cctbx.array_family import flex
+
+from auspex import __version__
+from . import Cif, Dials, Mtz, Sca, Shlex, Xds
+
+# bump when the cached attributes of the parsers change, so that older caches are not picked up
+CACHE_FORMAT_VERSION = 3
+
+# DialsParser is not cached: writing flagged tables and the resolutions need its walked msgpack table and the
+# crystal models, which are not stored as arrays.
+_parser_classes = {_.__name__: _ for _ in (Mtz.MtzParser, Xds.XdsParser, Cif.CifParser,
+                                           Shlex.ShlexParser, Sca.ScaParser, Sca.ScaUnmergedParser)}
+
+
+def file_digest(filename: str, chunk_size: int = 1 << 24) -> str:
+    """
+    :param filename: File name or path to the file.
+    :param chunk_size: Number of bytes hashed at once. Default: 16 MB.
+    :return: sha256 hex digest of the file content as stored on disk.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(filename: str, cache_dir: str, *options, digest: str = None) -> str:
+    """The cache entry of a file is keyed by the file content, the reading options and the parser version.
+
+    :param filename: File name or path to the input file.
+    :param cache_dir: The cache directory.
+    :param options: Options affecting the parsed result, e.g. file type, unit cell and space group number.
+    :param digest: Optional. file_digest of the input file, if already computed.
+    :return: Path of the cache entry of the file.
+    :rtype: str
+    """
+    if digest is None:
+        digest = file_digest(filename)
+    key = hashlib.sha256(json.dumps([digest, __version__, CACHE_FORMAT_VERSION,
+                                     [str(_) for _ in options]]).encode()).hexdigest()
+    return os.path.join(cache_dir, key)
+
+
+def save_parsed(reflection_data, filename: str, cache_dir: str, *options, digest: str = None):
+    """Store the parsed arrays of a reflection parser in the cache. Each array is written as a separate .npy file,
+    so it can be memory-mapped when loaded. Symmetry objects are stored by their parameters; other objects, such as
+    the iotbx objects, are not cached and are rebuilt from the input file by the parser when needed. Parsers which
+    cannot be restored from the cache, i.e. DialsParser, are not stored.
+
+    :param reflection_data: A reflection parser after reading filename.
+    :param filename: File name or path to the input file.
+    :param cache_dir: The cache directory.
+    :param options: Options affecting the parsed result, as given to cache_path.
+    :param digest: Optional. file_digest of the input file. Default: the source_digest of the parser, if set.
+    :return: None
+    """
+    if type(reflection_data).__name__ not in _parser_classes:
+        return
+    if digest is None:
+        digest = reflection_data.source_digest
+    path = cache_path(filename, cache_dir, *options, digest=digest)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    os.makedirs(tmp_path)
+    meta = {'class': type(reflection_data).__name__, 'arrays': [], 'array_lists': {}, 'array_dicts': {},
+            'values': {}, 'space_groups': {}, 'unit_cells': {}, 'crystal_symmetries': {}, 'miller_sets': {}}
+    for name, value in reflection_data._cache_state().items():
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            np.save(os.path.join(tmp_path, name + '.npy'), value)
+            meta['arrays'].append(name)
+        elif isinstance(value, list) and value and all(isinstance(_, np.ndarray) for _ in value):
+            # observations grouped by redundancy
+            for i, array in enumerate(value):
+                np.save(os.path.join(tmp_path, '{0}.{1}.npy'.format(name, i)), array)
+            meta['array_lists'][name] = len(value)
+        elif isinstance(value, dict) and value and all(isinstance(_, np.ndarray) for _ in value.values()):
+            for key, array in value.items():
+                np.save(os.path.join(tmp_path, '{0}.{1}.npy'.format(name, key)), array)
+            meta['array_dicts'][name] = list(value)
+        elif isinstance(value, sgtbx.space_group):
+            meta['space_groups'][name] = value.type().hall_symbol()
+        elif isinstance(value, uctbx.unit_cell):
+            meta['unit_cells'][name] = value.parameters()
+        elif isinstance(value, crystal.symmetry):
+            meta['crystal_symmetries'][name] = _symmetry_to_json(value)
+        elif isinstance(value, miller.set):
+            np.save(os.path.join(tmp_path, name + '.indices.npy'), np.array(value.indices(), dtype=int))
+            miller_set = {'symmetry': _symmetry_to_json(value), 'anomalous_flag': value.anomalous_flag(),
+                          'is_array': isinstance(value, miller.array)}
+            if miller_set['is_array']:
+                np.save(os.path.join(tmp_path, name + '.data.npy'), value.data().as_numpy_array())
+                if value.sigmas() is not None:
+                    np.save(os.path.join(tmp_path, name + '.sigmas.npy'), value.sigmas().as_numpy_array())
+                miller_set['has_sigmas'] = value.sigmas() is not None
+                miller_set['intensity'] = value.is_xray_intensity_array()
+            meta['miller_sets'][name] = miller_set
+        else:
+            if isinstance(value, np.generic):
+                value = value.item()
+            try:
+                meta['values'][name] = json.loads(json.dumps(value))
+            except (TypeError, ValueError):
+                # not cached
+                continue
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def load_parsed(filename: str, cache_dir: str, *options, digest: str = None):
+    """Restore a reflection parser from the cache without parsing the input file. The arrays are memory-mapped
+    copy-on-write, so they are only paged in when used.
+
+    :param filename: File name or path to the input file.
+    :param cache_dir: The cache directory.
+    :param options: Options affecting the parsed result, as given to cache_path.
+    :param digest: Optional. file_digest of the input file, if already computed.
+    :return: The restored reflection parser, or None if the file is not in the cache.
+    """
+    path = cache_path(filename, cache_dir, *options, digest=digest)
+    meta_filename = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta_filename):
+        return None
+    with open(meta_filename) as f:
+        meta = json.load(f)
+    if meta['class'] not in _parser_classes:
+        return None
+    state = dict(meta['values'])
+    for name in meta['arrays']:
+        state[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='c')
+    for name, size in meta['array_lists'].items():
+        state[name] = [np.load(os.path.join(path, '{0}.{1}.npy'.format(name, i)), mmap_mode='c')
+                       for i in range(size)]
+    for name, keys in meta['array_dicts'].items():
+        state[name] = {key: np.load(os.path.join(path, '{0}.{1}.npy'.format(name, key)), mmap_mode='c')
+                       for key in keys}
+    for name, hall_symbol in meta['space_groups'].items():
+        state[name] = sgtbx.space_group(hall_symbol)
+    for name, parameters in meta['unit_cells'].items():
+        state[name] = uctbx.unit_cell(parameters)
+    for name, symmetry in meta['crystal_symmetries'].items():
+        state[name] = _symmetry_from_json(symmetry)
+    for name, miller_set in meta['miller_sets'].items():
+        indices = np.load(os.path.join(path, name + '.indices.npy'))
+        state[name] = miller.set(crystal_symmetry=_symmetry_from_json(miller_set['symmetry']),
+                                 indices=flex.miller_index(indices.tolist()),
+                                 anomalous_flag=miller_set['anomalous_flag'])
+        if miller_set['is_array']:
+            sigmas = None
+            if miller_set['has_sigmas']:
+                sigmas = flex.double(np.load(os.path.join(path, name + '.sigmas.npy')))
+            state[name] = miller.array(state[name], data=flex.double(np.load(os.path.join(path, name + '.data.npy'))),
+                                       sigmas=sigmas)
+            if miller_set['intensity']:
+                state[name].set_observation_type_xray_intensity()
+    reflection_data = _parser_classes[meta['class']]()
+    reflection_data._restore_cache_state(state)
+    return reflection_data
+
+
+def _symmetry_to_json(symmetry) -> list:
+    """
+    :return: [unit cell parameters, hall symbol] of a crystal symmetry
+    :rtype: list
+    """
+    return [symmetry.unit_cell().parameters(), symmetry.space_group().type().hall_symbol()]
+
+
+def _symmetry_from_json(symmetry: list) -> crystal.symmetry:
+    """
+    :return: crystal symmetry from [unit cell parameters, hall symbol]
+    :rtype: cctbx.crystal.symmetry
+    """
+    unit_cell, hall_symbol = symmetry
+    return crystal.symmetry(unit_cell=unit_cell,
+                            space_group_info=sgtbx.space_group_info(group=sgtbx.space_group(hall_symbol)))
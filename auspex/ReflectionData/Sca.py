@@ -1,6 +1,13 @@
 import iotbx.scalepack.merge as sca_merge
+from cctbx import crystal, sgtbx
 
 from .ReflectionBase import *
+from .Xds import XdsParser
+
+# a record of an unmerged scalepack file (6i4,i6,2i2,i3,2f8.1): original h k l, asu h k l, batch, centric flag,
+# spindle flag, asymmetric unit operator, I, sigma(I). the unused fields are skipped.
+_unmerged_record = np.dtype([('h', 'S4'), ('k', 'S4'), ('l', 'S4'), ('asu_hkl', 'V12'), ('batch', 'S6'),
+                             ('flags', 'V7'), ('i', 'S8'), ('sigma', 'S8')])
 
 class ScaParser(ReflectionParser):
     """The Parser class to process sca files.
@@ -18,23 +25,120 @@ class ScaParser(ReflectionParser):
         :return: None
         """
         try:
-            with open(filename) as f:
+            with open_reflection_file(filename, 'r') as f:
                 self._obj = sca_merge.reader(f)
             if self._obj.anomalous:
                 self._I_ano = np.array(self._obj.iobs, dtype=float)
                 self._sigI_ano = np.array(self._obj.sigmas, dtype=float)
                 self._hkl = np.array(self._obj.miller_indices, dtype=int)
-                self._resolutionI_ano = np.array(self._obj.unit_cell.d(self._obj.miller_indices), dtype=float)
+                self._set_resolution('I_ano', self._hkl, self._obj.unit_cell)
             else:
                 self._I = np.array(self._obj.iobs, dtype=float)
                 self._sigI = np.array(self._obj.sigmas, dtype=float)
                 self._hkl = np.array(self._obj.miller_indices, dtype=int)
-                self._resolutionI = np.array(self._obj.unit_cell.d(self._obj.miller_indices), dtype=float)
+                self._set_resolution('I', self._hkl, self._obj.unit_cell)
         except sca_merge.FormatError:
             try:
                 import iotbx.scalepack.no_merge_original_index as sca_unmerge
                 sca_unmerge.reader(filename)
-                print('Lacking the unit cell parameters. Cannot load unmerged intensities.')
+                print('Lacking the unit cell parameters. Cannot load unmerged intensities. '
+                      'Read it with ScaUnmergedParser or specify --unit-cell.')
             except AssertionError:
                 print('Not a readable scalepack file.')
-        self._filename = filename
\ No newline at end of file
+        self._filename = filename
+
+
+class ScaUnmergedParser(XdsParser):
+    """The Parser class to process unmerged scalepack files written with no merge original index.
+
+    The unit cell is not recorded in the file and has to be given. The records are decoded block-wise into numpy
+    arrays, and the observations are merged and grouped as done for unmerged XDS data.
+    """
+
+    def __init__(self):
+        super(ScaUnmergedParser, self).__init__()
+        self._batch = None
+
+    def read(self, filename: str,
+             unit_cell: list[float, float, float, float, float, float],
+             space_group_number: int = None,
+             chunk_size: int = 1 << 26):
+        """Read the given unmerged scalepack file.
+
+        :param filename: File or path to file.
+        :type filename: str
+        :param unit_cell: Unit cell parameters (a, b, c, alpha, beta, gamma).
+        :param space_group_number: Optional. Space group number. Default: the space group symbol in the file.
+        :param chunk_size: Number of bytes decoded at once. Default: 64 MB.
+        :type chunk_size: int
+        :return: None
+        """
+        if unit_cell is None:
+            raise AssertionError('Lacking the unit cell parameters. Cannot load unmerged intensities.')
+        with open_reflection_file(filename, 'rb') as sca:
+            # number of symmetry operators and space group symbol, followed by two lines per operator
+            first_line = sca.readline().split(None, 1)
+            if len(first_line) != 2 or not first_line[0].isdigit():
+                raise AssertionError('{0} is not an unmerged scalepack file.'.format(source_name(filename)))
+            for _ in range(2 * int(first_line[0])):
+                sca.readline()
+            hkl, batch, intensities, sigmas = read_unmerged_records(sca, chunk_size)
+        if space_group_number is not None:
+            space_group_info = sgtbx.space_group_info(number=int(space_group_number))
+        else:
+            space_group_info = sgtbx.space_group_info(symbol=first_line[1].strip().decode('ascii', 'replace'))
+        self._crystal_symmetry = crystal.symmetry(unit_cell=tuple(float(_) for _ in unit_cell),
+                                                  space_group_info=space_group_info)
+        self._header = {'merge': False, 'friedels_law': True}
+        self._hkl = hkl
+        self._batch = batch
+        self._I = intensities
+        self._sigI = sigmas
+        self._space_group = self._crystal_symmetry.space_group()
+        self._set_resolution('', self._hkl, self._crystal_symmetry.unit_cell())
+        self._filename = filename
+        self._merge()
+
+    def get_batch(self) -> np.ndarray[Literal["N"], np.int_]:
+        """
+        :return: batch numbers of the observations
+        :rtype: 1d ndarray
+        """
+        return self._batch
+
+
+def decode_unmerged_block(block: bytes) -> tuple[np.ndarray[Literal["N", 3], np.int_],
+                                                 np.ndarray[Literal["N"], np.int_],
+                                                 np.ndarray[Literal["N"], np.float64],
+                                                 np.ndarray[Literal["N"], np.float64]]:
+    """Decode a block of unmerged scalepack records (6i4,i6,2i2,i3,2f8.1). Indices of three digits run into their
+    neighbours, e.g. -100-120, so the fields are cut by position.
+
+    :param block: Complete lines of text.
+    :return: original Miller indices, batch numbers, intensities, sigmas
+    :rtype: tuple
+    """
+    records = cut_fixed_width_block(block, _unmerged_record)
+    try:
+        hkl = np.stack((records['h'].astype(int), records['k'].astype(int), records['l'].astype(int)), axis=1)
+        return hkl, records['batch'].astype(int), records['i'].astype(np.float64), \
+            records['sigma'].astype(np.float64)
+    except ValueError as err:
+        raise AssertionError('Malformed data record: {0}'.format(err))
+
+
+def read_unmerged_records(f, chunk_size: int = 1 << 26) -> tuple[np.ndarray[Literal["N", 3], np.int_],
+                                                                 np.ndarray[Literal["N"], np.int_],
+                                                                 np.ndarray[Literal["N"], np.float64],
+                                                                 np.ndarray[Literal["N"], np.float64]]:
+    """Read the records of an unmerged scalepack file block by block.
+
+    :param f: Binary file object positioned at the first record. May be a decompressing stream.
+    :param chunk_size: Number of bytes decoded at once. Default: 64 MB.
+    :return: original Miller indices, batch numbers, intensities, sigmas
+    :rtype: tuple
+    """
+    blocks = [decode_unmerged_block(_) for _ in iter_line_blocks(f, chunk_size, stop=None) if _.strip()]
+    if not blocks:
+        raise AssertionError('No unmerged scalepack records found.')
+    return tuple(np.concatenate(_) for _ in zip(*blocks))
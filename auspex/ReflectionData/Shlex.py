@@ -1,8 +1,15 @@
-from iotbx import reflection_file_reader
+import re
+
 from cctbx import uctbx, crystal, sgtbx
+from cctbx.array_family import flex
 
 from .ReflectionBase import *
 
+# HKLF 4 record: h, k, l (3I4), I, sigma(I) (2F8.2), optionally followed by a batch number
+_hklf_record = np.dtype([('h', 'S4'), ('k', 'S4'), ('l', 'S4'), ('i', 'S8'), ('sigma', 'S8')])
+# the record 0 0 0 terminates the reflections, it may be followed by instructions
+_hklf_end = re.compile(rb'^ *-?0 +-?0 +-?0(?: |\r?$)', re.MULTILINE)
+
 
 class ShlexParser(ReflectionParser):
     """
@@ -12,40 +19,115 @@ class ShlexParser(ReflectionParser):
         super(ShlexParser, self).__init__()
         self.miller_set = None
         self.crystal_symmetry = None
+        self._merged_index = None
 
     def read(self, filename: str,
              unit_cell: list[float, float, float, float, float, float],
-             space_group_number: int):
-        try:
-            self._obj = reflection_file_reader.any_reflection_file(filename+'=intensities')
-        except:
-            pass
+             space_group_number: int,
+             chunk_size: int = 1 << 26):
+        """Read the given SHELX HKLF 4 file. The fixed-width records are decoded block-wise into numpy arrays and
+        mapped to the asymmetric unit without building cctbx arrays of the observations.
+
+        :param filename: File or path to file.
+        :param unit_cell: Unit cell parameters (a, b, c, alpha, beta, gamma).
+        :param space_group_number: Space group number.
+        :param chunk_size: Number of bytes decoded at once. Default: 64 MB.
+        :return: None
+        """
         self.crystal_symmetry = crystal.symmetry().customized_copy(
-            uctbx.unit_cell(unit_cell),
-            sgtbx.space_group(sgtbx.space_group_symbols(space_group_number)).info()
+            uctbx.unit_cell(tuple(float(_) for _ in unit_cell)),
+            sgtbx.space_group(sgtbx.space_group_symbols(int(space_group_number))).info()
         )
         self._space_group = self.crystal_symmetry.space_group()
-        self.miller_set = self._obj.as_miller_arrays(self.crystal_symmetry, merge_equivalents=False)[0].map_to_asu()
-        self._hkl = np.array(self.miller_set.indices())
-        self._I = np.array(self.miller_set.data())
-        self._sigI = np.array(self.miller_set.sigmas())
-        self._resolutionI = np.array(self.miller_set.unit_cell().d(self.miller_set.indices()))
+        with open_reflection_file(filename, 'rb') as f:
+            hkl, intensities, sigmas = read_hklf(f, chunk_size)
+        # group the observations by their equivalence class. only one index per class is mapped by cctbx.
+        # Friedel mates are kept apart, as by the iotbx reader of HKLF files.
+        keys = equivalence_keys(hkl, self._space_group, anomalous_flag=True)
+        _, first, self._merged_index = np.unique(keys, return_index=True, return_inverse=True)
+        self.miller_set = miller.set(crystal_symmetry=self.crystal_symmetry,
+                                     indices=flex.miller_index(hkl[first].tolist()),
+                                     anomalous_flag=True).map_to_asu()
+        self._hkl_merged = np.array(self.miller_set.indices())
+        self._hkl = self._hkl_merged[self._merged_index]
+        self._I = intensities
+        self._sigI = sigmas
+        self._set_resolution('I', self._hkl, self.crystal_symmetry.unit_cell())
         self._resolution = self._resolutionI
+        self._d_star_sq = self._d_star_sqI
         self._filename = filename
         self._merge()
 
     def _merge(self):
-        """Record the merged data.
+        """Record the merged data, with the estimator of cctbx merge_equivalents. Equivalent observations are
+        averaged with weights 1/sigma^2. Observations with a sigma not above 1e-6 times the largest sigma of their
+        reflection do not contribute. The merged sigma is the larger of the external error 1/sqrt(sum of weights)
+        and sqrt(V/n), V being the weighted variance of the n observations as in gsl_stats_wvariance. A single
+        observation keeps its sigma, a reflection without contributing observations is set to 0.
 
         :return: None
         """
-        # merged_miller = self._obj.as_miller_arrays(self.crystal_symmetry, merge_equivalents=True)[0] won't merge
-        assert self.miller_set.is_unmerged_intensity_array()
-        merged_miller = self.miller_set.merge_equivalents().array()
-        self._I_merged = np.array(merged_miller.data())
-        self._hkl_merged = np.array(merged_miller.indices())
-        self._sigI_merged = np.array(merged_miller.sigmas())
-        self._resolution_merged = np.array(merged_miller.unit_cell().d(merged_miller.indices()))
-        self._multiplicity_merged = merged_miller.multiplicities().data().as_numpy_array()
-        self._complete_set = merged_miller.complete_set()
+        num_merged = self._hkl_merged.shape[0]
+        max_sigma = np.zeros(num_merged, dtype=np.float64)
+        np.maximum.at(max_sigma, self._merged_index, self._sigI)
+        valid = self._sigI > max_sigma[self._merged_index] * 1e-6
+        weights = np.zeros(self._sigI.shape, dtype=np.float64)
+        weights[valid] = 1. / np.square(self._sigI[valid], dtype=np.float64)
+        sum_weights = np.bincount(self._merged_index, weights=weights, minlength=num_merged)
+        sum_weights_sq = np.bincount(self._merged_index, weights=weights * weights, minlength=num_merged)
+        sum_weighted_obs = np.bincount(self._merged_index, weights=weights * self._I, minlength=num_merged)
+        num_obs = np.bincount(self._merged_index, weights=valid, minlength=num_merged)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            i_merged = np.where(sum_weights > 0., sum_weighted_obs / sum_weights, 0.)
+            deviation = weights * np.square(self._I - i_merged[self._merged_index])
+            var_weighted = sum_weights / (np.square(sum_weights) - sum_weights_sq) \
+                * np.bincount(self._merged_index, weights=deviation, minlength=num_merged)
+            var_merged = np.maximum(var_weighted / num_obs, 1. / sum_weights)
+        var_merged[num_obs < 2] = 0.
+        self._I_merged = i_merged
+        self._sigI_merged = np.where(num_obs == 1, max_sigma, np.sqrt(var_merged))
+        self._resolution_merged = d_spacing(self._hkl_merged, self.crystal_symmetry.unit_cell())
+        self._multiplicity_merged = self.miller_set.multiplicities().data().as_numpy_array()
+        self._complete_set = self.miller_set.complete_set()
+
 
+def decode_hklf_block(block: bytes) -> tuple[np.ndarray[Literal["N", 3], np.int_],
+                                             np.ndarray[Literal["N"], np.float64],
+                                             np.ndarray[Literal["N"], np.float64]]:
+    """Decode a block of fixed-width HKLF 4 records (3I4,2F8.2). Neighbouring fields may run into each other, e.g.
+    -100-100, so the fields are cut by position instead of being split at whitespace.
+
+    :param block: Complete lines of text.
+    :return: Miller indices, intensities, sigmas
+    :rtype: tuple
+    """
+    records = cut_fixed_width_block(block, _hklf_record)
+    hkl = np.stack((records['h'].astype(int), records['k'].astype(int), records['l'].astype(int)), axis=1)
+    return hkl, records['i'].astype(np.float64), records['sigma'].astype(np.float64)
+
+
+def read_hklf(f, chunk_size: int = 1 << 26) -> tuple[np.ndarray[Literal["N", 3], np.int_],
+                                                     np.ndarray[Literal["N"], np.float64],
+                                                     np.ndarray[Literal["N"], np.float64]]:
+    """Read the HKLF 4 records of a SHELX hkl file block by block. Reading stops at the terminating 0 0 0 record.
+
+    :param f: Binary file object. May be a decompressing stream.
+    :param chunk_size: Number of bytes decoded at once. Default: 64 MB.
+    :return: Miller indices, intensities, sigmas
+    :rtype: tuple
+    """
+    hkl, intensities, sigmas = [], [], []
+    for block in iter_line_blocks(f, chunk_size, stop=None):
+        end = _hklf_end.search(block)
+        if end is not None:
+            block = block[:end.start()]
+        if block.strip():
+            block_hkl, block_i, block_sigma = decode_hklf_block(block)
+            hkl.append(block_hkl)
+            intensities.append(block_i)
+            sigmas.append(block_sigma)
+        if end is not None:
+            break
+    if not hkl:
+        raise RuntimeError('No HKLF records found.')
+    return np.concatenate(hkl), np.concatenate(intensities), np.concatenate(sigmas)
@@ -1,14 +1,21 @@
 import numpy as np
-import copy
 import itertools
 import math
 
 from iotbx.xds import read_ascii
+from cctbx import crystal, sgtbx
+from cctbx.array_family import flex as af_flex
 import scitbx_array_family_flex_ext as flex
 
 import auspex.BinnedData
 from .ReflectionBase import *
 
+XdsChunk = namedtuple('XdsChunk', ['hkl', 'iobs', 'sigma', 'zd'])
+
+# per unique reflection sums accumulated in streaming mode: number of observations, sums of I, I^2 and sigma^2,
+# sums of the weights 1/sigma^2, of w*I and w*I^2, and the sum of the absolute deviations from the mean intensity
+_reflection_sum_names = ['n', 'i', 'i_sq', 'sig_sq', 'w', 'w_i', 'w_i_sq', 'abs_dev']
+
 
 class XdsParser(ReflectionParser):
     """The Parser class to process xds files.
@@ -21,42 +28,277 @@ class XdsParser(ReflectionParser):
         self.intensity_by_multiplicity = None
         self.ires_by_multiplicity = None
         self.sig_by_multiplicity = None
+        self._header = None
+        self._crystal_symmetry = None
+        self._zd = None
+        self._reflection_sums = None
 
-    def read_hkl(self, filename: str = None, merge_equivalents: bool = True):
+    def read_hkl(self, filename: str = None, merge_equivalents: bool = True, streaming: bool = False,
+                 chunk_size: int = 1 << 26):
         """Read the given XDS HKL file.
 
         :param filename: File or path to file.
         :type filename: str
         :param merge_equivalents: Whether to merge the observations. Default is True.
         :type merge_equivalents: bool
+        :param streaming: If True, the data records are not held in memory. They are read block by block and only
+                          the sums needed for the merged data and the merging statistics are accumulated, so peak
+                          memory is bounded by one block plus the unique reflections. The merged reflections are then
+                          used as the observations. Default is False.
+        :type streaming: bool
+        :param chunk_size: Number of bytes decoded at once in streaming mode. Default: 64 MB.
+        :type chunk_size: int
         :return: None
         """
-        # use iotbx.mtz to read mtz file
-        with open(filename) as ascii_hkl:
+        if streaming:
+            self.read_header(filename)
+            self._space_group = self._crystal_symmetry.space_group()
+            self._filename = filename
+            self._accumulate_chunks(filename, chunk_size)
+            # the merged reflections are the observations of the analysis
+            self._hkl = self._hkl_merged
+            self._I = self._I_merged
+            self._sigI = self._sigI_merged
+            self._set_resolution('', self._hkl, self._crystal_symmetry.unit_cell())
+            return
+        self.read_header(filename)
+        with open_reflection_file(filename, 'r') as ascii_hkl:
             self._obj = read_ascii.reader(ascii_hkl)
-        self._space_group = self._obj.crystal_symmetry().space_group()
+        self._crystal_symmetry = self._obj.crystal_symmetry()
         # read IOBS
         self._I = np.array(self._obj.iobs, dtype=float)
         # read SIGMA(IOBS)
         self._sigI = np.array(self._obj.sigma_iobs, dtype=float)
         # read hkl
         self._hkl = np.array(self._obj.miller_indices)
-        self._hkl_view = self._hkl.copy().view([('a', int), ('b', int), ('c', int)])
-        self._resolution = np.array(self._obj.unit_cell.d(self._obj.miller_indices))
+        if self._obj.unmerged_data:
+            self._zd = self._obj.zd.as_numpy_array()
+        self._space_group = self._crystal_symmetry.space_group()
+        self._set_resolution('', self._hkl, self._crystal_symmetry.unit_cell())
+        self._filename = filename
         if merge_equivalents is True:
             self._merge()
-        self._filename = filename
+
+    def _accumulate_chunks(self, filename: str, chunk_size: int = 1 << 26):
+        """Merge the observations of the given XDS_ASCII.HKL file from its data blocks. The first pass accumulates
+        the number of observations and the sums of I, I^2, sigma^2 and of the weights 1/sigma^2 per unique
+        reflection. The second pass accumulates the absolute deviations from the mean intensities, needed by
+        R-merge, R-meas and R-pim. Observations with negative sigmas are excluded as misfits, as done by XDS.
+
+        :param filename: File or path to file.
+        :param chunk_size: Number of bytes decoded at once. Default: 64 MB.
+        :return: None
+        """
+        anomalous_flag = self.anomalous_flag
+        keys = np.zeros(0, dtype=np.int64)
+        sums = np.zeros((0, len(_reflection_sum_names)), dtype=np.float64)
+        for chunk in self.iter_chunks(filename, chunk_size):
+            valid = chunk.sigma >= 0.
+            chunk_keys = equivalence_keys(chunk.hkl[valid], self._space_group, anomalous_flag)
+            iobs, sigma = chunk.iobs[valid], chunk.sigma[valid]
+            with np.errstate(divide='ignore'):
+                weights = np.where(sigma > 0., 1. / (sigma * sigma), 0.)
+            chunk_sums = np.stack((np.ones(iobs.size), iobs, iobs * iobs, sigma * sigma,
+                                   weights, weights * iobs, weights * iobs * iobs, np.zeros(iobs.size)), axis=1)
+            keys, inverse = np.unique(np.concatenate((keys, chunk_keys)), return_inverse=True)
+            sums = np.stack([np.bincount(inverse.reshape(-1), weights=np.concatenate((sums[:, i], chunk_sums[:, i])),
+                                         minlength=keys.size) for i in range(sums.shape[1])], axis=1)
+        n = sums[:, _reflection_sum_names.index('n')]
+        i_mean = sums[:, _reflection_sum_names.index('i')] / n
+        dev_idx = _reflection_sum_names.index('abs_dev')
+        for chunk in self.iter_chunks(filename, chunk_size):
+            valid = chunk.sigma >= 0.
+            pos = np.searchsorted(keys, equivalence_keys(chunk.hkl[valid], self._space_group, anomalous_flag))
+            sums[:, dev_idx] += np.bincount(pos, weights=np.abs(chunk.iobs[valid] - i_mean[pos]), minlength=keys.size)
+        # single observations without a positive sigma are dropped, as in group_by_redundancies
+        keep = (n > 1) | (sums[:, _reflection_sum_names.index('sig_sq')] > 0.)
+        keys, sums = keys[keep], sums[keep]
+        miller_set = miller.set(crystal_symmetry=self._crystal_symmetry,
+                                indices=af_flex.miller_index(unpack_hkl(keys).tolist()),
+                                anomalous_flag=anomalous_flag).map_to_asu()
+        self._reflection_sums = sums
+        self._hkl_merged = np.array(miller_set.indices())
+        # weighted mean. the sigma is the larger of the external and the internal error.
+        n = sums[:, _reflection_sum_names.index('n')]
+        sum_w = sums[:, _reflection_sum_names.index('w')]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._I_merged = np.where(sum_w > 0., sums[:, _reflection_sum_names.index('w_i')] / sum_w, sums[:, 1] / n)
+            var_internal = (sums[:, _reflection_sum_names.index('w_i_sq')] - sum_w * self._I_merged ** 2) \
+                / ((n - 1.) * sum_w)
+            var_external = 1. / sum_w
+        var_internal[(n < 2) | ~np.isfinite(var_internal)] = 0.
+        var_external[sum_w == 0.] = 0.
+        self._sigI_merged = np.sqrt(np.maximum(var_internal, var_external))
+        self._resolution_merged = d_spacing(self._hkl_merged, self._crystal_symmetry.unit_cell())
+        self._multiplicity_merged = miller_set.multiplicities().data().as_numpy_array()
+        self._complete_set = miller_set.complete_set()
+
+    @property
+    def streaming(self) -> bool:
+        """
+        :return: whether the data were read in streaming mode, in which only the merged reflections are kept
+        :rtype: bool
+        """
+        return self._reflection_sums is not None
+
+    @property
+    def anomalous_flag(self) -> bool:
+        """Friedel mates are different reflections for unmerged data and for FRIEDEL'S_LAW=FALSE, as in
+        iotbx.xds.read_ascii.
+
+        :return: whether Friedel mates are kept apart when merging
+        :rtype: bool
+        """
+        return not self._header['merge'] or not self._header['friedels_law']
+
+    def valid_observations(self) -> np.ndarray[Literal["N"], np.bool_]:
+        """Observations with negative sigmas are misfits and skipped, as in iotbx.xds.read_ascii. The same
+        observations are merged and grouped by redundancy.
+
+        :return: whether each observation is used
+        :rtype: 1d ndarray
+        """
+        return self._sigI >= 0.
+
+    def read_header(self, filename: str) -> Dict[str, Any]:
+        """Read only the header of the given XDS_ASCII.HKL file.
+
+        :param filename: File or path to file.
+        :return: Header items, including the 1-based positions of the data items and the byte offset of the data.
+        :rtype: dict
+        """
+        header = {'merge': False, 'friedels_law': True, 'items': {}}
+        with open_reflection_file(filename, 'rb') as ascii_hkl:
+            while True:
+                line = ascii_hkl.readline()
+                if not line.startswith(b'!'):
+                    raise AssertionError('{0} has no complete XDS_ASCII header.'.format(source_name(filename)))
+                if line.startswith(b'!END_OF_HEADER'):
+                    header['data_offset'] = ascii_hkl.tell()
+                    break
+                for key, value in _parse_header_line(line.decode('ascii', 'replace')).items():
+                    if key.startswith('ITEM_'):
+                        header['items'][key[5:]] = int(value)
+                    elif key == 'FORMAT':
+                        header['format'] = value
+                    elif key == 'MERGE':
+                        header['merge'] = value == 'TRUE'
+                    elif key == "FRIEDEL'S_LAW":
+                        header['friedels_law'] = value == 'TRUE'
+                    elif key == 'SPACE_GROUP_NUMBER':
+                        header['space_group_number'] = int(value)
+                    elif key == 'UNIT_CELL_CONSTANTS':
+                        header['unit_cell'] = tuple(float(_) for _ in value.split())
+                    elif key == 'NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD':
+                        header['n_items'] = int(value)
+        if header.get('format') != 'XDS_ASCII':
+            raise AssertionError('{0} is not an XDS_ASCII file.'.format(source_name(filename)))
+        self._header = header
+        self._crystal_symmetry = crystal.symmetry(
+            unit_cell=header['unit_cell'],
+            space_group_info=sgtbx.space_group_info(number=header['space_group_number']))
+        return header
+
+    def _item_columns(self) -> list[int, ...]:
+        """
+        :return: 0-based positions of H, K, L, IOBS, SIGMA(IOBS) and, for unmerged data, ZD in each data record
+        :rtype: list
+        """
+        items = self._header['items']
+        names = ['H', 'K', 'L', 'IOBS', 'SIGMA(IOBS)']
+        if 'ZD' in items:
+            names.append('ZD')
+        return [items[_] - 1 for _ in names]
+
+    def iter_chunks(self, filename: str, chunk_size: int = 1 << 26):
+        """Iterate over the data records of the given XDS_ASCII.HKL file block by block.
+        Only the header and one block are held in memory, so consumers can accumulate over files of any size.
+
+        :param filename: File or path to file.
+        :param chunk_size: Number of bytes decoded at once. Default: 64 MB.
+        :return: Generator of XdsChunk(hkl, iobs, sigma, zd). zd is None for merged data.
+        """
+        if self._header is None:
+            self.read_header(filename)
+        item_columns = self._item_columns()
+        with open_reflection_file(filename, 'rb') as ascii_hkl:
+            ascii_hkl.seek(self._header['data_offset'])
+            for block in iter_line_blocks(ascii_hkl, chunk_size):
+                records = decode_line_block(block, self._header['n_items'])[:, item_columns]
+                yield XdsChunk(hkl=records[:, :3].astype(int), iobs=records[:, 3], sigma=records[:, 4],
+                               zd=records[:, 5] if records.shape[1] > 5 else None)
+
+    def write_filtered(self, filename: str, output: str, exclude_hkl: np.ndarray[Literal["N", 3], np.int_],
+                       chunk_size: int = 1 << 26) -> int:
+        """Write a copy of the given XDS_ASCII.HKL file without the observations equivalent to the given Miller
+        indices, e.g. NEMOs. The data records are streamed block by block and the kept lines are copied unchanged,
+        so memory stays bounded by one block for files of any size.
+
+        :param filename: File or path to file.
+        :param output: Path of the filtered file.
+        :param exclude_hkl: Miller indices to remove. All symmetry equivalents are removed, and the Friedel mates
+                            too unless the header sets FRIEDEL'S_LAW=FALSE.
+        :param chunk_size: Number of bytes processed at once. Default: 64 MB.
+        :return: Number of removed observations.
+        :rtype: int
+        """
+        if self._header is None:
+            self.read_header(filename)
+        space_group = self._crystal_symmetry.space_group()
+        anomalous_flag = not self._header['friedels_law']
+        exclude_keys = np.unique(equivalence_keys(exclude_hkl, space_group, anomalous_flag))
+        hkl_columns = self._item_columns()[:3]
+        num_removed = 0
+        with open_reflection_file(filename, 'rb') as ascii_hkl, open(output, 'wb') as filtered:
+            filtered.write(ascii_hkl.read(self._header['data_offset']))
+            for block in iter_line_blocks(ascii_hkl, chunk_size):
+                # the kept lines are decoded, so that each line has its own record
+                lines = [_ for _ in block.splitlines(keepends=True) if _.strip()]
+                hkl = decode_line_block(b''.join(lines), self._header['n_items'])[:, hkl_columns]
+                if hkl.shape[0] != len(lines):
+                    raise AssertionError('Malformed data record: {0} records in {1} lines.'.format(hkl.shape[0],
+                                                                                               len(lines)))
+                keys = equivalence_keys(hkl.astype(np.int64), space_group, anomalous_flag)
+                if exclude_keys.size > 0:
+                    pos = np.searchsorted(exclude_keys, keys).clip(max=exclude_keys.size - 1)
+                    keep = exclude_keys[pos] != keys
+                else:
+                    keep = np.full(keys.size, True)
+                num_removed += keys.size - int(np.count_nonzero(keep))
+                filtered.writelines(itertools.compress(lines, keep))
+            filtered.write(b'!END_OF_DATA\n')
+        return num_removed
+
+    def as_miller_array(self, merge_equivalents: bool = True) -> miller.array:
+        """Convert the intensities to a cctbx miller array.
+
+        :param merge_equivalents: Whether to merge the observations. Default is True.
+        :return: A cctbx miller array
+        :rtype: cctbx.miller_array
+        """
+        if self._obj is not None:
+            return self._obj.as_miller_array(merge_equivalents=merge_equivalents)
+        # streaming mode, cached or scalepack data
+        valid = self.valid_observations()
+        miller_set = miller.set(crystal_symmetry=self._crystal_symmetry,
+                                indices=af_flex.miller_index(self._hkl[valid].tolist()),
+                                anomalous_flag=self.anomalous_flag)
+        i_obs = miller.array(miller_set, data=af_flex.double(self._I[valid]), sigmas=af_flex.double(self._sigI[valid]))
+        i_obs.set_observation_type_xray_intensity()
+        if merge_equivalents:
+            i_obs = i_obs.merge_equivalents().array()
+        return i_obs
 
     def _merge(self):
         """Record the merged data.
 
         :return: None
         """
-        merged_miller = self._obj.as_miller_array(merge_equivalents=True)
+        merged_miller = self.as_miller_array(merge_equivalents=True)
         self._I_merged = np.array(merged_miller.data())
         self._hkl_merged = np.array(merged_miller.indices())
         self._sigI_merged = np.array(merged_miller.sigmas())
-        self._resolution_merged = np.array(self._obj.unit_cell.d(merged_miller.indices()))
+        self._resolution_merged = d_spacing(self._hkl_merged, self._crystal_symmetry.unit_cell())
         self._multiplicity_merged = merged_miller.multiplicities().data().as_numpy_array()
         self._complete_set = merged_miller.complete_set()
 
@@ -67,7 +309,7 @@ class XdsParser(ReflectionParser):
         :rtype: 1d ndarray
         """
         redund = miller.merge_equivalents(
-            self._obj.as_miller_array(merge_equivalents=False).map_to_asu()).redundancies().data().as_numpy_array()
+            self.as_miller_array(merge_equivalents=False).map_to_asu()).redundancies().data().as_numpy_array()
         return np.unique(redund)
 
     def group_by_redundancies(self):
@@ -84,7 +326,7 @@ class XdsParser(ReflectionParser):
 
         # get redundancy of each reflection in merged data
         redund = miller.merge_equivalents(
-            self._obj.as_miller_array(merge_equivalents=False).map_to_asu()).redundancies().data().as_numpy_array()
+            self.as_miller_array(merge_equivalents=False).map_to_asu()).redundancies().data().as_numpy_array()
 
 
         # get multiplicity of each reflection in merged data
@@ -99,12 +341,23 @@ class XdsParser(ReflectionParser):
         resolution_container = [list() for _ in range(uni_redund.size)]
         sigma_container = [list() for _ in range(uni_redund.size)]
 
-        # shrinkable shallow copy for unmerged indices, obs and resolution
-        tmp = self._hkl
-        tmp_obs = self._I
-        tmp_resol = self._resolution
+        # reflections are matched by the packed key of their equivalence class under the rotations of the space
+        # group, as the symmetry equivalents listed by miller.sym_equiv_indices
+        merged_keys = equivalence_keys(self._hkl_merged, self._space_group, self.anomalous_flag)
+
+        # shrinkable copy for unmerged indices, obs and resolution, of the observations in the miller array.
+        # the observations are sorted by reflection, so that the observations of each reflection are contiguous
+        # whatever the order of the file
+        valid = np.flatnonzero(self.valid_observations())
+        valid_keys = equivalence_keys(self._hkl[valid], self._space_group, self.anomalous_flag)
+        order = np.argsort(valid_keys, kind='stable')
+        valid = valid[order]
+        tmp = self._hkl[valid]
+        tmp_keys = valid_keys[order]
+        tmp_obs = self._I[valid]
+        tmp_resol = self._resolution[valid]
         # tmp_i_over_sig = self._I / self._sigI
-        tmp_sig = self._sigI
+        tmp_sig = self._sigI[valid]
 
         for idx, redund_num in enumerate(uni_redund):  # loop through unique redundancy
             args_redund = np.where(redund == redund_num)[0]
@@ -113,34 +366,17 @@ class XdsParser(ReflectionParser):
             args_redund_separated = [args_redund[multi_of_args_redund == uni] for uni in
                                      np.unique(multi_of_args_redund)]
             for args in args_redund_separated:  # loop through args_redund separated by multiplicity
-                # create iterator for merged data with specific multiplicity and redundancy
-                it = self._hkl_merged[args]
-                hkl_view = tmp.view([('a', int), ('b', int), ('c', int)])  # 1d view of Nx3 matrix
-
-                set_by_multiplicity = list()
-                for hkl_index in it:
-                    sym_operator = miller.sym_equiv_indices(self._space_group, hkl_index.tolist())
-                    set_by_multiplicity.append([_.h() for _ in sym_operator.indices()])
-                # set_by_multiplicity: NxMx3 array,
-                # N: number of obs with specific multiplicity and redundancy
-                # M: multiplicity
-                set_by_multiplicity = np.array(set_by_multiplicity, int)
-                multiplicity = set_by_multiplicity.shape[1]
-
-                logic_or = np.zeros(tmp.shape[0], dtype=bool)
-                for i in range(multiplicity):
-                    # compare_set: Nx3 array
-                    compare_set = copy.deepcopy(set_by_multiplicity[:, i, :]).view([('a', int), ('b', int), ('c', int)])
-                    # logic_or:  Nx1 bool array, true if obs exists,
-                    # N: the number of # of unmerged reflections (shrinkable after each loop)
-                    logic_or = logic_or | np.in1d(hkl_view, compare_set)
+                # logic_or:  Nx1 bool array, true if obs is equivalent to one of the merged reflections,
+                # N: the number of # of unmerged reflections (shrinkable after each loop)
+                logic_or = np.isin(tmp_keys, merged_keys[args])
                 # fill out the container
                 indices_container[idx].append(tmp[logic_or])
                 obs_container[idx].append(tmp_obs[logic_or])
                 resolution_container[idx].append(tmp_resol[logic_or])
                 sigma_container[idx].append(tmp_sig[logic_or])
                 # shrink reflections
-                tmp = copy.deepcopy(tmp[~logic_or])
+                tmp = tmp[~logic_or]
+                tmp_keys = tmp_keys[~logic_or]
                 tmp_obs = tmp_obs[~logic_or]
                 tmp_resol = tmp_resol[~logic_or]
                 tmp_sig = tmp_sig[~logic_or]
@@ -233,10 +469,12 @@ class XdsParser(ReflectionParser):
         for ind, redund in enumerate(uni_redund):
             if redund == 1:
                 continue
-            numerate = np.abs(_obs[ind] - np.mean(_obs[ind], axis=1)[:, None]).sum(1)
+            # the sums are accumulated in double precision, also when the observations are float32
+            obs_mean = np.mean(_obs[ind], axis=1, dtype=np.float64)
+            numerate = np.abs(_obs[ind] - obs_mean[:, None]).sum(1)
 
             r_denominator[redundant_counts_idx_lower[ind-1]:redundant_counts_idx_upper[ind-1]] \
-                = _obs[ind].sum(1)
+                = _obs[ind].sum(1, dtype=np.float64)
 
             r_pim_components[redundant_counts_idx_lower[ind-1]:redundant_counts_idx_upper[ind-1]] \
                 = (np.sqrt(1. / (redund - 1.)) * numerate)
@@ -248,16 +486,53 @@ class XdsParser(ReflectionParser):
                 = numerate
 
             cc_sig_epsilon_squared[redundant_counts_idx_lower[ind-1]:redundant_counts_idx_upper[ind-1]] \
-                = 1. / (redund - 1.) * (np.square(_obs[ind]).sum(axis=1)
-                                      - np.square(_obs[ind].sum(1)) / redund) * 2. / redund
+                = 1. / (redund - 1.) * (np.square(_obs[ind], dtype=np.float64).sum(axis=1)
+                                      - np.square(_obs[ind].sum(1, dtype=np.float64)) / redund) * 2. / redund
 
             cc_x_i_bar[redundant_counts_idx_lower[ind-1]:redundant_counts_idx_upper[ind-1]] \
-                = np.mean(_obs[ind], axis=1)
+                = obs_mean
 
         return r_pim_components, r_meas_components, r_merge_components, r_denominator, \
             cc_sig_epsilon_squared, cc_x_i_bar
 
+    def _merge_stats_from_sums(self, args: np.ndarray[Literal["N"], np.bool_]) -> tuple:
+        """Compute the merging statistics of the selected unique reflections from the sums accumulated in streaming
+        mode. The formulas are those of merge_stats_cmpt.
+
+        :param args: Selection of the merged reflections.
+        :return: number of reflections, mean intensity, mean i over sigma per reflection, rms sigma of the
+                 observations, mean redundancy, r_pim, r_merge, r_meas, cc_half
+        :rtype: tuple
+        """
+        sums = dict(zip(_reflection_sum_names, self._reflection_sums[args].T))
+        n = sums['n']
+        i_mean_hkl = sums['i'] / n
+        redundant = n > 1
+        n_r = n[redundant]
+        numerate = sums['abs_dev'][redundant]
+        r_denominator = sums['i'][redundant].sum()
+        r_pim = (np.sqrt(1. / (n_r - 1.)) * numerate).sum() / r_denominator
+        r_merge = numerate.sum() / r_denominator
+        r_meas = (np.sqrt(n_r / (n_r - 1.)) * numerate).sum() / r_denominator
+        sig_epsilon_square = (1. / (n_r - 1.) * (sums['i_sq'][redundant] - np.square(sums['i'][redundant]) / n_r)
+                              * 2. / n_r).mean()
+        x_i_bar = i_mean_hkl[redundant]
+        sig_y_square = 1 / (x_i_bar.size - 1) * ((x_i_bar * x_i_bar).sum() - np.square(x_i_bar.sum()) / x_i_bar.size)
+        cc_half = (sig_y_square - 0.5 * sig_epsilon_square) / (sig_y_square + 0.5 * sig_epsilon_square)
+        i_mean = i_mean_hkl.mean()
+        i_over_sigma_mean = i_mean / np.sqrt(np.mean(sums['sig_sq'] / n))
+        sig_rms = np.sqrt(sums['sig_sq'].sum() / n.sum())
+        return n.size, i_mean, i_over_sigma_mean, sig_rms, n.mean(), r_pim, r_merge, r_meas, cc_half
+
     def merge_stats_overall(self) -> auspex.BinnedData.BinnedStatistics:
+        if self.streaming:
+            ires = self._resolution_merged
+            num_data, i_mean, i_over_sigma_mean, _, redundancy_mean, r_pim, r_merge, r_meas, cc_half = \
+                self._merge_stats_from_sums(np.ones(ires.size, dtype=bool))
+            from auspex.BinnedData import BinnedStatistics
+            return BinnedStatistics().const_stats([ires.min(), ires.max()], num_data, i_mean, i_over_sigma_mean,
+                                                  self.cal_completeness(ires), redundancy_mean,
+                                                  r_pim, r_merge, r_meas, cc_half)
         r_pim_cmpt, r_meas_cmpt, r_merge_cmpt, r_denominator, cc_sig_epsilon_cmpt, cc_x_i_bar_cmpt = self.merge_stats_cmpt()
         ires_unique = np.concatenate(self.ires_by_multiplicity)
         num_data = ires_unique.size
@@ -285,6 +560,8 @@ class XdsParser(ReflectionParser):
         return merge_stats
 
     def merge_stats_binned(self, num_of_bins: int = 21) -> auspex.BinnedData.BinnedStatistics:
+        if self.streaming:
+            return self._merge_stats_binned_from_sums(num_of_bins)
         r_pim_cmpt, r_meas_cmpt, r_merge_cmpt, r_denominator, cc_sig_epsilon_cmpt, cc_x_i_bar_cmpt = self.merge_stats_cmpt()
         ires_unique = np.concatenate(self.ires_by_multiplicity)
         intensity_hkl = np.concatenate(
@@ -363,6 +640,25 @@ class XdsParser(ReflectionParser):
                                                     redundancy_binned, r_pim_binned, r_merge_binned, r_meas_binned, cc_half_binned)
         return merg_stats
 
+    def _merge_stats_binned_from_sums(self, num_of_bins: int = 21) -> auspex.BinnedData.BinnedStatistics:
+        """merge_stats_binned of data read in streaming mode.
+
+        :param num_of_bins: Number of resolution bins. Default: 21.
+        :return: binned merging statistics
+        :rtype: auspex.BinnedData.BinnedStatistics
+        """
+        ires = self._resolution_merged
+        stats = [[] for _ in range(10)]
+        for args in _get_args_binned([ires], num_of_bins):
+            num_data, i_mean, _, sig_rms, redundancy, r_pim, r_merge, r_meas, cc_half = \
+                self._merge_stats_from_sums(args)
+            for stat, value in zip(stats, (ires[args], num_data, i_mean, i_mean / sig_rms,
+                                           self.cal_completeness(ires[args]), redundancy,
+                                           r_pim, r_merge, r_meas, cc_half)):
+                stat.append(value)
+        from auspex.BinnedData import BinnedStatistics
+        return BinnedStatistics().const_stats(stats[0], *[np.array(_) for _ in stats[1:]])
+
     def merge_stats_by_range(self, max_resolution: float, min_resolution: float) \
             -> auspex.BinnedData.BinnedStatistics:
         r_pim_cmpt, r_meas_cmpt, r_merge_cmpt, r_denominator, cc_sig_epsilon_cmpt, cc_x_i_bar_cmpt = self.merge_stats_cmpt()
@@ -508,12 +804,8 @@ class XdsParser(ReflectionParser):
         :return:
         :rtype: Nx3 numpy.ndarray(dtype=int)
         """
-        bool_pos = np.full(self.size, False)
         sym_operator = miller.sym_equiv_indices(self._space_group, [int(h), int(k), int(l)])
-        for miller_idx in sym_operator.indices():
-            search_view = np.array(miller_idx.h()).view([('a', int), ('b', int), ('c', int)])
-            bool_pos |= np.in1d(self._hkl_view, search_view)
-        return np.argwhere(bool_pos).flatten()
+        return self.hkl_keys.rows([_.h() for _ in sym_operator.indices()])
 
     @filename_check
     def get_space_group(self) -> str:
@@ -521,7 +813,7 @@ class XdsParser(ReflectionParser):
         :return: space group
         :rtype: str
         """
-        return str(self._obj.miller_set().space_group().info())
+        return str(self._crystal_symmetry.space_group_info())
 
     @filename_check
     def get_cell_dimension(self):
@@ -529,7 +821,7 @@ class XdsParser(ReflectionParser):
         :return: cell dimensions (a*, b*, c*, alpha, beta, gamma)
         :rtype: tuple
         """
-        return self._obj.miller_set().unit_cell().parameters()
+        return self._crystal_symmetry.unit_cell().parameters()
 
     @filename_check
     def get_max_resolution(self) -> float:
@@ -537,7 +829,7 @@ class XdsParser(ReflectionParser):
         :return: maximum resolution
         :rtype: float
         """
-        return self._obj.miller_set().resolution_range()[1]
+        return self._resolution.min()
 
     @filename_check
     def get_min_resolution(self) -> float:
@@ -545,7 +837,7 @@ class XdsParser(ReflectionParser):
         :return: minimum resolution
         :rtype: float
         """
-        return self._obj.miller_set().resolution_range()[0]
+        return self._resolution.max()
 
     @filename_check
     def get_merged_I(self) -> np.ndarray[Literal["N"], np.float32]:
@@ -585,10 +877,26 @@ class XdsParser(ReflectionParser):
         :return: reflection position array on z-axis
         :rtype: 1d ndarray
         """
-        if self._obj.unmerged_data:
-            return self._obj.zd.as_numpy_array()
-        else:
-            return None
+        return self._zd
+
+
+def _parse_header_line(line: str) -> Dict[str, str]:
+    """Split an XDS header line into its KEY=value items. A line may hold several items and a value
+    may span several words, e.g. !UNIT_CELL_CONSTANTS=  64.6  98.3 119.9  90.0  90.0  90.0
+
+    :param line: Header line starting with !.
+    :return: Values by key.
+    :rtype: dict
+    """
+    items = {}
+    key = None
+    for word in line.lstrip('!').split():
+        if '=' in word:
+            key, value = word.split('=', 1)
+            items[key] = [value] if value else []
+        elif key is not None:
+            items[key].append(word)
+    return {key: ' '.join(value) for key, value in items.items()}
 
 
 def _get_bins_by_binwidth(ires: np.ndarray[Literal["N"], np.float32], bin_width: float) \
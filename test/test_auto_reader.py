@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip('cctbx')
+pytest.importorskip('dxtbx')
+
+from auspex.ReflectionData.AutoReader import FileReader, probe_file
+
+integrate_hkl = b"""!OUTPUT_FILE=INTEGRATE.HKL      DATE= 1-Jan-2024
+!SPACE_GROUP_NUMBER=    3
+!END_OF_HEADER
+     1     2     3 1.000E+02 1.000E+01
+!END_OF_DATA
+"""
+
+
+def test_integrate_hkl_is_refused(tmp_path):
+    filename = str(tmp_path / 'INTEGRATE.HKL')
+    with open(filename, 'wb') as f:
+        f.write(integrate_hkl)
+    assert probe_file(filename)['format'] == 'integrate_hkl'
+    with pytest.raises(RuntimeError, match='INTEGRATE.HKL'):
+        FileReader(filename)
+
+
+def test_unknown_format(tmp_path):
+    filename = str(tmp_path / 'notes.txt')
+    with open(filename, 'wb') as f:
+        f.write(b'not a reflection file\n')
+    with pytest.raises(RuntimeError, match='not recognised'):
+        FileReader(filename)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cctbx.miller')
+pytest.importorskip('gemmi')
+
+from auspex.ReflectionData.Cif import CifParser
+
+cif_format = """data_{0}
+_cell.length_a 40.0
+_cell.length_b 50.0
+_cell.length_c 60.0
+_cell.angle_alpha 90.0
+_cell.angle_beta 90.0
+_cell.angle_gamma 90.0
+_symmetry.space_group_name_H-M 'P 21 21 21'
+loop_
+_refln.index_h
+_refln.index_k
+_refln.index_l
+{1}
+"""
+
+anomalous_items = """_refln.pdbx_I_plus
+_refln.pdbx_I_plus_sigma
+_refln.pdbx_I_minus
+_refln.pdbx_I_minus_sigma
+1 2 3 100.0 10.0 90.0 9.0
+2 2 3 50.0 5.0 ? ?
+3 2 3 ? ? 30.0 3.0
+4 2 3 40.0 ? 20.0 2.0
+5 2 3 ? 4.0 10.0 1.0
+6 2 3 ? ? ? ?"""
+
+intensity_items = """_refln.intensity_meas
+_refln.intensity_sigma
+1 1 1 10.0 1.0
+2 2 2 20.0 2.0"""
+
+
+def test_anomalous_only_block(tmp_path):
+    filename = str(tmp_path / 'anomalous.cif')
+    with open(filename, 'w') as f:
+        f.write(cif_format.format('ano', anomalous_items) + cif_format.format('merged', intensity_items))
+    datasets = CifParser()
+    datasets.read(filename)
+    datasets = datasets.split_datasets()
+    assert sorted(datasets) == ['ano', 'merged']
+    assert all(_._hkl is not None for _ in datasets.values())
+    parser = datasets['ano']
+    # the pair of 6 2 3 has no observation
+    np.testing.assert_array_equal(parser._hkl, [[h, 2, 3] for h in range(1, 6)])
+    assert parser._I_ano.size == 2 * parser._hkl.shape[0]
+    np.testing.assert_array_equal(parser._I_ano, [100., 90., 50., 0., 0., 30., 0., 20., 0., 10.])
+    np.testing.assert_array_equal(parser._sigI_ano, [10., 9., 5., 0., 0., 3., 0., 2., 0., 1.])
+    # the missing halves have sigma 0 and are not valid observations
+    observation = parser.get_intensity_anom_data()
+    np.testing.assert_array_equal(observation.obs, [100., 90., 50., 30., 20., 10.])
+    assert not np.isnan(parser._I_ano).any()
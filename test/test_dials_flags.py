@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+msgpack = pytest.importorskip('msgpack')
+pytest.importorskip('cctbx')
+pytest.importorskip('dxtbx')
+
+from auspex.ReflectionData.Dials import DialsParser, dials_flags, _dials_integrated_diamond, _dials_strong
+
+nrows = 12
+
+# element type and numpy type of the columns of the test tables
+column_types = {'bbox': ('int6', '<i4', 6), 'entering': ('bool', '?', 1), 'flags': ('std::size_t', '<u8', 1),
+                'id': ('int', '<i4', 1), 'miller_index': ('cctbx::miller::index<>', '<i4', 3),
+                'num_pixels.background': ('int', '<i4', 1), 'num_pixels.background_used': ('int', '<i4', 1),
+                'num_pixels.foreground': ('int', '<i4', 1), 'num_pixels.valid': ('int', '<i4', 1),
+                'n_signal': ('int', '<i4', 1), 'panel': ('std::size_t', '<u8', 1),
+                'partial_id': ('std::size_t', '<u8', 1), 's1': ('vec3<double>', '<f8', 3),
+                'xyzcal.mm': ('vec3<double>', '<f8', 3), 'xyzcal.px': ('vec3<double>', '<f8', 3),
+                'xyzobs.mm.value': ('vec3<double>', '<f8', 3), 'xyzobs.mm.variance': ('vec3<double>', '<f8', 3),
+                'xyzobs.px.value': ('vec3<double>', '<f8', 3), 'xyzobs.px.variance': ('vec3<double>', '<f8', 3)}
+
+
+def column_values(name):
+    type_name, dtype, width = column_types.get(name, ('double', '<f8', 1))
+    values = np.arange(nrows * width).reshape(nrows, width) + len(name)
+    if name == 'flags':
+        values = np.full((nrows, 1), dials_flags['in_powder_ring'] | 1)
+    elif name == 'id':
+        values = np.zeros((nrows, 1))
+    return type_name, values.astype(dtype)
+
+
+def write_table(path, column_names):
+    data = {}
+    for name in column_names:
+        if name == 'shoebox':
+            # shoeboxes have elements of different sizes
+            data[name] = ['Shoebox<>', [nrows, b'\x01' * 37]]
+        else:
+            type_name, values = column_values(name)
+            data[name] = [type_name, [nrows, values.tobytes()]]
+    table = ['dials::af::reflection_table', 1, {'identifiers': {0: 'test'}, 'nrows': nrows, 'data': data}]
+    with open(path, 'wb') as f:
+        f.write(msgpack.packb(table))
+
+
+def read_table(path):
+    with open(path, 'rb') as f:
+        return msgpack.unpackb(f.read(), strict_map_key=False)
+
+
+def test_write_flagged(tmp_path):
+    source, output = str(tmp_path / 'integrated.refl'), str(tmp_path / 'flagged.refl')
+    write_table(source, _dials_integrated_diamond)
+    parser = DialsParser()
+    parser.smart_read(source)
+    rows = np.arange(nrows) % 4 == 1
+    parser.write_flagged(output, rows)
+    table, original = read_table(output), read_table(source)
+    flags = np.frombuffer(table[2]['data']['flags'][1][1], dtype='<u8')
+    expected = column_values('flags')[1].reshape(-1)
+    np.testing.assert_array_equal(flags, np.where(rows, expected | (1 << 22), expected))
+    assert dials_flags['user_excluded_in_scaling'] == 1 << 22
+    # all other columns are copied unchanged
+    for name in _dials_integrated_diamond:
+        if name != 'flags':
+            assert table[2]['data'][name] == original[2]['data'][name]
+    assert table[2]['nrows'] == nrows
+
+
+def test_write_flagged_drop(tmp_path):
+    source, output = str(tmp_path / 'integrated.refl'), str(tmp_path / 'dropped.refl')
+    write_table(source, _dials_integrated_diamond)
+    parser = DialsParser()
+    parser.smart_read(source)
+    rows = np.arange(nrows) % 3 == 0
+    parser.write_flagged(output, rows, drop=True)
+    table = read_table(output)
+    assert table[2]['nrows'] == np.count_nonzero(~rows)
+    for name in _dials_integrated_diamond:
+        type_name, values = column_values(name)
+        assert table[2]['data'][name][0] == type_name
+        assert table[2]['data'][name][1][0] == np.count_nonzero(~rows)
+        assert table[2]['data'][name][1][1] == values[~rows].tobytes()
+
+
+def test_drop_rejects_variable_size_columns(tmp_path):
+    source, output = str(tmp_path / 'strong.refl'), str(tmp_path / 'dropped.refl')
+    write_table(source, _dials_strong)
+    parser = DialsParser()
+    parser.smart_read(source)
+    with pytest.raises(AssertionError):
+        parser.write_flagged(output, np.arange(nrows) % 2 == 0, drop=True)
+    assert not os.path.exists(output)
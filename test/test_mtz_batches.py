@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('iotbx')
+
+from auspex.ReflectionData.Mtz import MtzParser
+from auspex.ReflectionData.MtzMap import batch_header_dtype
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.mark.parametrize('filename', ['4puc_K.mtz', '5usx.mtz', '8g0s.mtz'])
+def test_merged_data_have_no_batches(filename):
+    parser = MtzParser()
+    parser.read(os.path.join(test_dir, filename))
+    assert parser.get_batch() is None
+    assert parser.get_batch_headers() is None
+    with pytest.raises(ValueError):
+        parser.batch_header_index()
+
+
+def test_batch_header_index():
+    parser = MtzParser()
+    parser._batch = np.array([3, 1, 7, 3, 2], dtype=np.int32)
+    parser._batch_headers = np.zeros(3, dtype=batch_header_dtype)
+    parser._batch_headers['batch'] = [3, 1, 2]
+    np.testing.assert_array_equal(parser.batch_header_index(), [0, 1, -1, 0, 2])
+    # batches without any header
+    parser._batch_headers = np.zeros(0, dtype=batch_header_dtype)
+    np.testing.assert_array_equal(parser.batch_header_index(), [-1, -1, -1, -1, -1])
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+
+from auspex.ReflectionData.MtzMap import MtzMap
+
+# write_filtered computes the resolutions with ReflectionBase, which needs cctbx
+pytest.importorskip('cctbx.miller')
+gemmi = pytest.importorskip('gemmi')
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+mtz_files = [os.path.join(test_dir, _) for _ in ('4puc_K.mtz', '5usx.mtz', '8g0s.mtz')]
+
+
+@pytest.mark.parametrize('filename', mtz_files)
+def test_header_matches_gemmi(filename):
+    mtz_map = MtzMap()
+    mtz_map.read(filename)
+    mtz = gemmi.read_mtz_file(filename)
+    assert mtz_map.nref == mtz.nreflections
+    assert mtz_map.column_labels() == [_.label for _ in mtz.columns]
+    assert mtz_map.column_types() == [_.type for _ in mtz.columns]
+    assert mtz_map.space_group_number == mtz.spacegroup.number
+    np.testing.assert_allclose(mtz_map.cell, mtz.cell.parameters, rtol=1e-6)
+
+
+@pytest.mark.parametrize('filename', mtz_files)
+def test_columns_match_gemmi(filename):
+    mtz_map = MtzMap()
+    mtz_map.read(filename)
+    data = np.asarray(gemmi.read_mtz_file(filename))
+    for idx, label in enumerate(mtz_map.column_labels()):
+        # the mapped columns are views of the raw values, missing values included
+        np.testing.assert_array_equal(mtz_map.column(label), data[:, idx].astype(np.float32))
+    np.testing.assert_array_equal(mtz_map.miller_indices(), data[:, :3].astype(int))
+
+
+def test_extract_substitutes_missing_values():
+    mtz_map = MtzMap()
+    mtz_map.read(mtz_files[0])
+    data = np.asarray(gemmi.read_mtz_file(mtz_files[0]))
+    for idx in range(data.shape[1]):
+        expected = np.nan_to_num(data[:, idx], nan=0.)
+        extracted = mtz_map.extract(idx)
+        assert extracted.dtype == np.float32
+        np.testing.assert_array_equal(extracted, expected.astype(np.float32))
+        assert mtz_map.extract(idx, dtype=np.float64).dtype == np.float64
+
+
+def test_write_filtered_round_trip(tmp_path):
+    mtz = gemmi.read_mtz_file(mtz_files[1])
+    data = np.asarray(mtz)
+    d_spacings = np.asarray(mtz.make_d_array())
+    masks = {str(tmp_path / 'low.mtz'): d_spacings > 3.,
+             str(tmp_path / 'odd.mtz'): np.arange(mtz.nreflections) % 2 == 1}
+    mtz_map = MtzMap()
+    mtz_map.read(mtz_files[1])
+    mtz_map.write_filtered(masks, chunk_size=1000)
+    for filename, keep in masks.items():
+        filtered = gemmi.read_mtz_file(filename)
+        assert filtered.nreflections == np.count_nonzero(keep)
+        np.testing.assert_array_equal(np.asarray(filtered), data[keep])
+        for idx, column in enumerate(filtered.columns):
+            values = data[keep, idx]
+            if np.isnan(values).all():
+                continue
+            assert column.min_value == pytest.approx(np.nanmin(values), rel=1e-6)
+            assert column.max_value == pytest.approx(np.nanmax(values), rel=1e-6)
+        # the RESO record is recomputed from the kept rows
+        assert filtered.resolution_high() == pytest.approx(d_spacings[keep].min(), rel=1e-5)
+        assert filtered.resolution_low() == pytest.approx(d_spacings[keep].max(), rel=1e-5)
+
+
+def test_write_filtered_refuses_source(tmp_path):
+    source = str(tmp_path / 'source.mtz')
+    with open(mtz_files[1], 'rb') as f, open(source, 'wb') as g:
+        g.write(f.read())
+    os.symlink(source, str(tmp_path / 'link.mtz'))
+    mtz_map = MtzMap()
+    mtz_map.read(source)
+    keep = np.arange(mtz_map.nref) % 2 == 0
+    for output in (source, str(tmp_path / 'link.mtz'), str(tmp_path / '.' / 'source.mtz')):
+        with pytest.raises(AssertionError):
+            mtz_map.write_filtered({output: keep})
+    with open(mtz_files[1], 'rb') as f, open(source, 'rb') as g:
+        assert f.read() == g.read()
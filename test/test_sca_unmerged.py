@@ -0,0 +1,81 @@
+import io
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('iotbx')
+
+from auspex.ReflectionData.Sca import ScaUnmergedParser, decode_unmerged_block, read_unmerged_records
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+
+# (6i4,i6,2i2,i3,2f8.1)
+record_format = b'%4d%4d%4d%4d%4d%4d%6d%2d%2d%3d%8.1f%8.1f\n'
+
+
+def skip_symmetry_operators(f):
+    num_operators = int(f.readline().split()[0])
+    for _ in range(2 * num_operators):
+        f.readline()
+
+
+def test_negative_three_digit_indices():
+    block = record_format % (-100, -120, 3, 100, 120, 3, 17, 0, 1, 2, 1234.5, 12.3) \
+        + record_format % (1, -999, 100, 1, 999, 100, 1, 1, 0, 1, -5.0, 2.0)
+    assert b'-100-120' in block
+    hkl, batch, intensities, sigmas = decode_unmerged_block(block)
+    np.testing.assert_array_equal(hkl, [[-100, -120, 3], [1, -999, 100]])
+    np.testing.assert_array_equal(batch, [17, 1])
+    np.testing.assert_array_equal(intensities, [1234.5, -5.])
+    np.testing.assert_array_equal(sigmas, [12.3, 2.])
+
+
+def test_ragged_lines_and_blocks():
+    lines = [record_format % (i - 150, i, -i, 0, 0, 0, i, 0, 0, 1, i * 0.5, 1.) for i in range(200)]
+    # trailing blanks stripped from some lines
+    block = b''.join(_.rstrip() + b'\n' if i % 3 == 0 else _ for i, _ in enumerate(lines))
+    hkl, batch, intensities, sigmas = read_unmerged_records(io.BytesIO(block), chunk_size=1000)
+    np.testing.assert_array_equal(hkl[:, 0], np.arange(200) - 150)
+    np.testing.assert_array_equal(batch, np.arange(200))
+    np.testing.assert_array_equal(intensities, np.arange(200) * 0.5)
+
+
+def test_records_of_test_file():
+    with open(os.path.join(test_dir, 'unmerged.sca'), 'rb') as f:
+        skip_symmetry_operators(f)
+        data_start = f.tell()
+        hkl, batch, intensities, sigmas = read_unmerged_records(f, chunk_size=1 << 16)
+        f.seek(data_start)
+        # the indices of the test file are small enough to be separated by blanks
+        expected = np.loadtxt(f)
+    np.testing.assert_array_equal(hkl, expected[:, :3])
+    np.testing.assert_array_equal(batch, expected[:, 6])
+    np.testing.assert_allclose(intensities, expected[:, 10])
+    np.testing.assert_allclose(sigmas, expected[:, 11])
+
+
+def test_malformed_record():
+    with pytest.raises(AssertionError):
+        decode_unmerged_block(b'not a scalepack record at all\n')
+
+
+def test_merging_statistics_of_test_file():
+    parser = ScaUnmergedParser()
+    parser.read(os.path.join(test_dir, 'unmerged.sca'), (78., 78., 37., 90., 90., 90.), 19)
+    # unmerged data keep the Friedel mates apart, as iotbx does
+    assert parser.anomalous_flag
+    merged = parser.as_miller_array(merge_equivalents=False).merge_equivalents()
+    np.testing.assert_array_equal(parser.get_merged_hkl(), np.array(merged.array().indices()))
+    parser.group_by_redundancies()
+    # each merged reflection is grouped with all its observations
+    redundancies = np.bincount(merged.redundancies().data().as_numpy_array())
+    for obs in parser.intensity_by_multiplicity:
+        redundancy = obs.shape[1] if obs.ndim == 2 else 1
+        assert obs.shape[0] == redundancies[redundancy]
+    assert sum(_.size for _ in parser.intensity_by_multiplicity) == redundancies @ np.arange(redundancies.size)
+    overall = parser.merge_stats_overall()
+    assert overall.num_data_binned == merged.array().size()
+    assert 0. < overall.r_pim_binned < overall.r_merge_binned < overall.r_meas_binned
+    binned = parser.merge_stats_binned()
+    assert np.all(np.isfinite(binned.r_pim_binned))
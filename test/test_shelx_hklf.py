@@ -0,0 +1,77 @@
+import io
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cctbx')
+
+from cctbx import miller
+from cctbx.array_family import flex
+
+from auspex.ReflectionData.Shlex import ShlexParser, decode_hklf_block, read_hklf
+
+# (3I4,2F8.2)
+record_format = b'%4d%4d%4d%8.2f%8.2f\n'
+
+
+def test_fields_running_together():
+    block = record_format % (-100, -100, 100, 123.45, 1.23) + record_format % (-999, 5, -120, -1234.56, 9999.99)
+    assert block.startswith(b'-100-100')
+    hkl, intensities, sigmas = decode_hklf_block(block)
+    np.testing.assert_array_equal(hkl, [[-100, -100, 100], [-999, 5, -120]])
+    np.testing.assert_allclose(intensities, [123.45, -1234.56])
+    np.testing.assert_allclose(sigmas, [1.23, 9999.99])
+
+
+def test_ragged_lines_and_batch_numbers():
+    # a batch number after the record, stripped blanks and windows line endings
+    block = (record_format % (1, 2, 3, 10., 1.)).rstrip(b'\n') + b'   1\n' \
+        + b'   4   5   6   20.00    2.00\r\n' \
+        + b'  -7  -8  -9   30.0     3.0\n'
+    hkl, intensities, sigmas = decode_hklf_block(block)
+    np.testing.assert_array_equal(hkl, [[1, 2, 3], [4, 5, 6], [-7, -8, -9]])
+    np.testing.assert_allclose(intensities, [10., 20., 30.])
+    np.testing.assert_allclose(sigmas, [1., 2., 3.])
+
+
+def test_read_stops_at_terminating_record():
+    records = b''.join(record_format % (h, -h, 2 * h, h * 1.5, 0.5) for h in range(-150, 150) if h != 0)
+    content = records + record_format % (0, 0, 0, 0., 0.) + b'TITL after the data\nHKLF 4\n'
+    hkl, intensities, sigmas = read_hklf(io.BytesIO(content), chunk_size=500)
+    expected_h = np.array([_ for _ in range(-150, 150) if _ != 0])
+    np.testing.assert_array_equal(hkl, np.stack((expected_h, -expected_h, 2 * expected_h), axis=1))
+    np.testing.assert_allclose(intensities, expected_h * 1.5)
+    np.testing.assert_allclose(sigmas, 0.5)
+
+
+def test_no_records():
+    with pytest.raises(RuntimeError):
+        read_hklf(io.BytesIO(record_format % (0, 0, 0, 0., 0.)))
+
+
+def test_merge_matches_cctbx(tmp_path):
+    rng = np.random.default_rng(3)
+    # P212121: symmetry equivalents, Friedel mates, a single observation and sigmas which do not contribute
+    hkl = np.array([[1, 2, 3], [-1, 2, -3], [1, -2, -3], [-1, -2, -3], [1, 2, -3], [2, 0, 1], [0, 3, 4],
+                    [3, 1, 1], [-3, 1, 1], [3, -1, -1], [4, 4, 4]])
+    picked = np.concatenate((np.arange(hkl.shape[0]), rng.choice([0, 1, 2, 3, 4, 6, 7, 8, 9], size=60), [5, 5]))
+    intensities = rng.uniform(-20., 500., size=picked.size).round(2)
+    sigmas = rng.uniform(0.5, 30., size=picked.size).round(2)
+    sigmas[picked == 5] = [0., -1., 4.]
+    sigmas[picked == 10] = 0.
+    filename = str(tmp_path / 'test.hkl')
+    with open(filename, 'wb') as f:
+        f.write(b''.join(record_format % (*hkl[i], v, s) for i, v, s in zip(picked, intensities, sigmas)))
+        f.write(record_format % (0, 0, 0, 0., 0.))
+    parser = ShlexParser()
+    parser.read(filename, (10., 11., 12., 90., 90., 90.), 19)
+    assert parser.miller_set.anomalous_flag()
+    observations = miller.array(miller.set(parser.crystal_symmetry, flex.miller_index(hkl[picked].tolist()),
+                                           anomalous_flag=True),
+                                data=flex.double(intensities), sigmas=flex.double(sigmas))
+    merged = observations.map_to_asu().merge_equivalents().array()
+    expected = {tuple(h): (i, s) for h, i, s in zip(merged.indices(), merged.data(), merged.sigmas())}
+    assert len(expected) == parser._hkl_merged.shape[0]
+    for h, i, s in zip(parser._hkl_merged, parser._I_merged, parser._sigI_merged):
+        assert i == pytest.approx(expected[tuple(h)][0], rel=1e-12, abs=1e-12)
+        assert s == pytest.approx(expected[tuple(h)][1], rel=1e-12, abs=1e-12)
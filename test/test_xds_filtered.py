@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cctbx')
+pytest.importorskip('iotbx')
+
+from auspex.ReflectionData.Xds import XdsParser
+
+header_format = """!FORMAT=XDS_ASCII    MERGE=FALSE    FRIEDEL'S_LAW={0}
+!SPACE_GROUP_NUMBER=    3
+!UNIT_CELL_CONSTANTS=    40.000    50.000    60.000  90.000 100.000  90.000
+!NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD=5
+!ITEM_H=1
+!ITEM_K=2
+!ITEM_L=3
+!ITEM_IOBS=4
+!ITEM_SIGMA(IOBS)=5
+!END_OF_HEADER
+"""
+
+# P2, unique axis b: (h, k, l) and (-h, k, -l) are equivalent, (-h, -k, -l) and (h, -k, l) are their Friedel mates
+indices = [(1, 2, 3), (-1, 2, -3), (-1, -2, -3), (1, -2, 3), (2, 2, 2), (0, 0, 1)]
+
+
+def write_xds_ascii(path, friedels_law: bool, repeats: int = 500):
+    header = header_format.format('TRUE' if friedels_law else 'FALSE').encode('ascii')
+    lines = [b'%6d%6d%6d %10.3E %10.3E\n' % (h, k, l, i + 1., 2.) for i in range(repeats) for h, k, l in indices]
+    with open(path, 'wb') as f:
+        f.write(header + b''.join(lines) + b'!END_OF_DATA\n')
+    return header, lines
+
+
+@pytest.mark.parametrize('friedels_law, removed', [(True, 4), (False, 2)])
+def test_write_filtered(tmp_path, friedels_law, removed):
+    source, output = str(tmp_path / 'XDS_ASCII.HKL'), str(tmp_path / 'filtered.HKL')
+    header, lines = write_xds_ascii(source, friedels_law)
+    num_removed = XdsParser().write_filtered(source, output, np.array([[1, 2, 3]]), chunk_size=4096)
+    assert num_removed == removed * len(lines) // len(indices)
+    with open(output, 'rb') as f:
+        content = f.read()
+    assert content.startswith(header)
+    assert content.endswith(b'\n!END_OF_DATA\n')
+    kept = content[len(header):].splitlines(keepends=True)[:-1]
+    # the kept lines are copied unchanged and in order
+    excluded = set(indices[:removed])
+    assert kept == [_ for _ in lines if tuple(int(v) for v in _.split()[:3]) not in excluded]
+
+
+def test_write_filtered_without_exclusions(tmp_path):
+    source, output = str(tmp_path / 'XDS_ASCII.HKL'), str(tmp_path / 'filtered.HKL')
+    write_xds_ascii(source, True, repeats=10)
+    assert XdsParser().write_filtered(source, output, np.zeros((0, 3), dtype=int)) == 0
+    with open(source, 'rb') as f, open(output, 'rb') as g:
+        assert f.read() == g.read()
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cctbx')
+pytest.importorskip('iotbx')
+
+from cctbx import crystal, miller
+
+from auspex.ReflectionData.Xds import XdsParser
+
+header_format = """!FORMAT=XDS_ASCII    MERGE=FALSE    FRIEDEL'S_LAW={0}
+!SPACE_GROUP_NUMBER=    3
+!UNIT_CELL_CONSTANTS=    40.000    50.000    60.000  90.000 100.000  90.000
+!NUMBER_OF_ITEMS_IN_EACH_DATA_RECORD=6
+!ITEM_H=1
+!ITEM_K=2
+!ITEM_L=3
+!ITEM_IOBS=4
+!ITEM_SIGMA(IOBS)=5
+!ITEM_ZD=6
+!END_OF_HEADER
+"""
+
+stats_names = ['num_data_binned', 'i_mean_binned', 'i_over_sigma_binned', 'completeness_binned', 'redundancy_binned',
+               'r_pim_binned', 'r_merge_binned', 'r_meas_binned', 'cc_half_binned']
+
+
+def write_unmerged(path, friedels_law: bool, num_obs: int = 6000):
+    """Observations of the asymmetric unit and of its Friedel mates, in random order, some with negative sigmas."""
+    rng = np.random.default_rng(7)
+    symmetry = crystal.symmetry((40., 50., 60., 90., 100., 90.), 'P 1 2 1')
+    asu = np.array(miller.build_set(symmetry, anomalous_flag=False, d_min=4.).indices())
+    hkl = np.concatenate((asu, -asu))
+    true_intensities = rng.gamma(2., 100., size=hkl.shape[0])
+    picked = rng.integers(0, hkl.shape[0], size=num_obs)
+    intensities = true_intensities[picked] * (1. + 0.05 * rng.standard_normal(num_obs))
+    sigmas = np.sqrt(np.abs(intensities)) + 1.
+    sigmas[::97] = -1.
+    lines = [b'%6d%6d%6d %10.3E %10.3E %8.1f\n' % (h, k, l, i, s, 1.)
+             for (h, k, l), i, s in zip(hkl[picked], intensities, sigmas)]
+    with open(path, 'wb') as f:
+        f.write(header_format.format('TRUE' if friedels_law else 'FALSE').encode('ascii') + b''.join(lines)
+                + b'!END_OF_DATA\n')
+
+
+@pytest.mark.parametrize('friedels_law', [True, False])
+def test_streaming_matches_in_memory(tmp_path, friedels_law):
+    filename = str(tmp_path / 'XDS_ASCII.HKL')
+    write_unmerged(filename, friedels_law)
+    in_memory = XdsParser()
+    in_memory.read_hkl(filename)
+    in_memory.group_by_redundancies()
+    streamed = XdsParser()
+    streamed.read_hkl(filename, streaming=True)
+    assert streamed.streaming
+    # unmerged data keep the Friedel mates apart, whatever FRIEDEL'S_LAW
+    assert in_memory.anomalous_flag and streamed.anomalous_flag
+    assert in_memory.as_miller_array().anomalous_flag()
+    np.testing.assert_array_equal(np.unique(streamed.get_merged_hkl(), axis=0),
+                                  np.unique(in_memory.get_merged_hkl(), axis=0))
+    for stats in ('merge_stats_overall', 'merge_stats_binned'):
+        expected, actual = getattr(in_memory, stats)(), getattr(streamed, stats)()
+        for name in stats_names:
+            np.testing.assert_allclose(getattr(actual, name), getattr(expected, name), rtol=1e-9, err_msg=name)